@@ -1,8 +1,5 @@
-import numpy as np
-from src.helper import prandtl_meyer_from_mach
-from src.fluidPoint import GenericFlowElement, FluidPoint
-from src.expansionFan import JetExpansionFan
-from src.cluster import GeometryCluster
+from src.sweep import build_jet_cluster
+from src.export import EXPORT_FORMATS
 
 import pathlib
 import os
@@ -26,26 +23,21 @@ atm_pressure = 101325 # Pa
 # NUMERICS
 N_fan = 20  # number of rays in the expansion fan
 N_inlet = 20  # number of inlet points for characteristic propagation
+advance_mode = 'global'  # 'neighbor' only intersects characteristics with their neighbors along the front
+engine = 'geometric'  # 'lattice' marches the first iterations on the structured characteristic lattice
+tolerance = None  # riemann invariant tolerance (rad) for adaptive refinement of the front, None keeps N_fan / N_inlet fixed
 
-pm_angle_inlet = prandtl_meyer_from_mach(Mach_inlet, gamma)
-inlet_conditions = GenericFlowElement(pm_angle_inlet, pm_angle_inlet)
+# OUTPUT
+export_formats = []  # 'npz' and/or 'vtk': also write the net as arrays to the plots dir (see src/export.py)
 
-jef = JetExpansionFan(inlet=inlet_conditions, pressure_ratio=pressure_ratio, origin=(0, jet_width/2), NCHAR=N_fan, gamma=gamma, type=-1, pa=atm_pressure)
-ptot = jef.total_pressure
-
-inlet_points = [ # first point is a boundary!
-    FluidPoint((0, yp), pm_angle_inlet, pm_angle_inlet, gamma=gamma, ptot = ptot,
-               boundary="lower" if yp == 0 else None) for yp in np.linspace(0, jet_width/2, N_inlet, endpoint=False)
-]
-
-inlet_points.extend(jef.characteristic_origins)
-
-gc = GeometryCluster(inlet_points)
+gc = build_jet_cluster(Mach_inlet, pressure_ratio, gamma, N_fan, N_inlet, jet_width=jet_width,
+                       atm_pressure=atm_pressure, advance_mode=advance_mode, engine=engine,
+                       tolerance=tolerance)
 gc.run(printFlag=True, plot_interval=20, max_iter=200, plotkwargs={
     'save' : True,
     'markers' : False,
     'plot_frontline' : True,
-})
+}, exporters=[EXPORT_FORMATS[fmt](plots_dir) for fmt in export_formats])
 
 for attr in ['mach_number', 'pressure']:
     gc.plot_contours(attr, save=True, plot_characteristics=False, plot_frontline=True, plot_boundaries=True)
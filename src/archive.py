@@ -0,0 +1,236 @@
+import json
+import os
+
+import numpy as np
+from src.helper import flow_state
+from src.store import PointStore, CharacteristicStore, NO_INDEX
+
+# rows per chunk file of a ChunkedTable
+CHUNK_SIZE = 2**16
+# float precisions of the archived coordinates and invariants, float32 halves the archive and its page cache.
+# rounding to float32 changes a value by at most 2**-24 of its magnitude (6e-8), i.e. positions by up to
+# 6e-8 * |x| (6e-7 at x = 10) and riemann invariants / flow directions by up to 1.2e-7 rad for angles below 2 rad.
+# flow properties evaluated from archived invariants inherit that through the prandtl-meyer function:
+# |dM| <= |d nu| / (d nu / dM) with d nu / dM = sqrt(M^2 - 1) / (M (1 + (gamma - 1) / 2 M^2)), which is
+# below 1e-6 relative for 1.05 < M < 10 at gamma = 1.4, and p / ptot changes by gamma M / (1 + (gamma - 1) / 2 M^2)
+# times |dM| relative. the march computes with the float64 rows of the stores and reads the archive back only
+# to put back evicted segments (see GeometryCluster._reload_evicted), so the solution is not affected otherwise
+ARCHIVE_PRECISIONS = {'float64': np.float64, 'float32': np.float32}
+
+# columns of the archived dead points and dead characteristic segments,
+# index / origin / end are row indices into the stores of the GeometryCluster that wrote them
+POINT_COLUMNS = dict({'index': np.int64}, **{name: dtype for name, dtype in PointStore.COLUMNS.items() if name != 'flags'})
+SEGMENT_COLUMNS = {
+    'index': np.int64,
+    'origin': np.int64,
+    'end': np.int64,
+    'type': np.int8,
+    'x0': np.float64,
+    'y0': np.float64,
+    'x1': np.float64,
+    'y1': np.float64,
+}
+# FluidPoint attributes derived from the point columns, the array counterparts of the GenericFlowElement
+# properties evaluated by flow_property
+FLOW_FIELDS = ('prandtl_meyer_angle', 'flow_direction', 'mach_number', 'mach_angle', 'gamma_plus_direction',
+               'gamma_minus_direction', 'pressure_over_total_pressure', 'pressure')
+
+
+def _archived_columns(columns, precision, constants=()):
+    # archive layout of POINT_COLUMNS / SEGMENT_COLUMNS: floats in the given precision, constant columns left out
+    dtype = ARCHIVE_PRECISIONS[precision]
+    return {name: dtype if column == np.float64 else column for name, column in columns.items() if name not in constants}
+
+
+def point_columns(store : PointStore, rows):
+    # POINT_COLUMNS of the given rows of a PointStore
+    rows = np.asarray(rows, dtype=np.int64)
+    return dict(index=rows, **{name: store.values(name, rows) for name in POINT_COLUMNS if name != 'index'})
+
+
+def segment_columns(store : CharacteristicStore, rows):
+    # SEGMENT_COLUMNS of the given rows of a CharacteristicStore, end positions are nan without an end point
+    rows = np.asarray(rows, dtype=np.int64)
+    origin = store.values('origin', rows)
+    end = store.values('end', rows)
+    points = store.points
+    no_end = end == NO_INDEX
+    end_rows = np.where(no_end, origin, end)
+    return dict(index=rows, origin=origin, end=end, type=store.values('type', rows),
+                x0=points.values('x', origin), y0=points.values('y', origin),
+                x1=np.where(no_end, np.nan, points.values('x', end_rows)),
+                y1=np.where(no_end, np.nan, points.values('y', end_rows)))
+
+
+def flow_property(columns, name):
+    # a FluidPoint attribute for every row of point columns, stored columns are returned as they are and the
+    # FLOW_FIELDS are evaluated on the whole columns at once (nan for shock points), with helper.flow_state like
+    # the GenericFlowElement properties
+    if name in columns:
+        return np.asarray(columns[name])
+    if name not in FLOW_FIELDS:
+        raise ValueError('unknown flow field {}, expected a point column or one of {}'.format(name, FLOW_FIELDS))
+    v_plus = np.asarray(columns['v_plus'], dtype=np.float64)
+    v_minus = np.asarray(columns['v_minus'], dtype=np.float64)
+    values = np.full(len(v_plus), np.nan)
+    valid = ~(np.isnan(v_plus) | np.isnan(v_minus))
+    v_plus, v_minus = v_plus[valid], v_minus[valid]
+
+    pm = (v_plus + v_minus) / 2
+    fd = (v_minus - v_plus) / 2
+    if name == 'prandtl_meyer_angle':
+        values[valid] = pm
+        return values
+    if name == 'flow_direction':
+        values[valid] = fd
+        return values
+
+    gamma = np.asarray(columns['gamma'], dtype=np.float64)[valid]
+    mach, mu, _, _ = flow_state(pm, fd, gamma)
+    if name == 'mach_number':
+        values[valid] = mach
+    elif name in ('mach_angle', 'gamma_plus_direction', 'gamma_minus_direction'):
+        values[valid] = {'mach_angle': mu, 'gamma_plus_direction': fd + mu, 'gamma_minus_direction': fd - mu}[name]
+    else:
+        ratio = 1 / (1 + (gamma - 1) / 2 * mach**2)**(gamma / (gamma - 1))
+        if name == 'pressure':
+            ratio = ratio * np.asarray(columns['ptot'], dtype=np.float64)[valid]
+        values[valid] = ratio
+    return values
+
+
+class ChunkedTable:
+    # append-only on-disk table, each column is split into .npy chunk files of chunk_size rows
+    # (<directory>/<column>.<k>.npy), only the chunk being written is kept mapped, completed chunks
+    # are memory mapped again on demand when the table is read
+    def __init__(self, directory, columns, chunk_size=CHUNK_SIZE, size=0):
+        self.directory = directory
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.size = size
+        self._open_chunk = None  # (chunk number, {column: writable memmap})
+        os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return self.size
+
+    def _path(self, name, k):
+        return os.path.join(self.directory, '{}.{}.npy'.format(name, k))
+
+    def _writable_chunk(self, k):
+        if self._open_chunk is None or self._open_chunk[0] != k:
+            self.flush()
+            chunk = {}
+            for name, dtype in self.columns.items():
+                path = self._path(name, k)
+                if os.path.exists(path):
+                    chunk[name] = np.load(path, mmap_mode='r+')
+                else:
+                    chunk[name] = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(self.chunk_size,))
+            self._open_chunk = (k, chunk)
+        return self._open_chunk[1]
+
+    def append(self, **values):
+        # append rows given as equally long arrays, one per column
+        n = len(next(iter(values.values())))
+        written = 0
+        while written < n:
+            k, row = divmod(self.size, self.chunk_size)
+            count = min(n - written, self.chunk_size - row)
+            chunk = self._writable_chunk(k)
+            for name in self.columns:
+                chunk[name][row:row + count] = values[name][written:written + count]
+            written += count
+            self.size += count
+
+    def truncate(self, size):
+        # drop the rows after size (they are overwritten by later appends)
+        if size > self.size:
+            raise ValueError('cannot truncate table {} of {} rows to {} rows'.format(self.directory, self.size, size))
+        self.size = size
+
+    def flush(self):
+        if self._open_chunk is not None:
+            for column in self._open_chunk[1].values():
+                column.flush()
+
+    def chunks(self, names=None, start=0):
+        # lazily yield {column: array} for each chunk from row start on, the arrays are read-only memory maps
+        names = list(self.columns) if names is None else names
+        for k in range(start // self.chunk_size, -(-self.size // self.chunk_size)):
+            first = max(start - k * self.chunk_size, 0)
+            rows = min(self.chunk_size, self.size - k * self.chunk_size)
+            if self._open_chunk is not None and self._open_chunk[0] == k:
+                yield {name: self._open_chunk[1][name][first:rows] for name in names}
+            else:
+                yield {name: np.load(self._path(name, k), mmap_mode='r')[first:rows] for name in names}
+
+    def column(self, name):
+        # whole column read into memory
+        chunks = [chunk[name] for chunk in self.chunks([name])]
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=self.columns[name])
+
+
+class NetArchive:
+    # finalized part of a characteristic net (dead points and dead characteristic segments) on disk,
+    # the row counts are kept in <directory>/archive.json so the archive can be reopened
+    # floats are stored in precision (see ARCHIVE_PRECISIONS), point columns listed in constants (e.g. gamma and
+    # ptot of a single jet) are stored once in archive.json and filled back in by point_chunks
+    def __init__(self, directory, chunk_size=CHUNK_SIZE, sizes=None, precision='float64', constants=None):
+        if precision not in ARCHIVE_PRECISIONS:
+            raise ValueError('unknown archive precision {}, expected one of {}'.format(precision, tuple(ARCHIVE_PRECISIONS)))
+        sizes = {} if sizes is None else sizes
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.precision = precision
+        self.constants = {} if constants is None else dict(constants)
+        self.points = ChunkedTable(os.path.join(directory, 'points'),
+                                   _archived_columns(POINT_COLUMNS, precision, self.constants), chunk_size,
+                                   sizes.get('points', 0))
+        self.segments = ChunkedTable(os.path.join(directory, 'segments'), _archived_columns(SEGMENT_COLUMNS, precision),
+                                     chunk_size, sizes.get('segments', 0))
+
+    @classmethod
+    def open(cls, directory):
+        with open(os.path.join(directory, 'archive.json')) as f:
+            meta = json.load(f)
+        return cls(directory, chunk_size=meta['chunk_size'], sizes=meta, precision=meta.get('precision', 'float64'),
+                   constants=meta.get('constants'))
+
+    def point_chunks(self):
+        # points.chunks() with the constant columns filled in (all of POINT_COLUMNS)
+        for chunk in self.points.chunks():
+            for name, value in self.constants.items():
+                chunk[name] = np.full(len(chunk['index']), value, dtype=POINT_COLUMNS[name])
+            yield chunk
+
+    def find_points(self, indices):
+        # POINT_COLUMNS of the archived points with the given (store) indices, in that order
+        indices = np.asarray(indices, dtype=np.int64)
+        found = [{name: column[np.isin(chunk['index'], indices)] for name, column in chunk.items()}
+                 for chunk in self.point_chunks()]
+        columns = {name: np.concatenate([chunk[name] for chunk in found]) for name in POINT_COLUMNS}
+        missing = np.setdiff1d(indices, columns['index'])
+        if len(missing):
+            raise KeyError('points {} are not archived'.format(missing))
+        order = np.argsort(columns['index'])
+        position = order[np.searchsorted(columns['index'], indices, sorter=order)]
+        return {name: column[position] for name, column in columns.items()}
+
+    def append_points(self, store : PointStore, rows):
+        columns = point_columns(store, rows)
+        for name, value in self.constants.items():
+            if not np.all(columns[name] == value):
+                raise ValueError('archived column {} is not constant ({}) any more'.format(name, value))
+        self.points.append(**columns)
+
+    def append_segments(self, store : CharacteristicStore, rows):
+        self.segments.append(**segment_columns(store, rows))
+
+    def flush(self):
+        self.points.flush()
+        self.segments.flush()
+        meta = {'chunk_size': self.chunk_size, 'points': self.points.size, 'segments': self.segments.size,
+                'precision': self.precision, 'constants': self.constants}
+        with open(os.path.join(self.directory, 'archive.json'), 'w') as f:
+            json.dump(meta, f)
@@ -0,0 +1,224 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from src.helper import mach_from_prandtl_meyer, prandtl_meyer_max
+from src.sweep import build_jet_cluster
+
+# problem sizes (N_fan = N_inlet) benchmarked by default
+DEFAULT_SIZES = [5, 10, 20, 40]
+# iterations timed by the advance_frontline benchmark
+ADVANCE_ITERATIONS = 20
+# relative slowdown flagged as a regression by compare
+DEFAULT_THRESHOLD = 0.2
+# the headless solver core timed by the import benchmark, and the packages it must not load (plotting, and the
+# worker pools of the opt-in parallel search and async plots)
+CORE_MODULE = 'src.cluster'
+PLOTTING_PACKAGES = ('matplotlib', 'scipy')
+WORKER_PACKAGES = ('multiprocessing', 'concurrent')
+# fresh interpreters the import benchmark averages over
+IMPORT_INTERPRETERS = 10
+
+
+def _quiet():
+    # GeometryCluster.run prints every iteration
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def bench_prandtl_meyer(n):
+    # scalar inverse prandtl-meyer calls, 100 * n of them
+    pm = np.linspace(0.01, 0.9 * prandtl_meyer_max(1.4), 100 * n)
+    start = time.perf_counter()
+    for value in pm:
+        mach_from_prandtl_meyer(value, 1.4)
+    return time.perf_counter() - start, len(pm)
+
+
+def bench_characteristic_mul(n):
+    # Characteristic.__mul__ over every ordered pair of the initial frontline characteristics
+    gc = build_jet_cluster(2.5, 2.0, 1.4, n, n)
+    chars = gc.frontline_characteristics
+    start = time.perf_counter()
+    for a in chars:
+        for b in chars:
+            a * b
+    return time.perf_counter() - start, len(chars) ** 2
+
+
+def bench_advance_frontline(n):
+    # first ADVANCE_ITERATIONS calls of advance_frontline
+    gc = build_jet_cluster(2.5, 2.0, 1.4, n, n)
+    start = time.perf_counter()
+    with _quiet():
+        for _ in range(ADVANCE_ITERATIONS):
+            if gc.advance_frontline():
+                break
+            gc.iter += 1
+    return time.perf_counter() - start, max(gc.iter, 1)
+
+
+def bench_run(n):
+    # full GeometryCluster.run until the march stops
+    gc = build_jet_cluster(2.5, 2.0, 1.4, n, n)
+    start = time.perf_counter()
+    with _quiet():
+        gc.run(max_iter=100000)
+    return time.perf_counter() - start, gc.iter
+
+
+def bench_plot_contours(n):
+    # plot_contours of the mach number after a full run, saved to a temporary directory
+    import matplotlib
+    matplotlib.use('Agg')
+    with tempfile.TemporaryDirectory() as output_dir:
+        gc = build_jet_cluster(2.5, 2.0, 1.4, n, n, output_dir=output_dir)
+        with _quiet():
+            gc.run(max_iter=100000)
+        start = time.perf_counter()
+        gc.plot_contours('mach_number', save=True, plot_characteristics=False)
+        return time.perf_counter() - start, 1
+
+
+def bench_import(interpreters=IMPORT_INTERPRETERS):
+    # mean cumulative import time of CORE_MODULE (as reported by -X importtime) over fresh interpreters,
+    # fails if importing it loads any of PLOTTING_PACKAGES or WORKER_PACKAGES
+    check = 'import sys, {}; loaded = {{m.split(".")[0] for m in sys.modules}} & {}; assert not loaded, loaded'.format(
+        CORE_MODULE, set(PLOTTING_PACKAGES + WORKER_PACKAGES))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    total = 0.0
+    for _ in range(interpreters):
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', check], cwd=root, capture_output=True,
+                                 text=True, check=True)
+        line = next(line for line in process.stderr.splitlines() if line.split('|')[-1].strip() == CORE_MODULE)
+        total += int(line.split('|')[1]) * 1e-6
+    return total / interpreters, interpreters
+
+
+# benchmarks timed at every problem size, bench(n) -> (time, operations)
+BENCHMARKS = {
+    'prandtl_meyer': bench_prandtl_meyer,
+    'characteristic_mul': bench_characteristic_mul,
+    'advance_frontline': bench_advance_frontline,
+    'run': bench_run,
+    'plot_contours': bench_plot_contours,
+}
+# benchmarks independent of the problem size, bench() -> (time, samples), kept out of the size / exponent matrix
+FIXED_BENCHMARKS = {
+    'import': bench_import,
+}
+
+
+def scaling_exponent(sizes, times):
+    # slope of log(time) over log(size), i.e. time ~ size ** exponent
+    if len(sizes) < 2:
+        return None
+    return float(np.polyfit(np.log(sizes), np.log(times), 1)[0])
+
+
+def run_benchmarks(names, sizes, repeats=3):
+    # best of repeats wall time of every benchmark and size, with throughput and scaling exponent,
+    # FIXED_BENCHMARKS are timed once per repeat
+    results = {}
+    for name in names:
+        if name in FIXED_BENCHMARKS:
+            best, samples = min(FIXED_BENCHMARKS[name]() for _ in range(repeats))
+            print('{:<20} {:<7} {:10.4f} s  (mean of {})'.format(name, '', best, samples))
+            results[name] = {'time': best, 'samples': samples}
+            continue
+        times, throughput = [], []
+        for n in sizes:
+            best, count = min(BENCHMARKS[name](n) for _ in range(repeats))
+            times.append(best)
+            throughput.append(count / best)
+            print('{:<20} {:<7} {:10.4f} s  {:12.1f} ops/s'.format(name, 'N={}'.format(n), best, count / best))
+        results[name] = {
+            'sizes': list(sizes),
+            'times': times,
+            'throughput': throughput,
+            'exponent': scaling_exponent(sizes, times),
+        }
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'repeats': repeats,
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    # list of (benchmark, size, baseline time, current time, ratio, regressed) for the sizes both runs share
+    # (size is None for FIXED_BENCHMARKS)
+    rows = []
+    for name, base in baseline['results'].items():
+        if name not in current['results']:
+            continue
+        now = current['results'][name]
+        if ('time' in base) != ('time' in now):
+            continue  # timed per size in one run and once in the other (old baselines time the import per size), skipped
+        if 'time' in base:
+            ratio = now['time'] / base['time']
+            rows.append((name, None, base['time'], now['time'], ratio, ratio > 1 + threshold))
+            continue
+        base_times = dict(zip(base['sizes'], base['times']))
+        for n, t in zip(now['sizes'], now['times']):
+            if n in base_times:
+                ratio = t / base_times[n]
+                rows.append((name, n, base_times[n], t, ratio, ratio > 1 + threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='solver benchmarks with scaling exponents and baseline comparison')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run benchmarks and write a json baseline')
+    run_parser.add_argument('-o', '--output', default=None, help='json file to write the results to')
+    run_parser.add_argument('-b', '--bench', nargs='+', choices=list(BENCHMARKS) + list(FIXED_BENCHMARKS),
+                            default=list(BENCHMARKS) + list(FIXED_BENCHMARKS))
+    run_parser.add_argument('-n', '--sizes', nargs='+', type=int, default=DEFAULT_SIZES, help='N_fan = N_inlet values')
+    run_parser.add_argument('-r', '--repeats', type=int, default=3)
+
+    compare_parser = commands.add_parser('compare', help='compare two json results and flag regressions')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('-t', '--threshold', type=float, default=DEFAULT_THRESHOLD,
+                                help='relative slowdown flagged as a regression')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        results = run_benchmarks(args.bench, args.sizes, args.repeats)
+        for name, result in results['results'].items():
+            if result.get('exponent') is not None:
+                print('{:<20} scaling exponent {:.2f}'.format(name, result['exponent']))
+        if args.output is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows = compare(baseline, current, args.threshold)
+    for name, n, base, now, ratio, regressed in rows:
+        print('{:<20} {:<7} {:10.4f} s -> {:10.4f} s  x{:5.2f}{}'.format(
+            name, '' if n is None else 'N={}'.format(n), base, now, ratio, '  REGRESSION' if regressed else ''))
+    regressions = sum(row[-1] for row in rows)
+    print('{} regression(s) beyond {:.0%}'.format(regressions, args.threshold))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,28 +1,269 @@
+import math
+
 import numpy as np
 from src.fluidPoint import FluidPoint
+from src.store import NO_INDEX
+
+# pairs closer than this (distance squared) are treated as coincident and never intersected
+COINCIDENT_TOL = 1e-10
+# determinant threshold of the 2x2 intersection system. NOTE: like the original np.linalg based
+# solve, pairs with a negative determinant are rejected too, i.e. only pairs where the direction of
+# the first characteristic lies counter-clockwise of the second one intersect
+DET_TOL = 1e-10
+# number of (row x column) pairs evaluated at once by nearest_intersections
+PAIR_BLOCK_SIZE = 2**20
+# number of target rows sharing one direction-pruned candidate set in nearest_intersections
+PRUNED_ROW_BLOCK = 64
+
+
+def _intersect_ray_pair(x1, y1, theta1, x2, y2, theta2):
+    # closed-form solution of (x1, y1) + t * dir1 = (x2, y2) + u * dir2, returns the position or None
+    d1x, d1y = math.cos(theta1), math.sin(theta1)
+    d2x, d2y = math.cos(theta2), math.sin(theta2)
+    det = d2x * d1y - d1x * d2y
+    if det < DET_TOL:
+        return None
+    t = (d2x * (y2 - y1) - d2y * (x2 - x1)) / det
+    return (x1 + t * d1x, y1 + t * d1y)
+
+
+def intersect_rays(x1, y1, theta1, x2, y2, theta2):
+    # vectorized counterpart of Characteristic.__mul__ geometry, all arguments broadcast against each other
+    # returns the intersection coordinates and a mask of pairs that intersect at all
+    # (non-coincident origins, determinant above DET_TOL); coordinates outside the mask are meaningless
+    d1x, d1y = np.cos(theta1), np.sin(theta1)
+    d2x, d2y = np.cos(theta2), np.sin(theta2)
+    dx = x2 - x1
+    dy = y2 - y1
+    det = d2x * d1y - d1x * d2y
+    hit = (det >= DET_TOL) & (dx**2 + dy**2 >= COINCIDENT_TOL)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(hit, (d2x * dy - d2y * dx) / np.where(hit, det, 1.0), 0.0)
+    return x1 + t * d1x, y1 + t * d1y, hit
+
+
+class RayArrays:
+    # origin coordinates, directions and origin flow direction (cos, sin) of a sequence of characteristics,
+    # the input of the batched intersection kernels
+    __slots__ = ('characteristics', 'x', 'y', 'direction', 'cos_flow', 'sin_flow')
+
+    def __init__(self, characteristics):
+        self.characteristics = list(characteristics)
+        n = len(self.characteristics)
+        self.x = np.empty(n)
+        self.y = np.empty(n)
+        self.direction = np.empty(n)
+        self.cos_flow = np.empty(n)
+        self.sin_flow = np.empty(n)
+        for i, char in enumerate(self.characteristics):
+            origin = char.origin
+            self.x[i], self.y[i] = origin.pos
+            self.direction[i] = char.direction
+            _, _, _, _, self.cos_flow[i], self.sin_flow[i] = origin._derived_state()
+
+    def __len__(self):
+        return len(self.characteristics)
+
+    @classmethod
+    def _from_columns(cls, characteristics, columns):
+        rays = cls.__new__(cls)
+        rays.characteristics = characteristics
+        rays.x, rays.y, rays.direction, rays.cos_flow, rays.sin_flow = columns
+        return rays
+
+    def take(self, rows):
+        # RayArrays of the characteristics in rows (an index array), without recomputing their columns
+        rows = np.asarray(rows, dtype=np.int64)
+        return self._from_columns([self.characteristics[i] for i in rows],
+                                  [column[rows] for column in (self.x, self.y, self.direction, self.cos_flow, self.sin_flow)])
+
+    @classmethod
+    def concatenate(cls, parts):
+        return cls._from_columns([char for part in parts for char in part.characteristics],
+                                 [np.concatenate([getattr(part, name) for part in parts])
+                                  for name in ('x', 'y', 'direction', 'cos_flow', 'sin_flow')])
+
+    def forward_distance(self, x, y, rows=slice(None)):
+        # flow_direction_dot_product of the origins in rows towards the points (x, y)
+        return self.cos_flow[rows] * (x - self.x[rows]) + self.sin_flow[rows] * (y - self.y[rows])
+
+
+def nearest_intersections(targets : RayArrays, candidates : RayArrays, rows=None):
+    # for each target characteristic c (optionally only the indices in rows), find the candidate g
+    # for which g * c lies ahead of both origins and is closest to c.origin in flow direction
+    # returns (index into candidates or -1, flow distance) per target row; ties go to the lowest index,
+    # which matches the stable sort in GeometryCluster.find_first_intersection
+    rows = np.arange(len(targets)) if rows is None else np.asarray(rows)
+    best = np.full(len(rows), -1, dtype=np.int64)
+    best_distance = np.full(len(rows), np.inf)
+    if len(candidates) == 0 or len(rows) == 0:
+        return best, best_distance
+
+    # g * c needs sin(g.direction - c.direction) >= DET_TOL; if all directions lie within an interval
+    # shorter than pi, that means g.direction > c.direction, so targets are processed in order of direction
+    # and each block only against the candidates pointing counter-clockwise of its lowest direction
+    target_direction = targets.direction[rows]
+    if np.ptp(np.concatenate((candidates.direction, target_direction))) < np.pi:
+        row_order = np.argsort(target_direction, kind='stable')
+        candidate_order = np.argsort(candidates.direction, kind='stable')
+        candidate_direction = candidates.direction[candidate_order]
+        block = max(1, min(PRUNED_ROW_BLOCK, PAIR_BLOCK_SIZE // len(candidates)))
+    else:
+        row_order = np.arange(len(rows))
+        candidate_order = None
+        block = max(1, PAIR_BLOCK_SIZE // len(candidates))
+
+    for start in range(0, len(rows), block):
+        b = row_order[start:start + block]
+        r = rows[b]
+        if candidate_order is None:
+            c = slice(None)
+        else:
+            first = np.searchsorted(candidate_direction, target_direction[b].min(), side='right')
+            c = np.sort(candidate_order[first:])  # keep candidate index order for the tie-break
+            if len(c) == 0:
+                continue
+        # candidates are the first operand (g * c), targets the second
+        x, y, hit = intersect_rays(candidates.x[None, c], candidates.y[None, c], candidates.direction[None, c],
+                                   targets.x[r, None], targets.y[r, None], targets.direction[r, None])
+        distance = targets.forward_distance(x, y, (r, None))
+        valid = hit & (distance > 0) & (candidates.forward_distance(x, y, (None, c)) > 0)
+        distance = np.where(valid, distance, np.inf)
+        index = np.argmin(distance, axis=1)
+        d = distance[np.arange(len(r)), index]
+        found = np.isfinite(d)
+        index = index if candidate_order is None else c[index]
+        best[b] = np.where(found, index, -1)
+        best_distance[b] = d
+    return best, best_distance
+
+
+def nearest_intersections_among(targets : RayArrays, candidates : RayArrays, candidate_index, return_all=False):
+    # like nearest_intersections, but target row i only considers the candidates listed in
+    # candidate_index[i] (an (n_targets, k) integer array, entries < 0 are padding)
+    # returns (index into candidates or -1, flow distance) per target row, and with return_all=True
+    # also the (n_targets, k) flow distances of all hits from the target and from the candidate origins
+    # (inf where there is no valid hit)
+    candidate_index = np.asarray(candidate_index, dtype=np.int64)
+    n = len(targets)
+    best = np.full(n, -1, dtype=np.int64)
+    best_distance = np.full(n, np.inf)
+    if n == 0 or candidate_index.shape[1] == 0:
+        if return_all:
+            return best, best_distance, np.full(candidate_index.shape, np.inf), np.full(candidate_index.shape, np.inf)
+        return best, best_distance
+
+    padding = candidate_index < 0
+    c = np.where(padding, 0, candidate_index)
+    x, y, hit = intersect_rays(candidates.x[c], candidates.y[c], candidates.direction[c],
+                               targets.x[:, None], targets.y[:, None], targets.direction[:, None])
+    distance = targets.forward_distance(x, y, (slice(None), None))
+    candidate_distance = candidates.cos_flow[c] * (x - candidates.x[c]) + candidates.sin_flow[c] * (y - candidates.y[c])
+    valid = hit & ~padding & (distance > 0) & (candidate_distance > 0)
+    distance = np.where(valid, distance, np.inf)
+    k = np.argmin(distance, axis=1)
+    d = distance[np.arange(n), k]
+    found = np.isfinite(d)
+    best[found] = candidate_index[np.arange(n), k][found]
+    best_distance[found] = d[found]
+    if return_all:
+        return best, best_distance, distance, np.where(valid, candidate_distance, np.inf)
+    return best, best_distance
+
 
 class Characteristic(): # a characteristic class
+    # like FluidPoint, a characteristic is either detached or a view into a CharacteristicStore row,
+    # GeometryCluster attaches characteristics once they are dead (have a final end point)
+    __slots__ = ('_origin', '_type', '_direction', '_end', 'frontline_complement', '_store', '_index')
+
     def __init__(self, origin : FluidPoint, type):
 
-        # a fluid point acting as the origin, defines the invariant, direction, and position of characteristic.
-        self.origin = origin
-        self.type = type  # 1 - gamma+, -1 - gamma-, 0 - flow direction
+        self._store = None
+        self._index = NO_INDEX
 
-        self.gamma = origin.gamma
-        self.ptot = origin.ptot
+        # a fluid point acting as the origin, defines the invariant, direction, and position of characteristic.
+        self._origin = origin
+        self._type = type  # 1 - gamma+, -1 - gamma-, 0 - flow direction
 
         match type:
             case 1:
-                self.direction = origin.gamma_plus_direction
+                self._direction = origin.gamma_plus_direction
             case -1:
-                self.direction = origin.gamma_minus_direction
+                self._direction = origin.gamma_minus_direction
             case 0:
-                self.direction = origin.flow_direction
+                self._direction = origin.flow_direction
 
-        self.end = None
+        self._end = None
 
         self.frontline_complement = None  # cache container
 
+    def attach(self, store):
+        # move the characteristic into a CharacteristicStore row, origin and end are attached to its point store
+        if self._store is not None:
+            if self._store is not store:
+                raise ValueError('characteristic is already attached to a different store')
+            return self._index
+
+        origin = self._origin.attach(store.points)
+        end = NO_INDEX if self._end is None else self._end.attach(store.points)
+        self._index = store.add(self, origin, end, self._type, self._direction)
+        self._store = store
+        self._origin = self._end = self._direction = None
+        return self._index
+
+    @classmethod
+    def view(cls, store, index):
+        # attached characteristic for an existing CharacteristicStore row (see ColumnStore.object)
+        char = cls.__new__(cls)
+        char._store = store
+        char._index = index
+        char._type = int(store.get('type', index))
+        char._origin = char._end = char._direction = None
+        char.frontline_complement = None
+        return char
+
+    @property
+    def store_index(self):
+        return self._index
+
+    @property
+    def origin(self):
+        if self._store is None:
+            return self._origin
+        return self._store.points.object(self._store.get('origin', self._index))
+
+    @property
+    def type(self):
+        return self._type
+
+    @property
+    def direction(self):
+        if self._store is None:
+            return self._direction
+        return float(self._store.get('direction', self._index))
+
+    @property
+    def end(self):
+        if self._store is None:
+            return self._end
+        end = self._store.get('end', self._index)
+        return None if end == NO_INDEX else self._store.points.object(end)
+
+    @end.setter
+    def end(self, point):
+        if self._store is None:
+            self._end = point
+        else:
+            self._store.set('end', self._index, NO_INDEX if point is None else point.attach(self._store.points))
+
+    @property
+    def gamma(self):
+        return self.origin.gamma
+
+    @property
+    def ptot(self):
+        return self.origin.ptot
+
     @property
     def measure(self):  # flow direction distance of the characteristic from origin to end
         if self.end is None:
@@ -31,6 +272,17 @@ class Characteristic(): # a characteristic class
             return self.origin.flow_direction_dot_product(self.end)
 
 
+    @property
+    def origin_bool(self):
+        # whether the origin already shot a characteristic of this type (set by update_bool_of_origin)
+        match self.type:
+            case 1:
+                return self.origin._gamma_plus_bool
+            case -1:
+                return self.origin._gamma_minus_bool
+            case 0:
+                return self.origin._gamma_zero_bool
+
     def update_bool_of_origin(self):
         match self.type:
             case 1:
@@ -41,40 +293,43 @@ class Characteristic(): # a characteristic class
                 self.origin._gamma_zero_bool = True
 
 
+    def intersect_many(self, others, forward=True):
+        # batched `other * self` for every characteristic in others (a sequence or RayArrays)
+        # returns an (n, 2) array of intersection positions and a mask of valid hits; with forward=True
+        # hits behind self.origin or other.origin (in their flow direction) are masked out as well
+        if not isinstance(others, RayArrays):
+            others = RayArrays(others)
+        x1, y1 = self.origin.pos
+        x, y, hit = intersect_rays(others.x, others.y, others.direction, x1, y1, self.direction)
+        if forward:
+            hit &= (self.origin.flow_direction_dot_product_many(x, y) > 0) & (others.forward_distance(x, y) > 0)
+        return np.column_stack((x, y)), hit
+
+    def first_intersection(self, others):
+        # closest valid intersection `other * self` ahead of both origins, returns (point, other) or (None, None)
+        if not isinstance(others, RayArrays):
+            others = RayArrays(others)
+        index, _ = nearest_intersections(RayArrays([self]), others)
+        if index[0] < 0:
+            return None, None
+        other = others.characteristics[index[0]]
+        return other * self, other
+
     def __mul__(self, other) -> [FluidPoint, None]:
         # multiplication of two characteristics
         # defined as the intersection point!
 
-        if self.origin * other.origin < 1e-10: # ignore coincident points!
+        if self.origin * other.origin < COINCIDENT_TOL: # ignore coincident points!
             return None
 
         # Unpack origin points
         x1, y1 = self.origin.pos
         x2, y2 = other.origin.pos
 
-        theta1 = self.direction
-        theta2 = other.direction
-
-        # Direction vectors for both lines
-        dir1 = np.array([np.cos(theta1), np.sin(theta1)])
-        dir2 = np.array([np.cos(theta2), np.sin(theta2)])
-
-        # Set up the system of linear equations A * [t, u]^T = b
-        A = np.array([[dir1[0], -dir2[0]],
-                      [dir1[1], -dir2[1]]])
-
-        b = np.array([x2 - x1, y2 - y1])
-
-        # Check if the determinant is zero (lines are parallel)
-        if np.abs(np.linalg.det(A) < 1e-10):
+        position = _intersect_ray_pair(x1, y1, self.direction, x2, y2, other.direction)
+        if position is None:
             return None  # No intersection, lines are parallel
 
-        # Solve for t and u
-        t, u = np.linalg.solve(A, b)
-
-        # Compute the intersection point using the parametric equation of the first line
-        position = tuple(np.array([x1, y1]) + t * dir1)
-
         if self.type == other.type: # intersection of characteristics of the same type
             return FluidPoint(position, None, None, gamma=self.gamma, ptot = self.ptot)
 
@@ -1,41 +1,293 @@
 import os
+import time
+import tracemalloc
 
-import matplotlib.pyplot as plt
-import matplotlib
 import numpy as np
-from src.characteristic import Characteristic
-from src.fluidPoint import FluidPoint, GenericFlowElement
+from src.characteristic import Characteristic, RayArrays, intersect_rays, nearest_intersections, nearest_intersections_among
+from src.fluidPoint import FluidPoint, GenericFlowElement, BOUNDARY_FLAGS, derive_flow_state
+from src.store import PointStore, CharacteristicStore, NO_INDEX
+from src.spatial import SegmentGrid, unreachable_segments
+from src.archive import NetArchive, point_columns, segment_columns, flow_property
+from src.metrics import new_record
+from src.query import FieldQuery
+from src.lattice import LatticeMarch
+from src.plotting import render_geometry, draw_segments, save_or_show, DEFAULT_QUEUE_SIZE, DEFAULT_LEVELS, PLOT_FORMATS
+
+# frontline advancement modes
+ADVANCE_MODES = ('global', 'neighbor')
+# marching engines, see GeometryCluster.__init__
+ENGINES = ('geometric', 'lattice')
+# storage modes of the solved net (see GeometryCluster.__init__) and the precision of their on-disk archive
+STORAGE_MODES = {'full': 'float64', 'compact': 'float32'}
+# point columns hoisted to the cluster in compact storage when every point shares their value
+HOISTED_COLUMNS = ('gamma', 'ptot')
+# streaming: the stores are compacted once they hold this many rows, and again each time they doubled since (or
+# grew by this many rows if nothing could be dropped)
+COMPACT_ROWS = 4096
+# tie order of frontline characteristics starting at the same x, by family
+FRONTLINE_FAMILY_ORDER = {1: 0, -1: 1, 0: 2}
+# the family and store index of a frontline characteristic are combined into one tie key, family * FAMILY_STRIDE + index
+FAMILY_STRIDE = 2**48
+# layout version of the checkpoint files written by GeometryCluster.save_checkpoint
+CHECKPOINT_VERSION = 8
+
+# adaptive frontline refinement (see GeometryCluster.adapt_frontline), spacings are in units of the reference spacing
+REFINE_SPACING = 5.0  # gaps of the front wider than this are refined regardless of the invariants
+COARSEN_SPACING = 2.0  # points are only merged away if the gap they leave is at most this wide
+COARSEN_FRACTION = 0.25  # ... and the invariants across that gap differ by at most this fraction of the tolerance
+NEIGHBOR_SPACING = 10.0  # arc neighbors further apart than this are not treated as a gap of the front
+
+
+def _refined_boundary(a, b):
+    # boundary flag of a point interpolated between frontline points with boundaries a and b,
+    # inside a centered fan it shoots the same single family as the fan rays, otherwise it is an interior point
+    for one_family, edge in (('minus_only', 'upper'), ('plus_only', 'lower')):
+        if one_family in (a, b) and {a, b} <= {one_family, edge}:
+            return one_family
+    return None
+
+def _tie_keys(characteristics):
+    # tie keys of frontline characteristics starting at the same x: family order, then point order in the store
+    return np.array([FRONTLINE_FAMILY_ORDER[char.type] * FAMILY_STRIDE + char.origin.store_index
+                     for char in characteristics], dtype=np.int64)
+
+def _merge_positions(x, key, new_x, new_key):
+    # positions in the merged sequence of rows (new_x, new_key) merged into rows (x, key), both sorted by (x, key):
+    # a binary search in x, and among the (few) rows of equal x one in key
+    position = np.searchsorted(x, new_x, side='left')
+    end = np.searchsorted(x, new_x, side='right')
+    for i in np.flatnonzero(end > position):
+        position[i] += np.searchsorted(key[position[i]:end[i]], new_key[i])
+    return position + np.arange(len(new_x))
+
+def region_of_interest(x_station=None):
+    # (xmin, ymin, xmax, ymax) the march is confined to, from a downstream x station, or None for an unbounded march.
+    # only a downstream limit can confine the march: the forward characteristics of a point above, below or upstream
+    # of a box can still reach it, so only points past xmax are retired (see retire_outside)
+    if x_station is None:
+        return None
+    return -np.inf, -np.inf, float(x_station), np.inf
 
 class GeometryCluster:
-    def __init__(self, init_points):
+    def __init__(self, init_points, advance_mode='global', neighbor_window=4, output_dir=None, archive_dir=None,
+                 eviction=True, tolerance=None, spacing=None, engine='geometric', storage='full'):
+
+        # 'global' tests every frontline characteristic against every other one,
+        # 'neighbor' only against the neighbor_window nearest characteristics on either side along the front,
+        # falling back to the global search where the local result is inconclusive (same march as 'global')
+        if advance_mode not in ADVANCE_MODES:
+            raise ValueError('unknown advance mode {}, expected one of {}'.format(advance_mode, ADVANCE_MODES))
+        self.advance_mode = advance_mode
+        self.neighbor_window = neighbor_window
+        # 'lattice' marches the first iterations of a jet (see sweep.build_jet_cluster) on the structured
+        # characteristic lattice, a whole iteration per vectorized step, and hands over to the geometric
+        # search as soon as the lattice no longer describes the net (see lattice.LatticeMarch for the gain)
+        if engine not in ENGINES:
+            raise ValueError('unknown engine {}, expected one of {}'.format(engine, ENGINES))
+        self.engine = engine
+        self.output_dir = output_dir # directory saved plots go to, defaults to plots/ in the current directory
+
+        # struct-of-arrays storage of every point and dead characteristic of the net,
+        # the FluidPoint and Characteristic objects held below are views into it
+        self.points = PointStore(view=FluidPoint.view)
+        self.characteristics = CharacteristicStore(self.points, view=Characteristic.view)
+        for p in init_points:
+            p.attach(self.points)
 
         self.frontline_points = init_points # init points should be an iterable (ideally a set)
+        # position of each frontline point along the arc of the front, init points are assumed to be
+        # passed in arc order (e.g. lower boundary to upper boundary)
+        self._arc_rank = {p: i for i, p in enumerate(init_points)}
         self.frontline_characteristics = []
+        self._frontline_rays = RayArrays([])
+        self._frontline_keys = np.empty(0, dtype=np.int64)  # tie keys (see _tie_keys) of the frontline rays
         self.get_frontline_characteristics()
 
+        # adaptive refinement: with a tolerance (on the riemann invariants, in radians) frontline points are
+        # inserted or merged away after every iteration, see adapt_frontline. the reference spacing defaults
+        # to the median distance between neighboring init points (init_points may be any iterable)
+        self.tolerance = tolerance
+        if spacing is None and tolerance is not None:
+            ordered = list(init_points)
+            gaps = [p * q for p, q in zip(ordered[:-1], ordered[1:])]
+            gaps = np.sqrt([gap for gap in gaps if gap > 0])
+            spacing = float(np.median(gaps)) if len(gaps) else None
+        self.spacing = spacing
+
         self.dead_points = set({})
         self.dead_characteristics = set({})
+        self._dead_rows = []  # store rows of dead_characteristics in order of death
+        self._dead_index = SegmentGrid(self.characteristics) # spatial index over dead_characteristics
+        self.shock_points = []
+
+        # with eviction, dead characteristics ending upstream of the whole frontline are taken out of the
+        # dead segment search (see evict_unreachable), they are kept in dead_characteristics or the archive
+        self.eviction = eviction
+        self._evicted_bound = -np.inf
+        self._evicted_ids = np.empty(0, dtype=np.int64)
+        self._evicted_x1 = np.empty(0)
+        # bounded segments out of reach of the current frontline characteristics are taken out of the search too,
+        # they are kept here and put back as soon as the frontline could reach them (see _evict_dead_segments)
+        self._shadowed_ids = np.empty(0, dtype=np.int64)
+
+        # streaming mode: with archive_dir set, dead points and characteristics are appended to an on-disk
+        # NetArchive as they are finalized instead of being collected in dead_points / dead_characteristics
+        # storage='compact' (streaming only) archives them in float32 (see archive.ARCHIVE_PRECISIONS for the error
+        # bounds) and keeps gamma and ptot, constant across a jet, once per cluster instead of once per point.
+        # this halves the archive on disk (and in the page cache), the resident memory hardly changes (N = 60:
+        # 7.06 MB against 7.17 MB streaming with storage='full'): the stores stay float64, as the searchable dead
+        # segments and the frontline are what the march computes with (in float32 the solution would change), and
+        # what keeps resident memory bounded is streaming itself, which drops the archived rows nothing refers to
+        # any more from the stores (see _compact_stores)
+        if storage not in STORAGE_MODES:
+            raise ValueError('unknown storage mode {}, expected one of {}'.format(storage, tuple(STORAGE_MODES)))
+        if storage == 'compact' and archive_dir is None:
+            raise ValueError('compact storage streams the solved net to an archive, archive_dir is required')
+        self.storage = storage
+        if storage == 'compact':
+            for name in HOISTED_COLUMNS:
+                self.points.hoist(name)
+        self.archive = None if archive_dir is None else NetArchive(archive_dir, precision=STORAGE_MODES[storage],
+                                                                    constants=self.points.constants)
+        # streaming also drops the archived rows nothing resident refers to any more from the point and
+        # characteristic stores (see _compact_stores), the furthest x they reached is kept for reach
+        self._dropped_reach = -np.inf
+        self._compact_at = COMPACT_ROWS  # resident rows of the larger store that trigger the next compaction
+        self._exporters = ()  # exporters of the current run, the rows they have not written yet stay resident
 
         self.iter = 0
 
-    def get_frontline_characteristics(self):
-
-        front_gammma_plus = []
-        front_gammma_minus = []
-        front_boundary = []
+        # instrumentation: advance_frontline and run fill in last_metrics (see metrics.COLUMNS) every iteration,
+        # run passes it to every observer, observer(cluster, record), after each iteration
+        self.observers = []
+        self.last_metrics = new_record()
+        self._query = None  # FieldQuery over the solved net, see query()
+        self._fields = None  # (net state, {name: values}) cache of field()
+        self._intersection_pool = None  # IntersectionPool of run(intersection_workers=...), None searches serially
+
+        if self.tolerance is not None: # refine the initial front (e.g. a coarse expansion fan) up to the tolerance
+            while True:
+                inserted, removed = self.adapt_frontline()
+                self._add_dead(removed, ())
+                if not inserted and not removed:
+                    break
+            self.get_frontline_characteristics()
+
+    @property
+    def constants(self):
+        # point columns held once for the whole cluster (compact storage), name -> value
+        return dict(self.points.constants)
+
+    def add_observer(self, observer):
+        self.observers.append(observer)
+
+    def remove_observer(self, observer):
+        self.observers.remove(observer)
 
-        for ind, p in enumerate(self.frontline_points):
-            cp, cm, c0 = self.make_characteristics(p)
-            if cp is not None:
-                front_gammma_plus.append(cp)
-            if cm is not None:
-                front_gammma_minus.append(cm)
-            if c0 is not None:
-                front_boundary.append(c0)
-
-        self.frontline_characteristics = front_gammma_plus + front_gammma_minus + front_boundary
-        # sort frontline by x value!
-        self.frontline_characteristics = sorted(self.frontline_characteristics, key = lambda x: x.origin.pos[0])
+    def get_frontline_characteristics(self):
+        # update the frontline characteristics to the current frontline_points: characteristics of points that left
+        # the front or have been shot since are dropped, the others are kept (objects and ray columns) with their
+        # intersection state reset, and the characteristics of new frontline points are merged in
+
+        previous = self._frontline_rays
+        frontline_points = set(self.frontline_points)
+        keep = [i for i, char in enumerate(previous.characteristics)
+                if char.origin in frontline_points and not char.origin_bool]
+        for i in keep:
+            char = previous.characteristics[i]
+            char.end = None
+            char.frontline_complement = None
+
+        known = {char.origin for char in previous.characteristics}
+        derive_flow_state([p for p in self.frontline_points if p not in known])
+        new = []
+        for p in self.frontline_points:
+            if p not in known:
+                new.extend(c for c in self.make_characteristics(p) if c is not None)
+
+        # sort frontline by x value! ties keep the family order and then the point order in the store,
+        # so the march does not depend on the iteration order of the frontline set (needed by resume).
+        # the kept characteristics are in that order already, only the new ones are sorted and merged in
+        kept, new = previous.take(keep), RayArrays(new)
+        kept_key, new_key = self._frontline_keys[keep], _tie_keys(new.characteristics)
+        order = np.lexsort((new_key, new.x))
+        new, new_key = new.take(order), new_key[order]
+        slots = _merge_positions(kept.x, kept_key, new.x, new_key)
+        merged = np.empty(len(kept) + len(new), dtype=np.int64)
+        is_new = np.zeros(len(merged), dtype=bool)
+        is_new[slots] = True
+        merged[slots] = len(kept) + np.arange(len(new))
+        merged[~is_new] = np.arange(len(kept))
+        # array form of the frontline for the batched intersection kernels
+        self._frontline_rays = RayArrays.concatenate([kept, new]).take(merged)
+        self._frontline_keys = np.concatenate((kept_key, new_key))[merged]
+        self.frontline_characteristics = self._frontline_rays.characteristics
+
+    @property
+    def reach(self):
+        # furthest x position of the frontline (taken from the frontline rays, which cover every frontline point),
+        # of the whole net once the front is empty
+        if len(self._frontline_rays):
+            return float(np.max(self._frontline_rays.x))
+        return float(np.max(self.points.x, initial=self._dropped_reach)) if len(self.points) else 0.0
+
+    @property
+    def shock_location(self):
+        # position of the most upstream detected shock point or None if there is no shock
+        return min([p.pos for p in self.shock_points]) if self.shock_points else None
+
+    def dead_point_chunks(self):
+        # columns (see archive.POINT_COLUMNS) of the dead points in chunks, read back lazily in streaming mode
+        if self.archive is not None:
+            yield from self.archive.point_chunks()
+        else:
+            yield point_columns(self.points, sorted(p.store_index for p in self.dead_points))
+
+    @property
+    def dead_segment_count(self):
+        # number of dead characteristics, the start of dead_segment_chunks that yields only the ones dying after now
+        return len(self.archive.segments) if self.archive is not None else len(self._dead_rows)
+
+    def dead_segment_chunks(self, start=0):
+        # columns (see archive.SEGMENT_COLUMNS) of the dead characteristics in order of death in chunks, from the
+        # start-th on, read back lazily in streaming mode
+        if self.archive is not None:
+            yield from self.archive.segments.chunks(start=start)
+        else:
+            yield segment_columns(self.characteristics, self._dead_rows[start:])
+
+    def field(self, name):
+        # values of a flow field (see archive.FLOW_FIELDS) or point column (e.g. 'x', 'index') at every solved point,
+        # the dead points in archive order followed by the frontline points in store order, e.g.
+        #   ax.tricontourf(gc.field('x'), gc.field('y'), gc.field('mach_number'))
+        # fields are evaluated on whole columns at once and cached (read-only) until the net changes
+        n_dead = len(self.archive.points) if self.archive is not None else len(self.dead_points)
+        state = (self.iter, len(self.points), n_dead, len(self.frontline_points))
+        if self._fields is None or self._fields[0] != state:
+            self._fields = (state, {})
+        fields = self._fields[1]
+        if name not in fields:
+            chunks = list(self.dead_point_chunks())
+            chunks.append(point_columns(self.points, sorted(p.store_index for p in self.frontline_points)))
+            values = np.concatenate([flow_property(chunk, name) for chunk in chunks])
+            values.setflags(write=False)
+            fields[name] = values
+        return fields[name]
+
+    def query(self):
+        # cached FieldQuery (interpolated flow fields at arbitrary locations) over the net solved so far,
+        # extended with the newly solved points whenever the cluster advanced since the last call
+        if self._query is None:
+            self._query = FieldQuery(self)
+        elif self._query.iter != self.iter:
+            self._query.update()
+        return self._query
+
+    def plot_path(self, name, fmt='svg'):
+        if fmt not in PLOT_FORMATS:
+            raise ValueError('unknown plot format {!r}, expected one of {}'.format(fmt, PLOT_FORMATS))
+        output_dir = self.output_dir if self.output_dir is not None else os.path.join(os.getcwd(), 'plots')
+        return os.path.join(output_dir, '{}_{}.{}'.format(name, self.iter, fmt))
 
     def make_characteristics(self, point : FluidPoint):
         if point._gamma_plus_bool:
@@ -53,86 +305,141 @@ class GeometryCluster:
         return c_plus, c_minus, c_0
 
     def find_first_intersection(self, char1):
-
-        gamma = self.frontline_characteristics
-        gamma_valid = []
-        intersects = []
-        for ind, g in enumerate(gamma):
-            inter = g * char1
-            if inter is not None and\
-                    char1.origin.flow_direction_dot_product(inter) > 0\
-                and\
-                    g.origin.flow_direction_dot_product(inter) > 0:
-            # make sure:
-            # 1) intersection exists
-            # 1) we don't backtrack from char1.origin
-            # 3) we don't backtrack from g.origin.origin (if any)
-            #     if not g.origin.ending_characteristics or g.origin.ending_characteristics.pop().origin.flow_direction_dot_product(inter) > 0:
-
-                intersects.append(g * char1)
-                gamma_valid.append(g)
-
-        #if no such intersects exist, return nones
-        if not intersects: # empty list is false-y
+        # make sure:
+        # 1) intersection exists
+        # 1) we don't backtrack from char1.origin
+        # 3) we don't backtrack from g.origin.origin (if any)
+        # and return the remaining intersection closest to char1.origin in flow direction
+
+        inter, g = char1.first_intersection(self._frontline_rays)
+        if inter is None:
             return None, None, None
 
-        # sort by flow_distance!
-
-        sorted_intersect_and_gamma = sorted(zip(intersects, gamma_valid),
-                                            key=lambda tuple: (char1.origin.flow_direction_dot_product(tuple[0])))
-        inter, g = sorted_intersect_and_gamma[0]
-
         return inter, g, char1
 
     def find_first_dead_intersection(self, char1):
-
-        gamma = self.dead_characteristics
-        gamma_valid = []
-        intersects = []
-        for ind, g in enumerate(gamma):
-            inter= g * char1
-            if g.end.pos[0] > char1.origin.pos[0]: # don't need to bother with g to the left of char1.origin
-                if inter is not None and g.origin != char1.origin and\
-                        char1.origin.flow_direction_dot_product(inter) > 0 and\
-                        g.origin.flow_direction_dot_product(inter) > 0 and\
-                        g.end.flow_direction_dot_product(inter) < 0:
-
-                # make sure:
-                # 1) intersection exists
-                # 1) we don't backtrack from char1.origin
-                # 3) we don't backtrack from g.origin
-                # 4) we DO backtrack from g.end (g is dead after all)
-                # 5) g.origin is not same as char1.origin (trivial case)
-
-                    intersects.append(g * char1)
-                    gamma_valid.append(g)
-
-        #if no such intersects exist, return nones
-        if not intersects: # empty list is false-y
+        # make sure:
+        # 1) intersection exists
+        # 1) we don't backtrack from char1.origin
+        # 3) we don't backtrack from g.origin
+        # 4) we DO backtrack from g.end (g is dead after all)
+        # 5) g.origin is not same as char1.origin (trivial case)
+        # the dead characteristics are searched through a spatial index, only segments near char1 are tested
+
+        index = self._dead_index.first_intersection(char1)
+        if index is None:
             return None, None, None
 
-        # sort by flow_distance!
-
-        sorted_intersect_and_gamma = sorted(zip(intersects, gamma_valid),
-                                            key=lambda tuple: (char1.origin.flow_direction_dot_product(tuple[0])))
-        inter, g = sorted_intersect_and_gamma[0]
+        g = self.characteristics.object(index)
+        inter = g * char1
+        if inter is None:
+            return None, None, None
 
         return inter, g, char1
 
-    def advance_frontline(self, printFlag = False):
+    def _nearest_frontline_intersections(self, rows=None):
+        # nearest_intersections of the frontline rays among themselves (optionally only for the target rows),
+        # sharded over the worker pool of run if it has one, with the same result either way
+        if self._intersection_pool is not None:
+            return self._intersection_pool.nearest_intersections(self._frontline_rays, rows)
+        return nearest_intersections(self._frontline_rays, self._frontline_rays, rows=rows)
+
+    def find_neighbor_intersections(self):
+        # first intersection of every frontline characteristic among its neighbors along the arc of the front,
+        # O(N) per call for the rows resolved locally. the front ordering only decides which ray is hit first where
+        # rays of the same family do not cross, so a row is treated as locally inconsistent, and resolved by the
+        # global search, if
+        # 1) it hits the outermost characteristic of that family on that side of its window (the next one
+        #    further along the front could be hit first)
+        # 2) it, or the characteristic it hits, is crossed by a same-family neighbor before the hit (coalescing waves)
+        # 3) it has no local hit at all (a characteristic further along the front can still hit it)
+        # on a jet about half of the rows have no local hit, so the search stays quadratic in the front
+        rays = self._frontline_rays
+        n = len(rays)
+        w = self.neighbor_window
+        types = np.array([char.type for char in self.frontline_characteristics], dtype=np.int8)
+
+        # arc order of the characteristics, neighbors on the front are neighbors in arc_order
+        arc = np.array([self._arc_rank[char.origin] for char in self.frontline_characteristics], dtype=float)
+        arc_order = np.lexsort((types, arc))
+        arc_position = np.empty(n, dtype=np.int64)
+        arc_position[arc_order] = np.arange(n)
+
+        offsets = np.concatenate((np.arange(-w, 0), np.arange(1, w + 1)))
+        window = arc_position[:, None] + offsets[None, :]
+        outside = (window < 0) | (window >= n)
+        candidates = np.where(outside, -1, arc_order[np.clip(window, 0, n - 1)])
+
+        first_index, first_distance, distance, candidate_distance =\
+            nearest_intersections_among(rays, rays, candidates, return_all=True)
+        found = first_index >= 0
+        partner = np.where(found, first_index, 0)
+        column = np.argmin(distance, axis=1)
+
+        # 1) is the partner the outermost candidate of its family on its side of the (untruncated) window?
+        family = (types[candidates] == types[partner][:, None]) & ~outside
+        outermost_before = np.argmax(family[:, :w], axis=1)
+        outermost_after = 2 * w - 1 - np.argmax(family[:, :w - 1:-1], axis=1)
+        on_edge = np.where(column < w, (column == outermost_before) & ~outside[:, 0],
+                           (column == outermost_after) & ~outside[:, -1])
+
+        # 2) flow distance at which each characteristic is first crossed by a same-family neighbor,
+        # from either side of the (one-sided) intersection test
+        same_family = (types[candidates] == types[:, None]) & ~outside
+        crossed_at = np.min(np.where(same_family, distance, np.inf), axis=1)
+        np.minimum.at(crossed_at, candidates[same_family], candidate_distance[same_family])
+
+        x, y, _ = intersect_rays(rays.x[partner], rays.y[partner], rays.direction[partner], rays.x, rays.y, rays.direction)
+        partner_distance = rays.forward_distance(x, y, partner)
+
+        inconsistent = np.flatnonzero(~found | on_edge | (crossed_at[partner] <= partner_distance) |
+                                      (crossed_at <= first_distance))
+        if len(inconsistent):
+            first_index[inconsistent], _ = self._nearest_frontline_intersections(inconsistent)
+        self.last_metrics['pair_tests'] += n * 2 * w + len(inconsistent) * n
+        self.last_metrics['global_rows'] += len(inconsistent)
+        return first_index
+
+    def _arc_rank_between(self, point, origin, other_origin):
+        # arc rank of a new point reached from two frontline points: next to the one it is closer to,
+        # on the side of the other one (the midpoint would misplace it when the origins are far apart on the arc)
+        rank, other_rank = self._arc_rank[origin], self._arc_rank[other_origin]
+        if point * other_origin < point * origin:
+            rank, other_rank = other_rank, rank
+        return rank + 0.25 * np.sign(other_rank - rank)
+
+    def advance_frontline(self, printFlag = False, region=None, stop_at_shock=True):
         # define new frontline points and store them in the cache
+        # new frontline points outside region (see region_of_interest) are retired to the dead points right away,
+        # with stop_at_shock=False shock points are only retired and the march goes on with the rest of the front
+
+        metrics = self.last_metrics = new_record()
+        start = time.perf_counter()
 
         new_frontline_points = set({}) # a set of points!
+        new_arc_rank = {} # arc position of new frontline points, between those of the points they came from
         new_dead_points = set({}) # a set of points!
         new_dead_characteristics = set({}) # a set of chars!
+        new_shock_points = set({}) # both characteristics of a mutual pair end at the same shock point, count it once
 
         stopFlag = False
 
-        for char in self.frontline_characteristics:
-            new_intersect, ch_other, _ = self.find_first_intersection(char)
+        # closest intersection of every frontline characteristic, in one batched pass (see find_first_intersection)
+        if self.advance_mode == 'neighbor':
+            first_index = self.find_neighbor_intersections()
+        else:
+            first_index, _ = self._nearest_frontline_intersections()
+            metrics['pair_tests'] += len(self._frontline_rays) ** 2
+
+        for char, index in zip(self.frontline_characteristics, first_index):
+            new_intersect, ch_other = None, None
+            if index >= 0:
+                ch_other = self.frontline_characteristics[index]
+                new_intersect = ch_other * char
 
             # NOTE: new intersect and ch_other could be None!
             if new_intersect is not None:
+                metrics['intersections'] += 1
 
                 # check if this inmtersect is indeed the closest for both characteristics
                 if ch_other.measure is None or\
@@ -152,17 +459,26 @@ class GeometryCluster:
             if char.frontline_complement is not None and char.frontline_complement.frontline_complement == char:
                 if char.end.v_plus is not None: # if there is no shock at char.end, continue the frontline
                     new_frontline_points.add(char.end) # add end point to new front
+                    new_arc_rank[char.end] = self._arc_rank_between(char.end, char.origin, char.frontline_complement.origin)
                 else: # if we detect a shock, add end to dead points (cannot continue the model)
                     new_dead_points.add(char.end)
+                    if char.end not in new_shock_points:
+                        new_shock_points.add(char.end)
+                        self.shock_points.append(char.end)
+                        metrics['shocks'] += 1
 
-                    if printFlag:
-                        print('shockwave formation detected at ({:.2f}, {:.2f})'.format(char.end.pos[0],
-                                                                                        char.end.pos[1]))
-                    stopFlag = True
+                        if printFlag:
+                            print('shockwave formation detected at ({:.2f}, {:.2f})'.format(char.end.pos[0],
+                                                                                            char.end.pos[1]))
+                    stopFlag = stop_at_shock
 
                 new_dead_characteristics.add(char)
                 char.update_bool_of_origin()
-                char.end.ending_characteristics.add(char)
+                char.end.add_ending_characteristic(char)
+
+        lap = time.perf_counter()
+        metrics['intersection'] = lap - start
+        dead_pair_tests = self._dead_index.pair_tests
 
         for point in self.frontline_points:
             if not point.all_chars_exhausted: # if we didn't find new intersections in the above loop
@@ -171,15 +487,22 @@ class GeometryCluster:
                 for char in self.make_characteristics(point):
                     if char is not None:  # only check valid chars
                         inter, char2, _ = self.find_first_dead_intersection(char) # last chance - check the dead chars
+                        metrics['fallbacks'] += 1
+                        metrics['dead_intersections'] += inter is not None
                         if inter is None: # we didn't find any intersections with dead chars! => try again in the next frontline
                             new_frontline_points.add(point)
+                            new_arc_rank[point] = self._arc_rank[point]
                         else: # we did find an intersection with dead chars!
                             if inter.v_plus is None: # but it's a shock!
                                 new_dead_points.add(inter)
-                                if printFlag:
-                                    print('shockwave formation detected at ({:.2f}, {:.2f})'.format(inter.pos[0],
-                                                                                                    inter.pos[1]))
-                                stopFlag = True
+                                if inter not in new_shock_points:
+                                    new_shock_points.add(inter)
+                                    self.shock_points.append(inter)
+                                    metrics['shocks'] += 1
+                                    if printFlag:
+                                        print('shockwave formation detected at ({:.2f}, {:.2f})'.format(inter.pos[0],
+                                                                                                        inter.pos[1]))
+                                stopFlag = stop_at_shock
                             else: # inter is a valid intersection point => add it to the frontline and make sure we don't shoot char2 again!
                                 match char2.type:
                                     case 1:
@@ -190,6 +513,7 @@ class GeometryCluster:
                                         inter._gamma_zero_bool = True
 
                                 new_frontline_points.add(inter)
+                                new_arc_rank[inter] = self._arc_rank[point]
 
 
             else:  # kill the point
@@ -197,139 +521,592 @@ class GeometryCluster:
                 for dead_char in point.ending_characteristics:
                     new_dead_characteristics.add(dead_char)
 
+        metrics['pair_tests'] += self._dead_index.pair_tests - dead_pair_tests
+        lap = time.perf_counter()
+        metrics['fallback'] = lap - start - metrics['intersection']
+
+        # register the new points and dead characteristics with the column stores,
+        # in an order independent of the set iteration order so store rows are reproducible
+        for point in sorted(new_frontline_points, key=lambda p: p.pos):
+            point.attach(self.points)
+        for point in sorted(new_dead_points, key=lambda p: p.pos):
+            point.attach(self.points)
+        for char in sorted(new_dead_characteristics, key=lambda c: (c.origin.store_index, c.type)):
+            char.attach(self.characteristics)
+
         # store new frontline and update front characteristics
         if printFlag:
             print('new frontline size: {}'.format(len(new_frontline_points)))
 
         self.frontline_points = new_frontline_points
+        self._arc_rank = {p: i for i, p in enumerate(sorted(new_frontline_points, key=lambda p: (new_arc_rank[p], p.store_index)))}
+        metrics['frontline_size'] = len(new_frontline_points)
         if stopFlag: # if the frontline is empty
             if printFlag:
                 print('stopping model')
+            self.get_frontline_characteristics()
+            metrics['rebuild'] = time.perf_counter() - lap
             return True
 
+        if region is not None:
+            retired = self.retire_outside(region)
+            new_dead_points |= retired
+            metrics['retired'] = len(retired)
+            if printFlag and retired:
+                print('{} frontline points left the region of interest'.format(len(retired)))
+
+        if self.tolerance is not None:
+            inserted, removed = self.adapt_frontline()
+            new_dead_points |= removed
+            if printFlag:
+                print('adaptive frontline: {} points inserted, {} merged away'.format(len(inserted), len(removed)))
+
         self.get_frontline_characteristics()
-        self.dead_points = self.dead_points.union(new_dead_points)
-        self.dead_characteristics = self.dead_characteristics.union(new_dead_characteristics)
+        self._add_dead(new_dead_points, new_dead_characteristics)
+        if self.eviction:
+            self.evict_unreachable()
+        metrics['frontline_size'] = len(self.frontline_points)
+        metrics['rebuild'] = time.perf_counter() - lap
 
         return False  # continue the run function
 
-    def run(self, max_iter = 100, printFlag = False, plot_interval=0, plotkwargs={'save' : True, 'markers' : False}):
+    def retire_outside(self, region):
+        # take the frontline points downstream of region off the front (they stop shooting characteristics),
+        # returns them so they can be added to the dead points
+        xmax = region[2]
+        retired = {p for p in self.frontline_points if p.pos[0] > xmax}
+        if retired:
+            self.frontline_points = set(self.frontline_points) - retired
+            self._arc_rank = {p: i for i, p in enumerate(sorted(self.frontline_points, key=self._arc_rank.get))}
+        return retired
+
+    def _add_dead(self, new_dead_points, new_dead_characteristics):
+        # merge newly dead (attached) points and characteristics into the dead sets, or the archive when streaming
+        if self.archive is None:
+            self.dead_points |= set(new_dead_points)
+            self._dead_rows.extend(sorted(char.store_index for char in new_dead_characteristics
+                                          if char not in self.dead_characteristics))
+            self.dead_characteristics |= set(new_dead_characteristics)
+        else:
+            # dead characteristics are the only rows of the characteristic store, in order of death,
+            # so the ones not archived yet are the rows after the archived ones
+            self.archive.append_points(self.points, sorted(p.store_index for p in new_dead_points))
+            self.archive.append_segments(self.characteristics, np.arange(len(self.archive.segments), len(self.characteristics)))
+        self._dead_index.insert(sorted(char.store_index for char in new_dead_characteristics))
+
+    def adapt_frontline(self):
+        # error-controlled refinement and coarsening of the frontline, walking it along its arc:
+        # - a gap between neighbors whose riemann invariants differ by more than the tolerance (or that is wider
+        #   than REFINE_SPACING) gets a new point, interpolated linearly in position and invariants
+        # - an interior point whose neighbors differ by less than COARSEN_FRACTION of the tolerance is removed
+        #   from the front (it stays a dead point), never two neighbors in one pass
+        # only points that have not shot any characteristic yet take part, so inserted points never shoot into
+        # a region already covered. returns (inserted points, removed points)
+        front = sorted(self.frontline_points, key=self._arc_rank.get)
+        if len(front) < 2 or self.spacing is None:
+            return set(), set()
+
+        x, y = np.array([p.pos for p in front]).T
+        v_plus = np.array([p.v_plus for p in front])
+        v_minus = np.array([p.v_minus for p in front])
+        fresh = np.array([p._flags == BOUNDARY_FLAGS.get(p.boundary, 0) for p in front])
+        interior = np.array([p.boundary is None for p in front])
+        h = self.spacing
+
+        gap = np.hypot(np.diff(x), np.diff(y))
+        error = np.maximum(np.abs(np.diff(v_plus)), np.abs(np.diff(v_minus)))
+        refine = fresh[:-1] & fresh[1:] & (gap <= NEIGHBOR_SPACING * h) &\
+            ((error > self.tolerance) | (gap > REFINE_SPACING * h))
+
+        merged_gap = np.hypot(x[2:] - x[:-2], y[2:] - y[:-2])
+        merged_error = np.maximum(np.abs(v_plus[2:] - v_plus[:-2]), np.abs(v_minus[2:] - v_minus[:-2]))
+        coarsen = fresh[1:-1] & interior[1:-1] & ~refine[:-1] & ~refine[1:] &\
+            (merged_gap <= COARSEN_SPACING * h) & (merged_error <= COARSEN_FRACTION * self.tolerance)
+
+        removed = set()
+        last = -2
+        for i in np.flatnonzero(coarsen) + 1:
+            if i > last + 1:
+                removed.add(front[i])
+                last = i
+
+        inserted = set()
+        rank = {p: float(i) for i, p in enumerate(front)}
+        for i in np.flatnonzero(refine):
+            a, b = front[i], front[i + 1]
+            point = FluidPoint(((x[i] + x[i + 1]) / 2, (y[i] + y[i + 1]) / 2),
+                               (v_plus[i] + v_plus[i + 1]) / 2, (v_minus[i] + v_minus[i + 1]) / 2,
+                               boundary=_refined_boundary(a.boundary, b.boundary),
+                               gamma=(a.gamma + b.gamma) / 2, ptot=(a.ptot + b.ptot) / 2)
+            point.attach(self.points)
+            inserted.add(point)
+            rank[point] = i + 0.5
+
+        self.frontline_points = (set(self.frontline_points) - removed) | inserted
+        self._arc_rank = {p: i for i, p in enumerate(sorted(self.frontline_points, key=rank.get))}
+        return inserted, removed
+
+    def evict_unreachable(self):
+        # find_first_dead_intersection only accepts dead characteristics ending downstream (in x) of the frontline
+        # point it searches from, so segments ending at or before the most upstream frontline point are unreachable
+        # for the next iteration. segments evicted earlier are put back if the front ever moves upstream again.
+        # the next iteration only searches from the frontline characteristics, so the segments upstream of all
+        # of their hits are taken out as well (see spatial.unreachable_segments)
+        bound = min([p.pos[0] for p in self.frontline_points]) if self.frontline_points else np.inf
+        evicted = self._evict_dead_segments(bound, self._frontline_rays)
+        store = self.characteristics
+
+        if self.archive is not None:
+            # streaming: the evicted rows are archived already, drop their objects unless a point is still
+            # the origin of a searchable segment or on the frontline, and the rows themselves now and then
+            # (also after a lattice march, which evicts as it goes)
+            if len(evicted):
+                store.release(evicted)
+                keep = set(self._dead_index.origin[self._dead_index.active]) | {p.store_index for p in self.frontline_points} |\
+                    set(store.values('origin', self._shadowed_ids))
+                self.points.release([i for i in set(store.values('origin', evicted)) | set(store.values('end', evicted))
+                                     if i not in keep])
+            self._compact_stores()
+
+    def _compact_stores(self):
+        # streaming: drop the archived rows from the point and characteristic stores (see COMPACT_ROWS) where they
+        # hold more than twice the rows still referenced: the searchable and shadowed dead segments, the characteristics ending at frontline points
+        # (a point killed on the front hands them to _add_dead again), the rows the exporters of the current run
+        # have not written yet, the end points of all of these, the frontline points and the shock points
+        chars = self.characteristics
+        if max(self.points.resident, chars.resident) < self._compact_at:
+            return
+        grid = self._dead_index
+        ending = [char.store_index for point in self.frontline_points for char in point.ending_characteristics]
+        floor = min([exporter.exported_segments for exporter in self._exporters], default=len(chars))
+        keep_chars = np.concatenate((grid.ids[grid.active], self._shadowed_ids, np.array(ending, dtype=np.int64),
+                                     np.arange(floor, len(chars))))
+        ends = chars.values('end', keep_chars)
+        floor = min([exporter.exported_points for exporter in self._exporters], default=len(self.points))
+        keep_points = np.concatenate((chars.values('origin', keep_chars), ends[ends != NO_INDEX],
+                                      np.array([p.store_index for p in self.frontline_points], dtype=np.int64),
+                                      np.array([p.store_index for p in self.shock_points], dtype=np.int64),
+                                      np.arange(floor, len(self.points))))
+        resident = max(self.points.resident, chars.resident)
+        if self.points.resident > 2 * len(np.unique(keep_points)):
+            self._dropped_reach = max(self._dropped_reach, float(np.max(self.points.x)))
+            self.points.compact(keep_points)
+        if chars.resident > 2 * len(np.unique(keep_chars)):
+            chars.compact(keep_chars)
+        if max(self.points.resident, chars.resident) < resident:
+            self._compact_at = max(2 * max(self.points.resident, chars.resident), COMPACT_ROWS)
+        else:  # nothing dropped (e.g. rows not exported yet), check again after COMPACT_ROWS more rows
+            self._compact_at = resident + COMPACT_ROWS
+
+    def _reload_evicted(self, bound):
+        # streaming: the archived dead segments ending beyond bound that are neither searchable nor shadowed, their rows (and those
+        # of their end points) read back from the archive where they were dropped from the stores. exact with
+        # storage='full', rounded to float32 with 'compact' (the front moving upstream again is rare, see
+        # evict_unreachable)
+        with np.errstate(invalid='ignore'):
+            rows = np.flatnonzero(self.archive.segments.column('x1') > bound)
+        rows = rows[~self._dead_index.searchable(rows) & ~np.isin(rows, self._shadowed_ids)]
+        chars = self.characteristics
+        dropped = rows[chars.dropped(rows)]
+        if len(dropped) == 0:
+            return rows
+        segments = {name: self.archive.segments.column(name)[dropped] for name in ('origin', 'end', 'type')}
+        point_rows = np.unique(np.concatenate((segments['origin'], segments['end'])))
+        point_rows = point_rows[self.points.dropped(point_rows)]
+        if len(point_rows):
+            columns = self.archive.find_points(point_rows)
+            columns['flags'] = np.zeros(len(point_rows), dtype=np.uint8)  # not archived, dead points never shoot
+            self.points.reload(point_rows, columns)
+        segments['direction'] = [Characteristic(self.points.object(origin), type=int(t)).direction
+                                 for origin, t in zip(segments['origin'], segments['type'])]
+        chars.reload(dropped, segments)
+        return rows
+
+    def _evict_dead_segments(self, bound, rays=None):
+        # take the dead segments ending at x <= bound out of the dead segment search, put back the ones evicted
+        # earlier that end beyond bound, returns the store indices of the newly evicted characteristics
+        # (streaming keeps no list of the evicted segments, they are found in the archive). given the rays the
+        # next search starts from, the bounded segments they cannot reach are shadowed: taken out until the rays
+        # of a later call can reach them, or evicted once they end at x <= bound
+        if bound < self._evicted_bound:
+            if self.archive is None:
+                back = self._evicted_x1 > bound
+                self._dead_index.restore(self._evicted_ids[back])
+                self._evicted_ids = self._evicted_ids[~back]
+                self._evicted_x1 = self._evicted_x1[~back]
+            else:
+                self._dead_index.restore(self._reload_evicted(bound))
+        self._evicted_bound = bound
+
+        store = self.characteristics
+        points = store.points
+        shadowed = self._shadowed_ids
+        origin, end = store.values('origin', shadowed), store.values('end', shadowed)
+        x0, y0 = points.values('x', origin), points.values('y', origin)
+        x1, y1 = points.values('x', end), points.values('y', end)
+        gone = x1 <= bound
+        still = ~gone
+        if rays is None:
+            still[:] = False
+        elif still.any():
+            still[still] = unreachable_segments(rays, x0[still], y0[still], x1[still], y1[still], self._dead_index.cell_size)
+        self._dead_index.restore(shadowed[~gone & ~still])
+
+        evicted = self._dead_index.evict(bound, rays)
+        shadow = points.values('x', store.values('end', evicted)) > bound
+        self._shadowed_ids = np.concatenate((shadowed[still], evicted[shadow]))
+        evicted = np.concatenate((shadowed[gone], evicted[~shadow]))
+        if self.archive is None:
+            self._evicted_ids = np.concatenate((self._evicted_ids, evicted))
+            self._evicted_x1 = np.concatenate((self._evicted_x1, points.values('x', store.values('end', evicted))))
+        return evicted
+
+    def save_checkpoint(self, path):
+        # write the state between two iterations to path (numpy .npz layout, uncompressed),
+        # GeometryCluster.resume(path) continues the march exactly where it stopped
+        points = self.points
+        frontline_points = sorted(self.frontline_points, key=lambda p: p.store_index)
+        frontline_position = {id(char): i for i, char in enumerate(self.frontline_characteristics)}
+
+        state = {
+            'version': CHECKPOINT_VERSION,
+            'iter': self.iter,
+            'advance_mode': self.advance_mode,
+            'neighbor_window': self.neighbor_window,
+            'engine': self.engine,
+            'storage': self.storage,
+            'output_dir': '' if self.output_dir is None else self.output_dir,
+            'tolerance': np.nan if self.tolerance is None else self.tolerance,
+            'spacing': np.nan if self.spacing is None else self.spacing,
+            'archive_dir': '' if self.archive is None else self.archive.directory,
+            'archive_points': 0 if self.archive is None else len(self.archive.points),
+            'archive_segments': 0 if self.archive is None else len(self.archive.segments),
+            'frontline_points': np.array([p.store_index for p in frontline_points], dtype=np.int64),
+            'arc_rank': np.array([self._arc_rank[p] for p in frontline_points], dtype=np.int64),
+            'frontline_origin': np.array([c.origin.store_index for c in self.frontline_characteristics], dtype=np.int64),
+            'frontline_type': np.array([c.type for c in self.frontline_characteristics], dtype=np.int8),
+            'frontline_end': np.array([NO_INDEX if c.end is None else c.end.store_index
+                                       for c in self.frontline_characteristics], dtype=np.int64),
+            'frontline_complement': np.array([frontline_position.get(id(c.frontline_complement), NO_INDEX)
+                                              for c in self.frontline_characteristics], dtype=np.int64),
+            'dead_points': np.sort(np.fromiter((p.store_index for p in self.dead_points), dtype=np.int64)),
+            'dead_characteristics': np.sort(np.fromiter((c.store_index for c in self.dead_characteristics), dtype=np.int64)),
+            'shock_points': np.array([p.store_index for p in self.shock_points], dtype=np.int64),
+            'dead_index_ids': self._dead_index.ids[self._dead_index.active],
+            'evicted_bound': self._evicted_bound,
+            'dropped_reach': self._dropped_reach,
+            'evicted_ids': self._evicted_ids,
+            'evicted_x1': self._evicted_x1,
+            'shadowed_ids': self._shadowed_ids,
+            'dead_index_cell_size': np.nan if self._dead_index.cell_size is None else self._dead_index.cell_size,
+        }
+        for prefix, store in (('points/', points), ('characteristics/', self.characteristics)):
+            state.update({prefix + name: column for name, column in store.columns().items()})
+            state.update({prefix + 'rows': store.rows(), prefix + 'size': len(store)})
+
+        if self.archive is not None:
+            self.archive.flush()
+
+        # write next to the target and rename, so an interrupted write never replaces a good checkpoint
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **state)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def resume(cls, path, **kwargs):
+        # rebuild a cluster from a checkpoint written by save_checkpoint, kwargs override the saved
+        # advance_mode, neighbor_window, engine, storage, output_dir, tolerance and spacing,
+        # a streaming archive is reopened and cut back to the checkpoint
+        with np.load(path) as f:
+            state = {key: f[key] for key in f.files}
+        if int(state['version']) != CHECKPOINT_VERSION:
+            raise ValueError('unsupported checkpoint version {} in {}'.format(int(state['version']), path))
+
+        options = {
+            'advance_mode': str(state['advance_mode']),
+            'neighbor_window': int(state['neighbor_window']),
+            'engine': str(state['engine']),
+            'storage': str(state['storage']),
+            'output_dir': str(state['output_dir']) or None,
+            'tolerance': None if np.isnan(state['tolerance']) else float(state['tolerance']),
+            'spacing': None if np.isnan(state['spacing']) else float(state['spacing']),
+        }
+        options.update(kwargs)
+        archive_dir = str(state['archive_dir']) or None
+
+        self = cls.__new__(cls)
+        self.__init__([], archive_dir=archive_dir, **options)
+        if archive_dir is not None:
+            self.archive = NetArchive.open(archive_dir)
+            self.archive.points.truncate(int(state['archive_points']))
+            self.archive.segments.truncate(int(state['archive_segments']))
+        for prefix, store in (('points/', self.points), ('characteristics/', self.characteristics)):
+            store.restore({name: state[prefix + name] for name in store.COLUMNS}, state[prefix + 'rows'],
+                          state[prefix + 'size'])
+        if self.storage == 'compact':
+            for name, value in self.archive.constants.items():
+                self.points.hoist(name, value)
+        point = self.points.object
+        characteristic = self.characteristics.object
+
+        # the characteristics ending at a point are exactly the stored characteristics with that end
+        # (in streaming mode the resident ones, the ends of dropped characteristics are not referenced any more)
+        ends = self.characteristics.end
+        for index, end in zip(self.characteristics.rows()[ends != NO_INDEX], ends[ends != NO_INDEX]):
+            point(int(end)).add_ending_characteristic(characteristic(int(index)))
+
+        self.frontline_points = {point(int(i)) for i in state['frontline_points']}
+        self._arc_rank = {point(int(i)): int(rank) for i, rank in zip(state['frontline_points'], state['arc_rank'])}
+        self.frontline_characteristics = [Characteristic(point(int(i)), type=int(t))
+                                          for i, t in zip(state['frontline_origin'], state['frontline_type'])]
+        for char, end, complement in zip(self.frontline_characteristics, state['frontline_end'], state['frontline_complement']):
+            char.end = None if end == NO_INDEX else point(int(end))
+            char.frontline_complement = None if complement == NO_INDEX else self.frontline_characteristics[complement]
+        self._frontline_rays = RayArrays(self.frontline_characteristics)
+        self._frontline_keys = _tie_keys(self.frontline_characteristics)
+
+        self.dead_points = {point(int(i)) for i in state['dead_points']}
+        self.dead_characteristics = {characteristic(int(i)) for i in state['dead_characteristics']}
+        self._dead_rows = state['dead_characteristics'].tolist()
+        self.shock_points = [point(int(i)) for i in state['shock_points']]
+        cell_size = float(state['dead_index_cell_size'])
+        self._dead_index = SegmentGrid(self.characteristics, cell_size=None if np.isnan(cell_size) else cell_size)
+        self._dead_index.insert(state['dead_index_ids'])
+        self._evicted_bound = float(state['evicted_bound'])
+        self._dropped_reach = float(state['dropped_reach'])
+        self._evicted_ids = state['evicted_ids']
+        self._evicted_x1 = state['evicted_x1']
+        self._shadowed_ids = state['shadowed_ids']
+
+        self.iter = int(state['iter'])
+        return self
+
+    def run(self, max_iter = 100, printFlag = False, plot_interval=0, plotkwargs={'save' : True, 'markers' : False},
+            checkpoint_path=None, checkpoint_interval=0, checkpoint_seconds=None, trace_memory=False,
+            async_plots=False, plot_queue_size=DEFAULT_QUEUE_SIZE, x_station=None, first_shock_only=True,
+            intersection_workers=0, exporters=(), export_interval=None):
+        # with checkpoint_path set, a checkpoint is written every checkpoint_interval iterations
+        # and/or whenever checkpoint_seconds have passed since the last one
+        # with trace_memory, the tracemalloc peak of every iteration is recorded in the metrics (slows the run down)
+        # with async_plots, saved geometry plots are rendered from snapshots in a background process, at most
+        # plot_queue_size of them are pending at a time and all of them are written before run returns
+        # x_station confines the march to the region upstream of it: frontline points downstream of it are retired,
+        # and the run ends once the front is empty or stalls, i.e. the region is covered (exact for supersonic flow)
+        # first_shock_only=False keeps marching past shock points instead of stopping at the first one
+        # either way the run ends when no interior point is left on the front (the boundary points alone only
+        # bounce off each other)
+        # intersection_workers > 1 shards the frontline intersection search of large fronts over that many worker
+        # processes (see parallel.IntersectionPool), the march is identical to the serial one
+        # exporters (see export.NetExporter) append the net solved since their last export every export_interval
+        # (by default plot_interval) iterations and when the run ends
+        # engine='lattice' commits its phase of the march as a whole, the checkpoint, plot and export falling due
+        # during it are written once when the geometric search takes over (or the run ends in it)
+        region = region_of_interest(x_station)
+        export_interval = plot_interval if export_interval is None else export_interval
+        # the worker pools (and multiprocessing with them) are only imported by the runs that use them
+        plotter = None
+        if async_plots and plot_interval > 0 and plotkwargs.get('save'):
+            from src.plotting import SnapshotPlotter
+            plotter = SnapshotPlotter(plot_queue_size)
+        if intersection_workers > 1:
+            from src.parallel import IntersectionPool
+            self._intersection_pool = IntersectionPool(intersection_workers)
+        self._exporters = tuple(exporters)
+        try:
+            self._run(max_iter, printFlag, plot_interval, plotkwargs, checkpoint_path, checkpoint_interval,
+                      checkpoint_seconds, trace_memory, plotter, region, first_shock_only, exporters,
+                      export_interval)
+        finally:
+            try:
+                if plotter is not None:
+                    plotter.close()
+            finally:
+                self._exporters = ()
+                if self._intersection_pool is not None:
+                    self._intersection_pool.close()
+                    self._intersection_pool = None
+
+    def _march_lattice(self, max_iter, printFlag, region):
+        # lattice phase of run, committed to the cluster as a whole: nothing is written until the handover
+        march = LatticeMarch.from_cluster(self)
+        if march is None:
+            if printFlag:
+                print('lattice engine: initial front is not a jet layout, using the geometric search')
+            return
+        steps = march.march(max_iter - self.iter, self.observers, region)
+        march.commit()
+        if region is not None:
+            self._add_dead(self.retire_outside(region), ())
+            self.get_frontline_characteristics()
+        if printFlag:
+            print('lattice engine: {} iterations marched, geometric search continues at reach {:.2f}'.format(
+                steps, self.reach))
+
+    def _plot_geometry(self, plotter, plotkwargs):
+        if plotter is None:
+            self.plot_geometry(**plotkwargs)
+        else:
+            # the worker keeps the segments of earlier snapshots, only the ones dead since the last one are sent
+            kwargs = {key: value for key, value in plotkwargs.items() if key not in ('save', 'fmt')}
+            plotter.submit(render_geometry, self.geometry_snapshot(start=plotter.segments),
+                           self.plot_path('geometry', plotkwargs.get('fmt', 'svg')), **kwargs)
+
+    def _run(self, max_iter, printFlag, plot_interval, plotkwargs, checkpoint_path, checkpoint_interval,
+             checkpoint_seconds, trace_memory, plotter, region, first_shock_only, exporters,
+             export_interval):
         breakLoop = False
-        while self.iter < max_iter and not breakLoop:
+        last_checkpoint = time.perf_counter()
+        stop_tracing = trace_memory and not tracemalloc.is_tracing()
+        if stop_tracing:
+            tracemalloc.start()
+        if self.engine == 'lattice':
+            start_iter = self.iter
+            self._march_lattice(max_iter, printFlag, region)
+            if self.iter > start_iter:
+                # the checkpoint, plot and export due during the lattice phase are written once at the handover,
+                # the plot and export only if the run goes on (it writes both when it ends)
+                def due(interval):
+                    return interval > 0 and self.iter // interval > start_iter // interval
+                goes_on = self.iter < max_iter and bool(self.frontline_points)
+                if self._write_outputs(printFlag, checkpoint_path, plotter, plotkwargs, exporters,
+                                       checkpoint=checkpoint_path is not None and (due(checkpoint_interval) or (
+                                           checkpoint_seconds is not None and
+                                           time.perf_counter() - last_checkpoint >= checkpoint_seconds)),
+                                       plot=goes_on and due(plot_interval),
+                                       export=goes_on and bool(exporters) and due(export_interval)):
+                    last_checkpoint = time.perf_counter()
+        while self.iter < max_iter and not breakLoop and self.frontline_points:
             print('iteration {}: advancing frontline points'.format(self.iter))
-            print('current reach: {:.2f}'.format(
-                max([p.pos[0] for p in self.frontline_points])
-            ))
-            breakLoop = self.advance_frontline(printFlag=printFlag)
-            self.iter +=1
-            if plot_interval > 0 and self.iter % plot_interval == 0:
+            print('current reach: {:.2f}'.format(self.reach))
+            if trace_memory:
+                tracemalloc.reset_peak()
+            previous_front = set(self.frontline_points) if region is not None else None
+            breakLoop = self.advance_frontline(printFlag=printFlag, region=region, stop_at_shock=first_shock_only)
+            if previous_front is not None and self.frontline_points == previous_front:
+                # nothing left to intersect (the partners of the remaining points were retired), the region is covered
                 if printFlag:
-                    print('plotting current geometry')
-                self.plot_geometry(**plotkwargs)
+                    print('frontline stalled, region of interest covered')
+                breakLoop = True
+            if not breakLoop and all(p.boundary is not None for p in self.frontline_points):
+                if printFlag:
+                    print('no interior points left on the frontline, stopping model')
+                breakLoop = True
+            metrics = self.last_metrics
+            metrics['iter'] = self.iter
+            self.iter +=1
+            if self._write_outputs(printFlag, checkpoint_path, plotter, plotkwargs, exporters,
+                                   checkpoint=checkpoint_path is not None and not breakLoop and (
+                                       (checkpoint_interval > 0 and self.iter % checkpoint_interval == 0) or
+                                       (checkpoint_seconds is not None and
+                                        time.perf_counter() - last_checkpoint >= checkpoint_seconds)),
+                                   plot=plot_interval > 0 and self.iter % plot_interval == 0,
+                                   export=bool(exporters) and export_interval > 0 and self.iter % export_interval == 0):
+                last_checkpoint = time.perf_counter()
+            if trace_memory:
+                metrics['memory_peak'] = tracemalloc.get_traced_memory()[1]
+            metrics['reach'] = self.reach
+            for observer in self.observers:
+                observer(self, metrics)
+        if stop_tracing:
+            tracemalloc.stop()
+        if self.archive is not None:
+            self.archive.flush()
         if plot_interval > 0:
             if printFlag:
                 print('plotting current geometry')
-            self.plot_geometry(**plotkwargs)
-
-
-    def plot_geometry(self, save = False, markers=True, plot_frontline=True):
-        fig, ax = plt.subplots(figsize = (8, 6))
-
-        for dead_char in self.dead_characteristics:
-
-            if dead_char.end is None:
-                continue # if, for some reason, we reach a char that has no end point yet, skip it
-
-            xplot = [dead_char.origin.pos[0], dead_char.end.pos[0]]
-            yplot = [dead_char.origin.pos[1], dead_char.end.pos[1]]
-
-            if dead_char.type in [1, -1]: # normal chars colored in grey, other configs can be passed through the advance function
-                ax.plot(xplot, yplot, color='k', alpha = 0.5, linestyle='dashed')
-            else: # gamma 0 (boundaries) highlighted in blue
-                ax.plot(xplot, yplot, color='k')
-
-        if plot_frontline:
-            for fl_char in self.frontline_characteristics:  # plot frontline points
-
-                ax.plot([fl_char.origin.pos[0]], [fl_char.origin.pos[1]], color='r', linestyle='dashed', marker = 'x')
-
-
-        # ax.set_ylim(0, 2)
-        ax.set_xlim(0, max([p.pos[0] for p in self.frontline_points]))
-
-        ax.set_xlabel('x')
-        ax.set_ylabel('y')
-        # ax.set_aspect('equal')
-
-        ax.grid()
-
-        if markers: # remove markers if flag is unset
-            for line in ax.lines:
-                line.set_marker('x')
-        if save:
-            curdir = os.getcwd()
-            plt.savefig(
-                "{}/plots/{}_{}.svg".format(curdir, 'geometry', self.iter)
-            )
-        else:
-            plt.show()
-
-        plt.clf()
-        plt.close(fig)
-
-    def plot_contours(self, property : str, save = False, plot_characteristics=True, plot_frontline=True, plot_boundaries=True):
-        # getattr(a, property, 'default value')
-
-        all_points = self.dead_points.union(self.frontline_points)
-        x = np.array(
-            [p.pos[0] for p in all_points]
-        )
-
-        y = np.array(
-            [p.pos[1] for p in all_points]
-        )
-
-        z = np.array(
-            [getattr(p, property) for p in all_points]
-        )  # contourplot value
+            self._plot_geometry(plotter, plotkwargs)
+        for exporter in exporters:
+            exporter.export(self)
+
+    def _write_outputs(self, printFlag, checkpoint_path, plotter, plotkwargs, exporters, checkpoint, plot, export):
+        # the outputs of run due after an iteration, their wall times go to last_metrics,
+        # returns whether a checkpoint was written
+        metrics = self.last_metrics
+        if checkpoint:
+            if printFlag:
+                print('writing checkpoint to {}'.format(checkpoint_path))
+            start = time.perf_counter()
+            self.save_checkpoint(checkpoint_path)
+            metrics['checkpoint'] = time.perf_counter() - start
+        if plot:
+            if printFlag:
+                print('plotting current geometry')
+            start = time.perf_counter()
+            self._plot_geometry(plotter, plotkwargs)
+            metrics['plot'] = time.perf_counter() - start
+        if export:
+            start = time.perf_counter()
+            for exporter in exporters:
+                exporter.export(self)
+            metrics['export'] = time.perf_counter() - start
+        return checkpoint
+
+
+    def geometry_snapshot(self, start=0):
+        # arrays needed to draw the current geometry (see plotting.render_geometry), cheap to pickle,
+        # with start > 0 only the segments of the dead characteristics from the start-th on (see dead_segment_chunks)
+        segments = list(self.dead_segment_chunks(start)) or [segment_columns(self.characteristics, [])]
+        return {
+            'iter': self.iter,
+            'reach': self.reach,
+            'start': start,
+            'segments': {name: np.concatenate([chunk[name] for chunk in segments]) for name in ('x0', 'y0', 'x1', 'y1', 'type')},
+            'frontline': np.array([c.origin.pos for c in self.frontline_characteristics]).reshape(-1, 2),
+        }
+
+    def plot_geometry(self, save = False, markers=True, plot_frontline=True, fmt='svg', rasterized=True):
+        render_geometry(self.geometry_snapshot(), self.plot_path('geometry', fmt) if save else None,
+                        markers=markers, plot_frontline=plot_frontline, rasterized=rasterized)
+
+    def plot_contours(self, property : str, save = False, plot_characteristics=True, plot_frontline=True, plot_boundaries=True,
+                      levels=DEFAULT_LEVELS, fmt='svg', rasterized=True):
+        # levels is the number of filled contour levels (or a sequence of level values),
+        # rasterized (the default) embeds the contours and characteristics as an image when saving to svg,
+        # rasterized=False draws them as vector paths, which grow with the net
+        import matplotlib.pyplot as plt
+
+        z = self.field(property)  # contourplot value
+        # shock points have no flow state (nan invariants), the contours are triangulated over the other points
+        finite = np.isfinite(z)
+        x = self.field('x')[finite]
+        y = self.field('y')[finite]
+        z = z[finite]
 
         fig, ax = plt.subplots(figsize = (8, 6))
         if plot_characteristics or plot_boundaries:
-            for dead_char in self.dead_characteristics:
-
-                if dead_char.end is None:
-                    continue # if, for some reason, we reach a char that has no end point yet, skip it
-
-                xplot = [dead_char.origin.pos[0], dead_char.end.pos[0]]
-                yplot = [dead_char.origin.pos[1], dead_char.end.pos[1]]
-
-                if dead_char.type in [1, -1]: # normal chars colored in grey, other configs can be passed through the advance function
-                    if plot_characteristics:
-                        ax.plot(xplot, yplot, color='k', alpha = 0.5, linestyle='dashed')
-                elif plot_boundaries: # gamma 0 (boundaries) highlighted in blue
-                    ax.plot(xplot, yplot, color='k')
+            segments = list(self.dead_segment_chunks())
+            segments = {name: np.concatenate([chunk[name] for chunk in segments]) for name in ('x0', 'y0', 'x1', 'y1', 'type')}
+            draw_segments(ax, segments, characteristics=plot_characteristics, boundaries=plot_boundaries,
+                          rasterized=rasterized)
 
-        if plot_frontline:
-            for fl_char in self.frontline_characteristics: # plot frontline points
+        if plot_frontline: # plot frontline points
+            origins = np.array([c.origin.pos for c in self.frontline_characteristics]).reshape(-1, 2)
+            ax.plot(origins[:, 0], origins[:, 1], color='k', linestyle='none', marker = 'x', rasterized=rasterized)
 
-                ax.plot([fl_char.origin.pos[0]], [fl_char.origin.pos[1]], color='k', linestyle='dashed', marker = 'x')
-
-        if any(z < 0):
+        if np.nanmin(z) < 0:
             cmap = 'rainbow'
-            max_abs = np.max(np.abs(z))
+            max_abs = np.nanmax(np.abs(z))
             vmin = -max_abs
             vmax = max_abs
         else:
             cmap = 'rainbow'
-            vmin = np.min(z)
-            vmax = np.max(z)
+            vmin = np.nanmin(z)
+            vmax = np.nanmax(z)
 
-        lvl = sorted(list(set(z)), key=lambda x: x)
+        if np.ndim(levels) == 0:
+            lvl = np.linspace(np.nanmin(z), np.nanmax(z), max(int(levels), 2))
+        else:
+            lvl = np.asarray(levels)
+        if not np.all(np.diff(lvl) > 0): # constant field
+            lvl = None
         contour = ax.tricontourf(x, y, z, cmap=cmap, levels=lvl, extend='both')
+        if rasterized:
+            contour.set_rasterized(True)
         cbar = fig.colorbar(contour, ax=ax, orientation='vertical', pad=0.1, ticks=np.linspace(vmin, vmax, 10))
         cbar.set_label(property, rotation=90)
 
-        ax.set_xlim(0, max([p.pos[0] for p in self.frontline_points]))
+        ax.set_xlim(0, self.reach)
 
         ax.set_xlabel('x')
         ax.set_ylabel('y')
@@ -338,16 +1115,7 @@ class GeometryCluster:
 
         ax.grid()
 
-        if save:
-            curdir = os.getcwd()
-            plt.savefig(
-                "{}/plots/{}_{}.svg".format(curdir, property, self.iter)
-            )
-        else:
-            plt.show()
-
-        plt.clf()
-        plt.close(fig)
+        save_or_show(fig, self.plot_path(property, fmt) if save else None)
 
 
 
@@ -356,7 +1124,7 @@ if __name__=="__main__":
     from expansionFan import JetExpansionFan
     from helper import prandtl_meyer_from_mach, mach_from_prandtl_meyer
     pm_angle_inlet = prandtl_meyer_from_mach(2.0, 1.4)
-    inlet_conditions = GenericFlowElement(pm_angle_inlet, pm_angle_inlet)
+    inlet_conditions = GenericFlowElement(pm_angle_inlet, pm_angle_inlet, gamma=1.4)
 
     jef = JetExpansionFan(inlet=inlet_conditions, pressure_ratio=1.2, origin=(0, 1), NCHAR=10, gamma=1.4, type=-1)
 
@@ -0,0 +1,235 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from src.archive import POINT_COLUMNS, flow_property
+from src.store import BOUNDARY_CODES
+from src.sweep import CASE_DEFAULTS, build_jet_cluster
+
+# resolutions (N_fan = N_inlet) of the default ladder, each level doubles the previous one
+DEFAULT_LEVELS = [10, 20, 40]
+# x stations (in jet widths) at which the centreline mach number and the jet boundary are sampled
+DEFAULT_PROBES = [1.0, 2.0, 3.0, 4.0]
+# relative error (against the richardson extrapolation) an output has to meet at the recommended level
+DEFAULT_TOLERANCE = 1e-3
+# relative change between levels treated as round-off, i.e. as no change at all
+ROUNDOFF_TOL = 1e-12
+# iterations of the fixed point solve for the observed order on a ladder with varying refinement ratios, and the
+# relative change of the order between iterations at which it is converged
+ORDER_ITERATIONS = 200
+ORDER_TOL = 1e-10
+
+
+def output_names(probes):
+    # outputs sampled at every level, in report order
+    names = ['shock_x', 'shock_y']
+    names += ['centreline_mach@{:g}'.format(x) for x in probes]
+    names += ['boundary_y@{:g}'.format(x) for x in probes]
+    return names
+
+
+def _profile(columns, code, name, stations):
+    # a column (or flow property) along the boundary points with the given code, linearly interpolated
+    # at the x stations (None outside the part of the boundary the march reached)
+    rows = columns['boundary'] == code
+    order = np.argsort(columns['x'][rows], kind='stable')
+    values = flow_property({key: column[rows][order] for key, column in columns.items()}, name)
+    finite = np.isfinite(values)  # shock points have no flow state
+    x, values = columns['x'][rows][order][finite], values[finite]
+    if len(x) < 2:
+        return [None] * len(stations)
+    return [float(np.interp(s, x, values)) if x[0] <= s <= x[-1] else None for s in stations]
+
+
+def sample_outputs(gc, probes, jet_width=1.0):
+    # the outputs of output_names from a solved cluster: first shock location, mach number on the lower
+    # (symmetry) boundary and y of the upper (jet) boundary at the probe stations
+    _, rows = np.unique(gc.field('index'), return_index=True)
+    columns = {name: gc.field(name)[rows] for name in POINT_COLUMNS}
+    stations = [x * jet_width for x in probes]
+
+    shock = gc.shock_location
+    values = [None, None] if shock is None else [float(shock[0]), float(shock[1])]
+    values += _profile(columns, BOUNDARY_CODES['lower'], 'mach_number', stations)
+    values += _profile(columns, BOUNDARY_CODES['upper'], 'y', stations)
+    return dict(zip(output_names(probes), values))
+
+
+def run_level(case, n, probes, run_options):
+    # run the case at resolution n in this (worker) process, returns the sampled outputs with the wall time and
+    # the peak resident memory of the process
+    case = dict(case, N_fan=n, N_inlet=n)
+    gc = build_jet_cluster(**case, **run_options.get('cluster', {}))
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # run prints every iteration
+        gc.run(**run_options.get('run', {}))
+    wall_time = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return {
+        'n': n,
+        'iterations': gc.iter,
+        'points': len(gc.points),
+        'wall_time': wall_time,
+        'memory_peak': peak,  # bytes
+        'outputs': sample_outputs(gc, probes, case['jet_width']),
+    }
+
+
+def observed_order(coarse, medium, fine, r21, r32):
+    # observed order of convergence from three levels with refinement ratios r21 = n_medium / n_coarse and
+    # r32 = n_fine / n_medium (fixed point iteration of celik et al. 2008 where the ratios differ),
+    # None where the differences vanish or do not converge monotonically, raises RuntimeError if the fixed point
+    # iteration does not converge (it diverges on ladders refined much less in the last step than in the first)
+    if None in (coarse, medium, fine):
+        return None
+    e21, e32 = medium - coarse, fine - medium
+    scale = ROUNDOFF_TOL * max(abs(coarse), abs(medium), abs(fine))
+    if abs(e21) <= scale or abs(e32) <= scale or e32 / e21 < 0:  # converged to round-off, or oscillating
+        return None
+    p = abs(math.log(abs(e21 / e32))) / math.log(r32)
+    if r21 != r32:
+        # with h ~ 1 / n: e21 / e32 = r32^p (r21^p - 1) / (r32^p - 1)
+        try:
+            for _ in range(ORDER_ITERATIONS):
+                q = math.log((r32**p - 1) / (r21**p - 1))
+                p, previous = abs(math.log(abs(e21 / e32)) + q) / math.log(r32), p
+                if abs(p - previous) <= ORDER_TOL * p:
+                    break
+            else:
+                raise RuntimeError('observed order did not converge in {} iterations'.format(ORDER_ITERATIONS))
+        except (OverflowError, ValueError, ZeroDivisionError):
+            raise RuntimeError('observed order iteration diverged') from None
+    return p
+
+
+def richardson(medium, fine, r, p):
+    # richardson extrapolation of the two finest levels (refinement ratio r) for observed order p
+    if p is None or None in (medium, fine):
+        return None
+    return fine + (fine - medium) / (r**p - 1)
+
+
+def analyse(levels, tolerance=DEFAULT_TOLERANCE):
+    # observed order, extrapolated value, per-level relative error and the cheapest level within tolerance of every
+    # output (from the three finest levels), and the cheapest level at which every extrapolated output is within it
+    levels = sorted(levels, key=lambda level: level['n'])
+    names = list(levels[0]['outputs'])
+    report = {}
+    if len(levels) < 3:
+        return report, None
+    coarse, medium, fine = levels[-3:]
+    r21, r32 = medium['n'] / coarse['n'], fine['n'] / medium['n']
+
+    for name in names:
+        values = [level['outputs'][name] for level in levels]
+        try:
+            p, note = observed_order(*values[-3:], r21, r32), None
+        except RuntimeError as error:
+            p, note = None, str(error)
+        exact = richardson(values[-2], values[-1], r32, p)
+        if exact is None and None not in values[-2:] and abs(values[-1] - values[-2]) <= ROUNDOFF_TOL * abs(values[-1]):
+            exact = values[-1]  # no change under the last refinement (e.g. upstream of the first wave)
+        errors = [None if exact is None or value is None else abs(value - exact) / max(abs(exact), 1e-300)
+                  for value in values]
+        sufficient = next((level['n'] for level, error in zip(levels, errors) if error is not None and error <= tolerance),
+                          None)
+        report[name] = {'values': values, 'order': p, 'extrapolated': exact, 'errors': errors, 'sufficient': sufficient,
+                        'note': note}
+
+    extrapolated = [entry for entry in report.values() if entry['extrapolated'] is not None]
+    recommended = None
+    for i, level in enumerate(levels):
+        if extrapolated and all(entry['errors'][i] is not None and entry['errors'][i] <= tolerance
+                                for entry in extrapolated):
+            recommended = level['n']
+            break
+    return report, recommended
+
+
+def run_study(case, levels=DEFAULT_LEVELS, probes=DEFAULT_PROBES, run_options=None, tolerance=DEFAULT_TOLERANCE):
+    # run the ladder one level at a time, each in a fresh worker process so the memory peak is that of the level
+    # alone (and levels do not compete for cores with each other), returns the levels, report and recommendation
+    run_options = {} if run_options is None else run_options
+    case = {key: value for key, value in dict(CASE_DEFAULTS, **case).items() if key not in ('N_fan', 'N_inlet')}
+    results = []
+    for n in levels:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            level = pool.submit(run_level, case, n, probes, run_options).result()
+        print('N={:<5} {:6d} iterations {:9.2f} s {:9.1f} MB'.format(
+            n, level['iterations'], level['wall_time'], level['memory_peak'] / 2**20))
+        results.append(level)
+    report, recommended = analyse(results, tolerance)
+    return {'case': case, 'probes': list(probes), 'tolerance': tolerance, 'levels': results, 'report': report,
+            'recommended': recommended}
+
+
+def format_report(study):
+    # plain text table: one row per output with its value at every level, observed order and extrapolation
+    def cell(value, fmt='{:.6g}'):
+        return '-' if value is None else fmt.format(value)
+
+    levels = study['levels']
+    columns = ['output'] + ['N={}'.format(level['n']) for level in levels] + ['order', 'extrapolated', 'N within tol']
+    rows = [[name] + [cell(v) for v in entry['values']] +
+            [cell(entry['order'], '{:.2f}'), cell(entry['extrapolated']), cell(entry['sufficient'], '{}')]
+            for name, entry in study['report'].items()]
+    rows.append(['wall time [s]'] + [cell(level['wall_time'], '{:.2f}') for level in levels] + [''] * 3)
+    rows.append(['memory [MB]'] + [cell(level['memory_peak'] / 2**20, '{:.1f}') for level in levels] + [''] * 3)
+    widths = [max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(columns)]
+    lines = ['  '.join(c.ljust(w) for c, w in zip(columns, widths))]
+    lines += ['  '.join(v.ljust(w) for v, w in zip(row, widths)) for row in rows]
+    lines += ['{}: {}'.format(name, entry['note']) for name, entry in study['report'].items() if entry.get('note')]
+    if study['recommended'] is None:
+        lines.append('no level meets a relative error of {:g} on every extrapolated output'.format(study['tolerance']))
+    else:
+        lines.append('cheapest level within a relative error of {:g}: N={}'.format(study['tolerance'], study['recommended']))
+    return '\n'.join(lines)
+
+
+def _parse_case(items):
+    # key=value pairs of CASE_DEFAULTS parameters
+    case = {}
+    for item in items:
+        key, _, value = item.partition('=')
+        if key not in CASE_DEFAULTS:
+            raise ValueError('unknown case parameter {}, expected one of {}'.format(key, sorted(CASE_DEFAULTS)))
+        case[key] = type(CASE_DEFAULTS[key])(value)
+    return case
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='grid convergence study of a jet expansion case')
+    parser.add_argument('-c', '--case', nargs='+', default=[],
+                        help='case parameters as key=value (defaults as in sweep.CASE_DEFAULTS)')
+    parser.add_argument('-n', '--levels', nargs='+', type=int, default=DEFAULT_LEVELS, help='N_fan = N_inlet values')
+    parser.add_argument('-p', '--probes', nargs='+', type=float, default=DEFAULT_PROBES,
+                        help='x stations (in jet widths) of the centreline and boundary outputs')
+    parser.add_argument('-t', '--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='relative error the recommended level has to meet')
+    parser.add_argument('--engine', default='lattice', help='marching engine (see GeometryCluster)')
+    parser.add_argument('--max-iter', type=int, default=100000)
+    parser.add_argument('-o', '--output', default=None, help='json file to write the study to')
+    args = parser.parse_args(argv)
+
+    if len(args.levels) < 3:
+        parser.error('the observed order needs at least three levels')
+    run_options = {'cluster': {'engine': args.engine}, 'run': {'max_iter': args.max_iter}}
+    study = run_study(_parse_case(args.case), sorted(args.levels), args.probes, run_options, args.tolerance)
+    print(format_report(study))
+    if args.output is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(study, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -34,7 +34,7 @@ class JetExpansionFan:
         pm_outlet = prandtl_meyer_from_mach(mach_outlet, self.gamma)
         flow_direction_outlet = pm_outlet - self.inlet.v_plus
 
-        self.outlet = GenericFlowElement(self.inlet.v_plus, pm_outlet + flow_direction_outlet)
+        self.outlet = GenericFlowElement(self.inlet.v_plus, pm_outlet + flow_direction_outlet, gamma=self.gamma)
 
     def initialize_characteristics(self):
         # assuming jet expansion increases flow angle
@@ -0,0 +1,179 @@
+import abc
+import json
+import os
+import re
+
+import numpy as np
+from src.archive import FLOW_FIELDS, point_columns, flow_property
+from src.store import BOUNDARY_CODES, NO_INDEX
+
+# columns of the exported characteristic segments: segment_index is the row in the characteristic store, origin and
+# end the point rows (the index column of the points) of its end points, end is NO_INDEX without an end point
+SEGMENT_COLUMNS = {'segment_index': np.int64, 'origin': np.int64, 'end': np.int64, 'type': np.int8}
+# vtk names of the numpy types written to polydata files
+VTK_TYPES = {'float64': 'Float64', 'float32': 'Float32', 'int64': 'Int64', 'int32': 'Int32', 'int8': 'Int8',
+             'uint8': 'UInt8'}
+
+
+def _point_data(store, rows, fields):
+    # point columns (see archive.POINT_COLUMNS) of the given store rows with the flow fields added
+    columns = point_columns(store, rows)
+    for name in fields:
+        columns[name] = flow_property(columns, name)
+    return columns
+
+
+def _replace(path, write):
+    # write(f) to a temporary file moved over path, so readers never see a partially written file
+    with open(path + '.tmp', 'wb') as f:
+        write(f)
+    os.replace(path + '.tmp', path)
+
+
+class NetExporter(abc.ABC):
+    # writes the solved net of a GeometryCluster to directory in parts, every export(cluster) appends one part with
+    # the points and dead characteristic segments added to the cluster stores since the previous call (store rows do
+    # not change once added, so the parts together are the net), e.g. every plot_interval via run(exporters=...).
+    # an exporter starts a new export, parts an earlier export left under the same name are removed
+    EXTENSION = None
+
+    def __init__(self, directory, name='net', fields=FLOW_FIELDS):
+        self.directory = directory
+        self.name = name
+        self.fields = tuple(fields)
+        self.parts = 0
+        self.exported_points = 0  # point store rows exported so far
+        self.exported_segments = 0  # characteristic store rows exported so far
+        os.makedirs(directory, exist_ok=True)
+        stale = re.compile(r'{}\.\d+\.{}$'.format(re.escape(name), self.EXTENSION))
+        for filename in os.listdir(directory):
+            if stale.match(filename):
+                os.remove(os.path.join(directory, filename))
+
+    def part_path(self, k):
+        return os.path.join(self.directory, '{}.{}.{}'.format(self.name, k, self.EXTENSION))
+
+    def export(self, cluster):
+        # append the rows added since the last call as a new part, returns its path or None if nothing was added
+        points = np.arange(self.exported_points, len(cluster.points))
+        segments = np.arange(self.exported_segments, len(cluster.characteristics))
+        if len(points) == 0 and len(segments) == 0:
+            return None
+        chars = cluster.characteristics
+        segment_data = {'segment_index': segments, 'origin': chars.values('origin', segments),
+                        'end': chars.values('end', segments), 'type': chars.values('type', segments)}
+
+        path = self.part_path(self.parts)
+        self._write_part(path, cluster, points, segment_data)
+        self.parts += 1
+        self.exported_points = len(cluster.points)
+        self.exported_segments = len(chars)
+        self._write_index(cluster)
+        return path
+
+    @abc.abstractmethod
+    def _write_part(self, path, cluster, points, segments):
+        # write the store rows points and the segment columns segments (SEGMENT_COLUMNS) to the part at path
+        pass
+
+    @abc.abstractmethod
+    def _write_index(self, cluster):
+        # rewrite the index of the parts written so far
+        pass
+
+
+class NpzExporter(NetExporter):
+    # parts <name>.<k>.npz holding the new points (index, x, y, invariants, gamma, ptot, boundary code and the flow
+    # fields) and segments (SEGMENT_COLUMNS) as flat arrays, <name>.json lists the complete parts with the boundary
+    # codes, read the export back with load_npz
+    EXTENSION = 'npz'
+
+    def _write_part(self, path, cluster, points, segments):
+        arrays = dict(_point_data(cluster.points, points, self.fields), **segments)
+        _replace(path, lambda f: np.savez(f, **arrays))
+
+    def _write_index(self, cluster):
+        index = {
+            'parts': self.parts,
+            'iter': cluster.iter,
+            'fields': list(self.fields),
+            'boundary_codes': {str(name): code for name, code in BOUNDARY_CODES.items()},
+        }
+        _replace(os.path.join(self.directory, self.name + '.json'), lambda f: f.write(json.dumps(index, indent=2).encode()))
+
+
+def load_npz(directory, name='net'):
+    # the parts of an NpzExporter export listed in its index, concatenated: {column: array}
+    with open(os.path.join(directory, name + '.json')) as f:
+        index = json.load(f)
+    parts = [np.load(os.path.join(directory, '{}.{}.npz'.format(name, k))) for k in range(index['parts'])]
+    if not parts:
+        return {}
+    return {key: np.concatenate([part[key] for part in parts]) for key in parts[0].files}
+
+
+def write_vtp(path, points, point_data, lines, cell_data):
+    # vtk xml polydata file with raw appended binary data: points (n, 3), lines (m, 2) indices into points and
+    # point / cell data arrays {name: (n,) or (m,) array}
+    blocks = []
+
+    def data_array(array, attributes):
+        array = np.ascontiguousarray(array, dtype=np.asarray(array).dtype.newbyteorder('<'))
+        offset = sum(8 + block.nbytes for block in blocks)
+        blocks.append(array)
+        return '<DataArray type="{}" {} format="appended" offset="{}"/>'.format(
+            VTK_TYPES[array.dtype.name], attributes, offset)
+
+    lines = np.asarray(lines, dtype=np.int64).reshape(-1, 2)
+    xml = ['<?xml version="1.0"?>',
+           '<VTKFile type="PolyData" version="1.0" byte_order="LittleEndian" header_type="UInt64">',
+           '<PolyData>',
+           '<Piece NumberOfPoints="{}" NumberOfVerts="0" NumberOfLines="{}" NumberOfStrips="0" NumberOfPolys="0">'.format(
+               len(points), len(lines)),
+           '<PointData>']
+    xml += [data_array(array, 'Name="{}"'.format(name)) for name, array in point_data.items()]
+    xml += ['</PointData>', '<CellData>']
+    xml += [data_array(array, 'Name="{}"'.format(name)) for name, array in cell_data.items()]
+    xml += ['</CellData>', '<Points>', data_array(np.asarray(points, dtype=np.float64), 'NumberOfComponents="3"'),
+            '</Points>', '<Lines>',
+            data_array(lines.ravel(), 'Name="connectivity"'),
+            data_array(2 * np.arange(1, len(lines) + 1, dtype=np.int64), 'Name="offsets"'),
+            '</Lines>', '</Piece>', '</PolyData>', '<AppendedData encoding="raw">']
+
+    def write(f):
+        f.write('\n'.join(xml).encode() + b'\n_')
+        for block in blocks:
+            f.write(np.uint64(block.nbytes).astype('<u8').tobytes())
+            f.write(block.tobytes())
+        f.write(b'\n</AppendedData>\n</VTKFile>\n')
+
+    _replace(path, write)
+
+
+class VtkExporter(NetExporter):
+    # parts <name>.<k>.vtp (vtk polydata) holding the new segments as lines, with family type and segment_index as
+    # cell data, over the new points and the earlier points the new segments start from (a part is self-contained,
+    # such points appear in more than one part with the same index and values), the point data are the flow fields,
+    # invariants, boundary code and index. <name>.vtm (multiblock of the complete parts) opens the net in paraview
+    EXTENSION = 'vtp'
+
+    def _write_part(self, path, cluster, points, segments):
+        ends = segments['end'] != NO_INDEX
+        origin, end = segments['origin'][ends], segments['end'][ends]
+        rows = np.unique(np.concatenate([points, origin, end]))
+        data = _point_data(cluster.points, rows, self.fields)
+        xyz = np.column_stack([data.pop('x'), data.pop('y'), np.zeros(len(rows))])
+        lines = np.column_stack([np.searchsorted(rows, origin), np.searchsorted(rows, end)])
+        write_vtp(path, xyz, data, lines, {'type': segments['type'][ends], 'segment_index': segments['segment_index'][ends]})
+
+    def _write_index(self, cluster):
+        blocks = ['<DataSet index="{0}" name="{1}.{0}" file="{1}.{0}.{2}"/>'.format(k, self.name, self.EXTENSION)
+                  for k in range(self.parts)]
+        xml = ['<?xml version="1.0"?>',
+               '<VTKFile type="vtkMultiBlockDataSet" version="1.0" byte_order="LittleEndian" header_type="UInt64">',
+               '<vtkMultiBlockDataSet>'] + blocks + ['</vtkMultiBlockDataSet>', '</VTKFile>', '']
+        _replace(os.path.join(self.directory, self.name + '.vtm'), lambda f: f.write('\n'.join(xml).encode()))
+
+
+# exporters by format name (run options of sweep)
+EXPORT_FORMATS = {'npz': NpzExporter, 'vtk': VtkExporter}
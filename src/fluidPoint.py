@@ -1,12 +1,88 @@
-from src.helper import prandtl_meyer_from_mach, mach_from_prandtl_meyer
+from src.helper import flow_state
+from src.store import NO_INDEX
 import numpy as np
 
+# bit flags marking which characteristics of a point have been tried
+GAMMA_PLUS_FLAG = 1
+GAMMA_MINUS_FLAG = 2
+GAMMA_ZERO_FLAG = 4
+ALL_CHARS_FLAGS = GAMMA_PLUS_FLAG | GAMMA_MINUS_FLAG | GAMMA_ZERO_FLAG
+
+# characteristics pre-exhausted by each boundary condition
+BOUNDARY_FLAGS = {
+    None: GAMMA_ZERO_FLAG,
+    "upper": GAMMA_PLUS_FLAG,
+    "lower": GAMMA_MINUS_FLAG,
+    "plus_only": GAMMA_ZERO_FLAG | GAMMA_MINUS_FLAG,
+    "minus_only": GAMMA_ZERO_FLAG | GAMMA_PLUS_FLAG,
+}
+
+def derive_flow_state(elements):
+    # fill the derived state cache of the flow elements that have none yet (see GenericFlowElement._derived_state)
+    # with one helper.flow_state call for all of them, e.g. for the new points of a frontline
+    elements = [element for element in elements if element._derived is None]
+    if not elements:
+        return
+    pm = np.array([(element.v_plus + element.v_minus) / 2 for element in elements])
+    fd = np.array([(element.v_minus - element.v_plus) / 2 for element in elements])
+    mach, mach_angle, cos_fd, sin_fd = flow_state(pm, fd, [element.gamma for element in elements])
+    for element, state in zip(elements, zip(pm.tolist(), fd.tolist(), mach.tolist(), mach_angle.tolist(),
+                                            cos_fd.tolist(), sin_fd.tolist())):
+        element._derived = state
+
+
 class GenericFlowElement():
+    # derived quantities are computed once on first access and cached in _derived,
+    # the cache is dropped whenever v_plus, v_minus or gamma change
+    __slots__ = ('_v_plus', '_v_minus', '_gamma', '_ptot', '_derived')
+
     def __init__(self, v_plus, v_minus, gamma=1.4, ptot = 1e6):
-        self.v_plus = v_plus
-        self.v_minus = v_minus
-        self.gamma = gamma
-        self.ptot = ptot
+        self._v_plus = v_plus
+        self._v_minus = v_minus
+        self._gamma = gamma
+        self._ptot = ptot
+        self._derived = None
+
+    @property
+    def v_plus(self):
+        return self._v_plus
+
+    @v_plus.setter
+    def v_plus(self, value):
+        self._v_plus = value
+        self._derived = None
+
+    @property
+    def v_minus(self):
+        return self._v_minus
+
+    @v_minus.setter
+    def v_minus(self, value):
+        self._v_minus = value
+        self._derived = None
+
+    @property
+    def gamma(self):
+        return self._gamma
+
+    @gamma.setter
+    def gamma(self, value):
+        self._gamma = value
+        self._derived = None
+
+    @property
+    def ptot(self):
+        return self._ptot
+
+    @ptot.setter
+    def ptot(self, value):
+        self._ptot = value
+
+    def _derived_state(self):
+        # (prandtl-meyer angle, flow direction, mach number, mach angle, cos and sin of flow direction)
+        if self._derived is None:
+            derive_flow_state((self,))
+        return self._derived
 
     @property
     def prandtl_meyer_angle(self):
@@ -18,19 +94,21 @@ class GenericFlowElement():
 
     @property
     def mach_number(self):
-        return mach_from_prandtl_meyer(self.prandtl_meyer_angle)
+        return self._derived_state()[2]
 
     @property
     def mach_angle(self):
-        return np.arcsin(1 / self.mach_number)
+        return self._derived_state()[3]
 
     @property
     def gamma_plus_direction(self):
-        return self.flow_direction + self.mach_angle
+        derived = self._derived_state()
+        return derived[1] + derived[3]
 
     @property
     def gamma_minus_direction(self):
-        return self.flow_direction - self.mach_angle
+        derived = self._derived_state()
+        return derived[1] - derived[3]
 
     @property
     def pressure_over_total_pressure(self):
@@ -41,56 +119,194 @@ class GenericFlowElement():
         return self.pressure_over_total_pressure * self.ptot
 
 class FluidPoint(GenericFlowElement): # generic flow element with position added!
-    def __init__(self, pos, v_plus=None, v_minus=None, boundary=None, gamma=1.4, ptot = 1e6):
+    # a point either owns its values (detached) or is a view into row _index of a PointStore (attached),
+    # GeometryCluster attaches every point it accepts so the whole net is also available as columns
+    __slots__ = ('_pos', '_boundary', '_flag_bits', '_ending_characteristics', '_store', '_index')
 
-        self.pos = pos # x y coordinates
+    def __init__(self, pos, v_plus=None, v_minus=None, boundary=None, gamma=1.4, ptot = 1e6):
 
-        self.boundary = boundary # flag to check if point is on the boundary
+        self._store = None
+        self._index = NO_INDEX
 
-        # booleans checking if characteristics have been tried
-        self._gamma_plus_bool = False
-        self._gamma_minus_bool = False
-        self._gamma_zero_bool = False
+        self._pos = pos # x y coordinates
 
-        # match the characteristics to shoot based on the boundary condition
-        if self.boundary == "upper":
-            self._gamma_plus_bool = True
-        if self.boundary == "lower":
-            self._gamma_minus_bool = True
-        if self.boundary == "plus_only":
-            self._gamma_zero_bool = True
-            self._gamma_minus_bool = True
-        if self.boundary == "minus_only":
-            self._gamma_zero_bool = True
-            self._gamma_plus_bool = True
-        if self.boundary is None:
-            self._gamma_zero_bool = True
+        self._boundary = boundary # flag to check if point is on the boundary
+        # accepted values: "lower", "upper", "plus_only", "minus_only"
 
-        # accepted values: "lower", "upper"
+        # bit flags checking if characteristics have been tried,
+        # matched to the characteristics to shoot based on the boundary condition
+        self._flag_bits = BOUNDARY_FLAGS.get(boundary, 0)
 
-        self.ending_characteristics = set({}) # store reference to all characteristics ending at this point
+        self._ending_characteristics = () # store reference to all characteristics ending at this point
 
         super().__init__(v_plus, v_minus, gamma, ptot)
 
+    def attach(self, store):
+        # move the point values into a PointStore row and turn this object into a view of it
+        if self._store is not None:
+            if self._store is not store:
+                raise ValueError('point is already attached to a different store')
+            return self._index
+
+        self._index = store.add(self, self._pos, self._v_plus, self._v_minus, self._gamma, self._ptot,
+                                self._boundary, self._flag_bits)
+        self._store = store
+        self._pos = self._v_plus = self._v_minus = self._gamma = self._ptot = self._boundary = None
+        self._flag_bits = 0
+        return self._index
+
+    @classmethod
+    def view(cls, store, index):
+        # attached point for an existing PointStore row (see ColumnStore.object)
+        point = cls.__new__(cls)
+        point._store = store
+        point._index = index
+        point._pos = point._v_plus = point._v_minus = point._gamma = point._ptot = point._boundary = None
+        point._flag_bits = 0
+        point._ending_characteristics = ()
+        point._derived = None
+        return point
+
+    @property
+    def store_index(self):
+        return self._index
+
+    @property
+    def pos(self):
+        if self._store is None:
+            return self._pos
+        return self._store.position(self._index)
+
+    @pos.setter
+    def pos(self, value):
+        if self._store is None:
+            self._pos = value
+        else:
+            self._store.set('x', self._index, value[0])
+            self._store.set('y', self._index, value[1])
+
+    @property
+    def boundary(self):
+        if self._store is None:
+            return self._boundary
+        return self._store.boundary_name(self._index)
+
+    @property
+    def v_plus(self):
+        if self._store is None:
+            return self._v_plus
+        return self._store.invariant('v_plus', self._index)
+
+    @v_plus.setter
+    def v_plus(self, value):
+        self._set_value('v_plus', np.nan if value is None else value)
+
+    @property
+    def v_minus(self):
+        if self._store is None:
+            return self._v_minus
+        return self._store.invariant('v_minus', self._index)
+
+    @v_minus.setter
+    def v_minus(self, value):
+        self._set_value('v_minus', np.nan if value is None else value)
+
+    @property
+    def gamma(self):
+        if self._store is None:
+            return self._gamma
+        return float(self._store.get('gamma', self._index))
+
+    @gamma.setter
+    def gamma(self, value):
+        self._set_value('gamma', value)
+
+    @property
+    def ptot(self):
+        if self._store is None:
+            return self._ptot
+        return float(self._store.get('ptot', self._index))
+
+    @ptot.setter
+    def ptot(self, value):
+        self._set_value('ptot', value)
+
+    def _set_value(self, name, value):
+        if self._store is None:
+            setattr(self, '_' + name, None if name.startswith('v_') and np.isnan(value) else value)
+        else:
+            self._store.set(name, self._index, value)
+        self._derived = None
+
+    @property
+    def _flags(self):
+        if self._store is None:
+            return self._flag_bits
+        return int(self._store.get('flags', self._index))
+
+    @_flags.setter
+    def _flags(self, value):
+        if self._store is None:
+            self._flag_bits = value
+        else:
+            self._store.set('flags', self._index, value)
+
+    def _get_flag(self, flag):
+        return bool(self._flags & flag)
+
+    def _set_flag(self, flag, value):
+        if value:
+            self._flags |= flag
+        else:
+            self._flags &= ~flag
+
+    @property
+    def _gamma_plus_bool(self):
+        return self._get_flag(GAMMA_PLUS_FLAG)
+
+    @_gamma_plus_bool.setter
+    def _gamma_plus_bool(self, value):
+        self._set_flag(GAMMA_PLUS_FLAG, value)
+
+    @property
+    def _gamma_minus_bool(self):
+        return self._get_flag(GAMMA_MINUS_FLAG)
+
+    @_gamma_minus_bool.setter
+    def _gamma_minus_bool(self, value):
+        self._set_flag(GAMMA_MINUS_FLAG, value)
+
+    @property
+    def _gamma_zero_bool(self):
+        return self._get_flag(GAMMA_ZERO_FLAG)
+
+    @_gamma_zero_bool.setter
+    def _gamma_zero_bool(self, value):
+        self._set_flag(GAMMA_ZERO_FLAG, value)
+
+    @property
+    def ending_characteristics(self):
+        return self._ending_characteristics
+
+    def add_ending_characteristic(self, char):
+        if char not in self._ending_characteristics:
+            self._ending_characteristics += (char,)
+
     @property
     def all_chars_exhausted(self):
-        return all((self._gamma_plus_bool, self._gamma_minus_bool, self._gamma_zero_bool))
+        return self._flags & ALL_CHARS_FLAGS == ALL_CHARS_FLAGS
 
     def flow_direction_dot_product(self, other):
-        flow_direction_vec = np.array([
-            np.cos(self.flow_direction),
-            np.sin(self.flow_direction)
-        ])
-        delta_vec = np.array([
-            other.pos[0] - self.pos[0],
-            other.pos[1] - self.pos[1],
-        ])
+        _, _, _, _, cos_fd, sin_fd = self._derived_state()
+        return cos_fd * (other.pos[0] - self.pos[0]) + sin_fd * (other.pos[1] - self.pos[1])
 
-        return np.dot(flow_direction_vec, delta_vec)
+    def flow_direction_dot_product_many(self, x, y):
+        # flow_direction_dot_product towards arrays of positions
+        _, _, _, _, cos_fd, sin_fd = self._derived_state()
+        x0, y0 = self.pos
+        return cos_fd * (np.asarray(x) - x0) + sin_fd * (np.asarray(y) - y0)
 
     def __mul__(self, other) -> float:
         # multiplication of points => return distance squared
 
         return (self.pos[0]-other.pos[0])**2 + (self.pos[1] - other.pos[1])**2
-
-
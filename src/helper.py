@@ -1,6 +1,15 @@
-
+import math
 import numpy as np
-from scipy.optimize import minimize
+from functools import lru_cache
+
+# inverse prandtl-meyer table settings
+PM_TABLE_SIZE = 2048  # number of nodes in the per-gamma lookup table
+PM_TABLE_MACH_MAX = 100.0  # largest mach number covered by the table (Newton handles the rest)
+PM_TOL = 1e-12  # target accuracy of the inverse solve (absolute, in sqrt(M^2 - 1))
+PM_MAX_NEWTON = 50  # hard cap on newton iterations (only reached far outside the table)
+PM_SERIES_BETA = 0.1  # below this beta the prandtl-meyer function is evaluated by its series
+PM_ROUNDOFF = 4 * np.finfo(float).eps  # residuals of nu below this (relative to the angle) are round-off
+
 
 def prandtl_meyer_from_mach(Mach, gamma=1.4):
 
@@ -12,20 +21,152 @@ def prandtl_meyer_from_mach(Mach, gamma=1.4):
 
     return alpha * np.arctan(beta/alpha) - np.arctan(beta)
 
+def prandtl_meyer_max(gamma=1.4):
+    # limit of the prandtl-meyer function as M -> infinity
+    alpha = np.sqrt((gamma+1) / (gamma-1))
+    return (alpha - 1) * np.pi / 2
+
+def _pm_of_beta(beta, alpha):
+    # prandtl-meyer angle as a function of beta = sqrt(M^2 - 1), works on arrays
+    # the closed form cancels catastrophically near M = 1, use the arctan series there instead
+    beta = np.asarray(beta, dtype=float)
+    small = beta < PM_SERIES_BETA
+    nu = alpha * np.arctan(beta/alpha) - np.arctan(beta)
+    if np.any(small):
+        b = beta[small]
+        b2 = b**2
+        series = np.zeros_like(b)
+        term = b
+        for k in range(1, 12):
+            term = -term * b2
+            series += term / (2*k + 1) * (1 / alpha**(2*k) - 1)
+        nu[small] = series
+    return nu
+
+def _pm_of_beta_derivative(beta, alpha):
+    # d(nu)/d(beta), strictly positive for beta > 0
+    b2 = beta**2
+    return b2 * (1 - 1 / alpha**2) / ((1 + b2 / alpha**2) * (1 + b2))
+
+@lru_cache(maxsize=None)
+def _prandtl_meyer_table(gamma):
+    # monotone table of beta against s = nu^(1/3)
+    # near M = 1, nu ~ beta^3 * (1 - 1/alpha^2) / 3, so beta is close to linear in s and interpolates well
+    alpha = np.sqrt((gamma+1) / (gamma-1))
+    beta_max = np.sqrt(PM_TABLE_MACH_MAX**2 - 1)
+    s_max = _pm_of_beta(beta_max, alpha)**(1/3)
+
+    s = np.linspace(0, s_max, PM_TABLE_SIZE)
+    # seed with the small-angle asymptote, then polish every node with newton (table built once per gamma)
+    beta = np.minimum((3 * s**3 / (1 - 1 / alpha**2))**(1/3), beta_max)
+    beta[-1] = beta_max
+    beta = _newton_beta(beta, s**3, alpha)
+
+    s.setflags(write=False)
+    beta.setflags(write=False)
+    return alpha, s, beta
+
+def _newton_beta(beta, pm, alpha, tol=PM_TOL):
+    # solve nu(beta) = pm by newton iterations, starting from beta (arrays of equal shape)
+    beta = np.array(beta, dtype=float)
+    active = pm > 0
+    beta[~active] = 0.0
+    for _ in range(PM_MAX_NEWTON):
+        if not active.any():
+            break
+        b = beta[active]
+        residual = _pm_of_beta(b, alpha) - pm[active]
+        step = residual / _pm_of_beta_derivative(b, alpha)
+        # nu is concave in beta, so a newton step from the right can overshoot below 0 => halve instead
+        b_new = np.where(b - step > 0, b - step, b / 2)
+        beta[active] = b_new
+        # near the prandtl-meyer limit nu is flat in beta and the steps do not shrink below the round-off of nu
+        # divided by nu', so a residual at round-off level ends the iterations as well
+        converged = (np.abs(b_new - b) <= tol * np.maximum(1.0, b_new)) |\
+            (np.abs(residual) <= PM_ROUNDOFF * pm[active])
+        active[np.flatnonzero(active)[converged]] = False
+    else:
+        raise RuntimeError('inverse prandtl-meyer solve did not converge')
+    return beta
+
+def _newton_beta_scalar(beta, pm, alpha, tol=PM_TOL):
+    # scalar counterpart of _newton_beta, avoids numpy overhead for single-point calls
+    for _ in range(PM_MAX_NEWTON):
+        if beta < PM_SERIES_BETA:
+            nu = float(_pm_of_beta(np.array([beta]), alpha)[0])
+        else:
+            nu = alpha * math.atan(beta/alpha) - math.atan(beta)
+        b2 = beta * beta
+        step = (nu - pm) / (b2 * (1 - 1 / alpha**2) / ((1 + b2 / alpha**2) * (1 + b2)))
+        beta_new = beta - step if beta - step > 0 else beta / 2
+        if abs(beta_new - beta) <= tol * max(1.0, beta_new) or abs(nu - pm) <= PM_ROUNDOFF * pm:
+            return beta_new
+        beta = beta_new
+    raise RuntimeError('inverse prandtl-meyer solve did not converge')
+
 def mach_from_prandtl_meyer(pm_radians, gamma=1.4):
-    res = minimize(lambda mach, gamma: abs(prandtl_meyer_from_mach(mach, gamma) - pm_radians),
-                   x0=2.0,
-                   args=(gamma))
+    # inverse of the prandtl-meyer function, accepts scalars or arrays
+    # table lookup in s = nu^(1/3) followed by newton polishing in beta = sqrt(M^2 - 1);
+    # iterations stop once the last correction is below PM_TOL (relative to max(1, beta)),
+    # which with quadratic convergence bounds the remaining error in beta, hence |dM| <= PM_TOL * max(1, M).
+    # close to the limit nu is too flat to resolve beta that finely (beta ~ (alpha^2 - 1) / (nu_max - nu)), there
+    # iterations stop once |nu(beta) - nu| <= PM_ROUNDOFF * nu, i.e. |dM| <= PM_ROUNDOFF * nu / (dnu / dbeta),
+    # the error the round-off of the angle itself causes
+    # angles <= 0 map to M = 1, angles >= the prandtl-meyer limit map to M = inf, nan propagates
+
+    alpha, s_table, beta_table = _prandtl_meyer_table(float(gamma))
+
+    if np.ndim(pm_radians) == 0:  # fast path for single points
+        pm = float(pm_radians)
+        if math.isnan(pm):
+            return math.nan
+        if pm <= 0:
+            return 1.0
+        if pm >= prandtl_meyer_max(gamma):
+            return math.inf
+        beta = _newton_beta_scalar(float(np.interp(pm**(1/3), s_table, beta_table)), pm, alpha)
+        return math.sqrt(1 + beta * beta)
+
+    pm = np.asarray(pm_radians, dtype=float)
+    pm_flat = pm.ravel()
+
+    nu_max = prandtl_meyer_max(gamma)
+    beyond = pm_flat >= nu_max
+    invalid = np.isnan(pm_flat)
+    pm_clipped = np.where(beyond | invalid, 0.0, np.maximum(pm_flat, 0.0))
+
+    beta0 = np.interp(np.cbrt(pm_clipped), s_table, beta_table)  # clips to the last node outside the table
+    beta = _newton_beta(beta0, pm_clipped, alpha)
 
-    return res.x[0]
+    mach = np.sqrt(1 + beta**2)
+    mach[beyond] = np.inf
+    mach[invalid] = np.nan
+
+    return mach.reshape(pm.shape)
+
+def flow_state(pm, fd, gamma):
+    # mach number, mach angle and cos / sin of the flow direction for arrays of prandtl-meyer angles pm, flow
+    # directions fd and gammas, elementwise: a value does not depend on the other entries of the arrays, so
+    # FluidPoint (one point or a batch at a time) and the vectorized engines, which all derive their state with
+    # it, agree to the last bit
+    pm, fd, gamma = (np.asarray(v, dtype=float) for v in (pm, fd, gamma))
+    mach = np.empty(len(pm))
+    for g in np.unique(gamma):  # one vectorized solve per distinct gamma
+        rows = gamma == g
+        mach[rows] = mach_from_prandtl_meyer(pm[rows], float(g))
+    return mach, np.arcsin(1 / mach), np.cos(fd), np.sin(fd)
 
 
 if __name__ == "__main__":
-    for M in np.linspace(1.01, 2.5, 100):
+    for gamma in [1.1, 1.3, 1.4, 5/3]:
+        M = np.concatenate([1 + np.logspace(-8, 0, 200), np.linspace(2.0, 60.0, 2000)])
+        pm = np.array([prandtl_meyer_from_mach(m, gamma) for m in M])
+        M_inv = mach_from_prandtl_meyer(pm, gamma)
+        M_scalar = np.array([mach_from_prandtl_meyer(v, gamma) for v in pm])
+        print('gamma={:.3f}: max relative error {:.2e} (vectorized), {:.2e} (scalar)'.format(
+            gamma, np.max(np.abs(M_inv - M) / M), np.max(np.abs(M_scalar - M) / M)))
+
+    for M in np.linspace(1.01, 2.5, 10):
         print('test for M={}'.format(M))
         print(prandtl_meyer_from_mach(M))
-        # print(mach_from_prandtl_meyer(prandtl_meyer_from_mach(M)))
         print('error: {}%'.format((mach_from_prandtl_meyer(prandtl_meyer_from_mach(M)) - M)/M * 100))
-
-
-
@@ -0,0 +1,334 @@
+import time
+
+import numpy as np
+from src.characteristic import Characteristic, RayArrays, intersect_rays, nearest_intersections_among
+from src.fluidPoint import BOUNDARY_FLAGS, GAMMA_PLUS_FLAG, GAMMA_MINUS_FLAG, GAMMA_ZERO_FLAG
+from src.helper import flow_state
+from src.metrics import new_record
+from src.store import BOUNDARY_CODES, BOUNDARY_NAMES, NO_INDEX
+
+# rays on either side along the front that every frontline ray is intersected with by the consistency check
+LATTICE_WINDOW = 6
+# rows (diagonals) of the node arrays allocated at a time
+LATTICE_BLOCK = 256
+
+# node kinds are boundary codes, each kind shoots these characteristic types
+INTERIOR, LOWER, UPPER, MINUS_ONLY = (BOUNDARY_CODES[b] for b in (None, 'lower', 'upper', 'minus_only'))
+RAY_TYPES = {INTERIOR: (1, -1), LOWER: (1, 0), UPPER: (-1, 0), MINUS_ONLY: (-1,)}
+TYPE_FLAGS = {1: GAMMA_PLUS_FLAG, -1: GAMMA_MINUS_FLAG, 0: GAMMA_ZERO_FLAG}
+
+
+class LatticeMarch:
+    # structured marching engine for the jet layout built by sweep.build_jet_cluster: inlet points from the
+    # lower symmetry boundary upwards, followed by the rays of an expansion fan at the upper lip (minus_only
+    # points and a final upper boundary point, all at the lip).
+    #
+    # in that layout every point of the net is a node (i, j) where gamma+ line i meets gamma- line j. gamma+
+    # lines are numbered from the top inlet point down, then in order of their reflection at the lower boundary,
+    # gamma- lines from the lowest inlet point up, through the fan, then in order of reflection at the upper
+    # boundary. node (i, j) follows from (i, j - 1) (its gamma+ predecessor) and (i - 1, j) (its gamma-
+    # predecessor), boundary nodes from one of those and the previous boundary node (i - 1, j - 1).
+    # nodes are kept in arrays indexed by (row, column) = (d - d0, e + Nm) with d = i + j, e = i - j: row d
+    # is exactly what GeometryCluster.advance_frontline computes in iteration d - d0 - 1, so a whole iteration
+    # is one vectorized sweep along a diagonal, using the unit processes of Characteristic.__mul__.
+    #
+    # before a diagonal is accepted, the frontline it starts from is checked for everything that would make the
+    # geometric engine deviate from the lattice (checked within LATTICE_WINDOW rays along the front, like the
+    # 'neighbor' advance mode): every lattice pair must be the unique mutual nearest intersection, no other
+    # frontline ray may pair up, and waiting rays must not hit a dead characteristic. the march stops at the
+    # first diagonal that fails (e.g. coalescing characteristics ahead of a shock) and hands the frontline over
+    # to the geometric engine, which continues from there
+    #
+    # the diagonals are sequential, each one a few dozen numpy calls on arrays of the front size, and every one of
+    # them searches, indexes and evicts the dead segments like an iteration of the geometric engine does. on the
+    # default jet a diagonal takes 4 to 5 times less than a geometric iteration (N = 40: 239 diagonals in 0.65 s
+    # against 2.6 s, N = 80: 479 in 1.9 s against 9.9 s), and the whole run about half as long (3.5 s -> 1.8 s and
+    # 13.1 s -> 5.7 s), as the geometric search still marches the iterations around the shock after the handover
+    def __init__(self, cluster, inlet_rows, fan_rows):
+        self.cluster = cluster
+        self.n_inlet = n_inlet = len(inlet_rows)
+        self.n_minus = n_minus = n_inlet - 1 + len(fan_rows)  # gamma- lines leaving the initial front
+        self.d0 = n_inlet - 2  # diagonal of the initial inlet points
+        self.width = n_inlet + n_minus + 1
+        self.lower_column = n_inlet + n_minus
+        self.rows = 0  # allocated rows
+        self.row = 0  # last accepted row
+        self._allocate(max(LATTICE_BLOCK, len(fan_rows)))
+
+        # initial front: inlet point k is node (i, j) = (n_inlet - 1 - k, k - 1), fan ray m is node (-1, n_inlet - 1 + m)
+        for k, index in enumerate(inlet_rows):
+            self._set_initial(0, n_inlet - 2 * k + n_minus, index)
+        for m, index in enumerate(fan_rows):
+            self._set_initial(m, n_minus - n_inlet - m, index)
+        rows, columns = np.nonzero(self.kind[:self.rows] >= 0)
+        self._derive(rows, columns)
+
+        # live rays of the frontline as (row, column, type), in order along the front (lower boundary first)
+        types = [RAY_TYPES[kind] for kind in self.kind[rows, columns]]
+        self.front = (np.repeat(rows, [len(t) for t in types]), np.repeat(columns, [len(t) for t in types]),
+                      np.array([t for ts in types for t in ts], dtype=np.int8))
+        self._sort_front()
+
+    @classmethod
+    def from_cluster(cls, cluster):
+        # LatticeMarch for a fresh GeometryCluster in the jet layout (see above), None for anything else
+        if cluster.iter != 0 or cluster.dead_points or len(cluster.characteristics) or cluster.tolerance is not None:
+            return None
+        front = sorted(cluster.frontline_points, key=cluster._arc_rank.get)
+        boundary = [p.boundary for p in front]
+        n_inlet = 1 + next((k for k, b in enumerate(boundary[1:]) if b is not None), len(boundary) - 1)
+        fan = front[n_inlet:]
+        if n_inlet < 2 or not fan or boundary[0] != 'lower' or any(b is not None for b in boundary[1:n_inlet]) or\
+                any(b != 'minus_only' for b in boundary[n_inlet:-1]) or boundary[-1] != 'upper' or\
+                any(p.pos != fan[0].pos for p in fan) or any(p._flags != BOUNDARY_FLAGS[p.boundary] for p in front):
+            return None
+        return cls(cluster, [p.store_index for p in front[:n_inlet]], [p.store_index for p in fan])
+
+    def _allocate(self, rows):
+        shape = (rows, self.width)
+        grown = {
+            'x': np.full(shape, np.nan), 'y': np.full(shape, np.nan),
+            'v_plus': np.full(shape, np.nan), 'v_minus': np.full(shape, np.nan),
+            'gamma': np.full(shape, np.nan), 'ptot': np.full(shape, np.nan),
+            'pm': np.full(shape, np.nan), 'flow': np.full(shape, np.nan), 'mach_angle': np.full(shape, np.nan),
+            'kind': np.full(shape, -1, dtype=np.int8),
+            'consumed': np.zeros(shape, dtype=np.uint8),
+            'index': np.full(shape, NO_INDEX, dtype=np.int64),
+        }
+        for name, column in grown.items():
+            if self.rows:
+                column[:self.rows] = getattr(self, name)
+            setattr(self, name, column)
+        self.rows = rows
+
+    def _set_initial(self, row, column, index):
+        points = self.cluster.points
+        for name in ('x', 'y', 'v_plus', 'v_minus', 'gamma', 'ptot'):
+            getattr(self, name)[row, column] = getattr(points, name)[index]
+        self.kind[row, column] = points.boundary[index]
+        self.index[row, column] = index
+
+    def _derive(self, rows, columns):
+        # prandtl-meyer angle, flow direction and mach angle of nodes
+        v_plus, v_minus = self.v_plus[rows, columns], self.v_minus[rows, columns]
+        pm = (v_plus + v_minus) / 2
+        self.pm[rows, columns] = pm
+        self.flow[rows, columns] = (v_minus - v_plus) / 2
+        # with helper.flow_state, as FluidPoint derives its state: the march has to reproduce the geometric engine
+        # exactly (the ordering of the front, and with it the net after the handover, depends on every bit of x)
+        self.mach_angle[rows, columns] = flow_state(pm, self.flow[rows, columns], self.gamma[rows, columns])[1]
+
+    def _sort_front(self):
+        rows, columns, types = self.front
+        order = np.lexsort((-types, -columns))
+        self.front = (rows[order], columns[order], types[order])
+        self._front_key = self._key(*self.front)
+        self._front_order = np.argsort(self._front_key)
+
+    def _key(self, rows, columns, types):
+        return (rows.astype(np.int64) * self.width + columns) * 3 + (types + 1)
+
+    def _find(self, rows, columns, types):
+        # positions in the front of the given rays, -1 for rays that are not on it
+        key = self._key(rows, columns, types)
+        position = np.searchsorted(self._front_key, key, sorter=self._front_order)
+        position = np.minimum(position, len(self._front_key) - 1)
+        found = self._front_order[position]
+        return np.where(self._front_key[found] == key, found, -1)
+
+    def _rays(self, rows, columns, types):
+        flow = self.flow[rows, columns]
+        direction = flow + np.where(types == 1, 1, np.where(types == -1, -1, 0)) * self.mach_angle[rows, columns]
+        return RayArrays._from_columns([None] * len(rows), [self.x[rows, columns], self.y[rows, columns], direction,
+                                                            np.cos(flow), np.sin(flow)])
+
+    def step(self):
+        # compute the next diagonal, returns False (and changes nothing) where the lattice breaks down
+        r = self.row + 1
+        d = self.d0 + r
+        if r + 1 > self.rows:
+            self._allocate(self.rows + LATTICE_BLOCK)
+
+        # nodes of the diagonal: e = i - j between the fan edge (e > -d - 2) and the boundaries
+        columns = np.arange(max(0, self.n_minus - d), self.lower_column + 1)
+        columns = columns[(columns - self.n_minus - d) % 2 == 0]
+        kind = np.where(columns == self.lower_column, LOWER, np.where(columns == 0, UPPER, INTERIOR)).astype(np.int8)
+        # the unit process of every node is (partner * target), as GeometryCluster.advance_frontline forms it:
+        # interior: gamma+ of (i, j-1) * gamma- of (i-1, j), lower: 0 of (i-1, j-1) * gamma- of (i-1, j),
+        # upper: gamma+ of (i, j-1) * 0 of (i-1, j-1)
+        up = np.full(len(columns), r - 1)
+        partner = (np.where(kind == LOWER, r - 2, up), np.where(kind == LOWER, columns, columns + 1),
+                   np.where(kind == LOWER, 0, 1).astype(np.int8))
+        target = (np.where(kind == UPPER, r - 2, up), np.where(kind == UPPER, columns, columns - 1),
+                  np.where(kind == UPPER, 0, -1).astype(np.int8))
+        partner_ray, target_ray = self._find(*partner), self._find(*target)
+        if np.any(partner_ray < 0) or np.any(target_ray < 0):
+            return False
+
+        rows, columns_, types = self.front
+        rays = self._rays(rows, columns_, types)
+        n = len(rays)
+        if not self._consistent(rays, partner_ray, target_ray):
+            return False
+
+        # waiting rays (not consumed by this diagonal) keep their point on the front, where
+        # GeometryCluster searches the dead characteristics for them (find_first_dead_intersection), all at once
+        # here. a ray with a dead hit stops the march unless the hit point is None there as well
+        waiting = np.ones(n, dtype=bool)
+        waiting[partner_ray] = waiting[target_ray] = False
+        waiting = np.flatnonzero(waiting)
+        origins = self.index[rows[waiting], columns_[waiting]]
+        hits = self.cluster._dead_index.first_intersections(rays.take(waiting), origins)
+        points, chars = self.cluster.points, self.cluster.characteristics
+        for i, origin, hit in zip(waiting[hits >= 0], origins[hits >= 0], hits[hits >= 0]):
+            if chars.object(int(hit)) * Characteristic(points.object(int(origin)), type=int(types[i])) is not None:
+                return False
+
+        # new nodes
+        x, y, _ = intersect_rays(rays.x[partner_ray], rays.y[partner_ray], rays.direction[partner_ray],
+                                 rays.x[target_ray], rays.y[target_ray], rays.direction[target_ray])
+        pr, pc = partner[0], partner[1]
+        tr, tc = target[0], target[1]
+        v_plus = np.where(kind == LOWER, self.v_minus[tr, tc] - 2 * self.flow[pr, pc], self.v_plus[pr, pc])
+        v_minus = np.where(kind == LOWER, self.v_minus[tr, tc],
+                           np.where(kind == UPPER, -v_plus + 2 * self.pm[tr, tc], self.v_minus[tr, tc]))
+        self.x[r, columns], self.y[r, columns] = x, y
+        self.v_plus[r, columns], self.v_minus[r, columns] = v_plus, v_minus
+        self.gamma[r, columns], self.ptot[r, columns] = self.gamma[pr, pc], self.ptot[pr, pc]
+        self.kind[r, columns] = kind
+        self._derive(np.full(len(columns), r), columns)
+        self.consumed[pr, pc] |= np.array([TYPE_FLAGS[t] for t in partner[2]], dtype=np.uint8)
+        self.consumed[tr, tc] |= np.array([TYPE_FLAGS[t] for t in target[2]], dtype=np.uint8)
+
+        # register the nodes and the (now dead) characteristics ending at them
+        nodes = np.full(len(columns), r)
+        # store rows in the order GeometryCluster attaches new frontline points (by position), frontline
+        # characteristics starting at the same x are ordered by their store row
+        order = np.lexsort((y, x))
+        self.index[r, columns[order]] = points.extend(
+            x=x[order], y=y[order], v_plus=v_plus[order], v_minus=v_minus[order],
+            gamma=self.gamma[r, columns[order]], ptot=self.ptot[r, columns[order]], boundary=kind[order],
+            flags=[BOUNDARY_FLAGS[BOUNDARY_NAMES[k]] for k in kind[order]])
+        origin = np.concatenate((self.index[pr, pc], self.index[tr, tc]))
+        char_type = np.concatenate((partner[2], target[2]))
+        order = np.lexsort((char_type, origin))
+        chars = self.cluster.characteristics.extend(
+            origin=origin[order], end=np.concatenate((self.index[r, columns],) * 2)[order], type=char_type[order],
+            direction=np.concatenate((rays.direction[partner_ray], rays.direction[target_ray]))[order])
+        self.cluster._dead_index.insert(chars)
+
+        keep = np.ones(n, dtype=bool)
+        keep[partner_ray] = keep[target_ray] = False
+        new_types = [RAY_TYPES[k] for k in kind]
+        counts = [len(t) for t in new_types]
+        self.front = (np.concatenate((rows[keep], np.repeat(nodes, counts))),
+                      np.concatenate((columns_[keep], np.repeat(columns, counts))),
+                      np.concatenate((types[keep], np.array([t for ts in new_types for t in ts], dtype=np.int8))))
+        self._sort_front()
+        self.row = r
+        if self.cluster.eviction:  # as GeometryCluster.evict_unreachable after every iteration
+            self.cluster._evict_dead_segments(float(np.min(self.x[self.front[0], self.front[1]])))
+        return True
+
+    def _consistent(self, rays, partner_ray, target_ray):
+        # whether GeometryCluster.advance_frontline would pair exactly (partner_ray, target_ray) on this front
+        n = len(rays)
+        offsets = np.concatenate((np.arange(-LATTICE_WINDOW, 0), np.arange(1, LATTICE_WINDOW + 1)))
+        window = np.arange(n)[:, None] + offsets[None, :]
+        candidates = np.where((window < 0) | (window >= n), -1, window)
+        first, _, distance, candidate_distance = nearest_intersections_among(rays, rays, candidates, return_all=True)
+
+        # every target hits its partner first, without a tie
+        if np.any(first[target_ray] != partner_ray):
+            return False
+        if np.any(np.sum(distance[target_ray] == np.min(distance[target_ray], axis=1)[:, None], axis=1) > 1):
+            return False
+        # partners hit nothing themselves (their own hit would replace the pairing, depending on the order)
+        if np.any(first[partner_ray] >= 0):
+            return False
+
+        # among all rays hitting a ray, the closest one (from that ray's origin) becomes its complement:
+        # for partners that must be their target (strictly), targets must not be hit at all
+        hitting = np.flatnonzero(first >= 0)
+        hit = first[hitting]
+        measure = candidate_distance[hitting, np.argmin(distance[hitting], axis=1)]
+        order = np.lexsort((measure, hit))
+        hit, measure, hitting = hit[order], measure[order], hitting[order]
+        head = np.r_[True, hit[1:] != hit[:-1]]
+        closest = np.full(n, -1)
+        closest[hit[head]] = hitting[head]
+        tied = np.zeros(n, dtype=bool)
+        second = np.flatnonzero(~head)
+        second = second[head[second - 1]]
+        tied[hit[second]] = measure[second] <= measure[second - 1]
+        if np.any(closest[partner_ray] != target_ray) or np.any(tied[partner_ray]) or np.any(closest[target_ray] >= 0):
+            return False
+
+        # all other hits must end on a partner (which pairs with its target instead)
+        is_partner = np.zeros(n, dtype=bool)
+        is_partner[partner_ray] = True
+        others = np.ones(n, dtype=bool)
+        others[partner_ray] = others[target_ray] = False
+        return not np.any(others & (first >= 0) & ~is_partner[np.maximum(first, 0)])
+
+    def march(self, max_steps, observers=(), region=None):
+        # advance up to max_steps diagonals, one cluster iteration each, returns the number of diagonals computed.
+        # with a region of interest the march stops after the first diagonal that leaves it, the points downstream
+        # are retired by the cluster after the handover (GeometryCluster.retire_outside)
+        cluster = self.cluster
+        steps = 0
+        while steps < max_steps:
+            start = time.perf_counter()
+            if not self.step():
+                break
+            record = cluster.last_metrics = new_record()
+            record['intersection'] = time.perf_counter() - start
+            record['intersections'] = 2 * int(np.count_nonzero(self.kind[self.row] >= 0))
+            record['pair_tests'] = len(self.front[0]) * 2 * LATTICE_WINDOW
+            rows, columns = np.array(sorted(set(zip(self.front[0].tolist(), self.front[1].tolist())))).T
+            x, y = self.x[rows, columns], self.y[rows, columns]
+            inside = np.ones(len(rows), dtype=bool)
+            if region is not None:
+                inside = x <= region[2]
+            record['retired'] = int(np.count_nonzero(~inside))
+            record['frontline_size'] = int(np.count_nonzero(inside))
+            record['iter'] = cluster.iter
+            cluster.iter += 1
+            steps += 1
+            record['reach'] = float(np.max(x[inside])) if inside.any() else float(np.max(cluster.points.x))
+            for observer in observers:
+                observer(cluster, record)
+            if not inside.all():
+                break
+        return steps
+
+    def commit(self):
+        # hand the march over to the cluster: point flags, dead points and characteristics, frontline
+        cluster = self.cluster
+        points = cluster.points
+        rows, columns = np.nonzero(self.kind >= 0)  # including initial fan points beyond the last row
+        index = self.index[rows, columns]
+        boundary_flags = np.array([BOUNDARY_FLAGS[BOUNDARY_NAMES[k]] for k in self.kind[rows, columns]], dtype=np.uint8)
+        points.flags[index] = boundary_flags | self.consumed[rows, columns]
+
+        front_rows, front_columns, _ = self.front
+        front = sorted(set(zip(front_columns.tolist(), front_rows.tolist())), reverse=True)  # lower boundary first
+        front_index = [int(self.index[row, column]) for column, row in front]
+        front_points = [points.object(i) for i in front_index]
+
+        chars = cluster.characteristics
+        on_front = np.isin(chars.end, front_index)
+        for i in np.flatnonzero(on_front):
+            points.object(int(chars.end[i])).add_ending_characteristic(chars.object(int(i)))
+
+        dead = np.setdiff1d(index, front_index)
+        if cluster.archive is None:
+            cluster._add_dead([points.object(int(i)) for i in dead], [chars.object(int(i)) for i in range(len(chars))])
+        else:  # streaming, by row (the characteristics are in the dead segment index already)
+            cluster.archive.append_points(points, dead)
+            cluster.archive.append_segments(chars, np.arange(len(cluster.archive.segments), len(chars)))
+        cluster.frontline_points = set(front_points)
+        cluster._arc_rank = {p: i for i, p in enumerate(front_points)}
+        cluster.get_frontline_characteristics()
+        if cluster.eviction:
+            cluster.evict_unreachable()
@@ -0,0 +1,53 @@
+import csv
+
+# wall time phases of one GeometryCluster iteration (seconds)
+PHASES = ('intersection', 'fallback', 'rebuild', 'checkpoint', 'plot', 'export')
+# counters of one iteration
+COUNTERS = (
+    'pair_tests',  # characteristic pairs considered by the frontline and dead characteristic searches
+    'intersections',  # frontline characteristics that found an intersection on the frontline
+    'global_rows',  # frontline characteristics the neighbor search left to the global search
+    'fallbacks',  # dead characteristic searches for points without a frontline intersection
+    'dead_intersections',  # ... that found an intersection
+    'shocks',  # shock points detected
+    'retired',  # frontline points retired outside the region of interest
+    'frontline_size',  # frontline points after the iteration
+)
+COLUMNS = ('iter', 'reach') + PHASES + COUNTERS + ('memory_peak',)
+
+
+def new_record():
+    # empty per-iteration record, memory_peak (bytes) stays None unless run traces memory
+    record = dict.fromkeys(PHASES, 0.0)
+    record.update(dict.fromkeys(COUNTERS, 0))
+    record.update(iter=None, reach=None, memory_peak=None)
+    return record
+
+
+class MetricsTable:
+    # observer collecting the per-iteration records of GeometryCluster.run, e.g.
+    #   table = MetricsTable()
+    #   gc.add_observer(table)
+    #   gc.run(...)
+    #   table.to_csv('metrics.csv')
+    def __init__(self):
+        self.rows = []
+
+    def __call__(self, cluster, record):
+        self.rows.append(dict(record))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def column(self, name):
+        return [row[name] for row in self.rows]
+
+    def totals(self):
+        # summed phase times and counters over all recorded iterations
+        return {name: sum(row[name] for row in self.rows) for name in PHASES + COUNTERS if name != 'frontline_size'}
+
+    def to_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(self.rows)
@@ -0,0 +1,88 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from src.characteristic import RayArrays, nearest_intersections
+
+# RayArrays columns the workers read from shared memory
+RAY_COLUMNS = ('x', 'y', 'direction', 'cos_flow', 'sin_flow')
+# smallest search (target rows x candidates) that is sharded over the workers, smaller ones run in the calling
+# process where the round trip to the pool would cost more than the search
+PARALLEL_MIN_PAIRS = 2**18
+
+_attached = {}  # worker side: name -> SharedMemory block of the last search
+
+
+def _shared_rays(buffer, n):
+    # RayArrays over the columns in a shared memory block, the kernels only need len() of the characteristics
+    columns = np.ndarray((len(RAY_COLUMNS), n), dtype=np.float64, buffer=buffer)
+    return RayArrays._from_columns(range(n), list(columns))
+
+
+def _search_shard(name, n, rows):
+    # nearest_intersections of the shared rays among themselves for the target rows of one shard
+    if name not in _attached:
+        for block in _attached.values():
+            block.close()
+        _attached.clear()
+        _attached[name] = shared_memory.SharedMemory(name=name)
+    rays = _shared_rays(_attached[name].buf, n)
+    return nearest_intersections(rays, rays, rows)
+
+
+class IntersectionPool:
+    # worker processes sharing the batched nearest intersection search of the frontline (see GeometryCluster.run).
+    # the ray columns are copied once per search into a shared memory block the workers map read-only, the target
+    # rows are dealt out round-robin (rows of every direction, hence similar cost, in every shard) and the results
+    # put back in row order. every row is searched against all candidates with the serial kernel, so the result
+    # does not depend on the number of workers
+    def __init__(self, workers):
+        if int(workers) < 1:
+            raise ValueError('an intersection pool needs at least one worker, got {}'.format(workers))
+        self.workers = int(workers)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._block = None  # SharedMemory, grown as the frontline grows
+
+    def _share(self, rays):
+        n = len(rays)
+        size = max(len(RAY_COLUMNS) * n * np.dtype(np.float64).itemsize, 1)
+        if self._block is None or self._block.size < size:
+            self._release()
+            self._block = shared_memory.SharedMemory(create=True, size=2 * size)
+        columns = np.ndarray((len(RAY_COLUMNS), n), dtype=np.float64, buffer=self._block.buf)
+        for i, name in enumerate(RAY_COLUMNS):
+            columns[i] = getattr(rays, name)
+        del columns  # no exported buffers may be left when the block is closed
+
+    def nearest_intersections(self, rays, rows=None):
+        # nearest_intersections(rays, rays, rows), sharded over the workers if the search is large enough
+        rows = np.arange(len(rays)) if rows is None else np.asarray(rows, dtype=np.int64)
+        if self.workers == 1 or len(rows) * len(rays) < PARALLEL_MIN_PAIRS:
+            return nearest_intersections(rays, rays, rows)
+
+        self._share(rays)
+        shards = min(self.workers, len(rows))
+        futures = [self._pool.submit(_search_shard, self._block.name, len(rays), rows[k::shards]) for k in range(shards)]
+        best = np.empty(len(rows), dtype=np.int64)
+        best_distance = np.empty(len(rows))
+        for k, future in enumerate(futures):
+            best[k::shards], best_distance[k::shards] = future.result()
+        return best, best_distance
+
+    def _release(self):
+        if self._block is not None:
+            self._block.close()
+            self._block.unlink()
+            self._block = None
+
+    def close(self):
+        try:
+            self._pool.shutdown()
+        finally:
+            self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
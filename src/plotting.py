@@ -0,0 +1,130 @@
+import numpy as np
+
+# matplotlib is imported by the drawing functions on first use, and the process pool by SnapshotPlotter, so the
+# solver modules importing this one (for the options below) do not load them in processes that never plot
+# snapshots waiting for (or being rendered by) the background worker before submit blocks
+DEFAULT_QUEUE_SIZE = 2
+# filled contour levels of plot_contours, independent of the number of points in the net
+DEFAULT_LEVELS = 64
+# output formats of saved plots, the characteristics are rasterized by default so that file size and render time
+# stay roughly constant as the net grows (rasterized=False in svg writes them as vector paths)
+PLOT_FORMATS = ('svg', 'png')
+# characteristic families drawn as one collection each: (types, style)
+FAMILY_STYLES = (
+    ((1,), dict(colors='k', alpha=0.5, linestyles='dashed')),
+    ((-1,), dict(colors='k', alpha=0.5, linestyles='dashed')),
+    ((0,), dict(colors='k')),  # boundaries
+)
+
+
+def draw_segments(ax, segments, characteristics=True, boundaries=True, markers=False, rasterized=False):
+    # characteristic segments (columns x0, y0, x1, y1, type) as one LineCollection per family instead of one
+    # artist per segment, segments without an end point are skipped, markers adds the segment end points
+    from matplotlib.collections import LineCollection
+
+    done = ~np.isnan(segments['x1'])
+    for types, style in FAMILY_STYLES:
+        if not (boundaries if types == (0,) else characteristics):
+            continue
+        rows = done & np.isin(segments['type'], types)
+        if not rows.any():
+            continue
+        x = np.stack([segments['x0'][rows], segments['x1'][rows]], axis=1)
+        y = np.stack([segments['y0'][rows], segments['y1'][rows]], axis=1)
+        ax.add_collection(LineCollection(np.stack([x, y], axis=2), rasterized=rasterized, **style))
+        if markers:
+            ax.plot(x.ravel(), y.ravel(), color='k', linestyle='none', marker='x', rasterized=rasterized)
+    ax.autoscale_view()
+
+
+def save_or_show(fig, path):
+    import matplotlib.pyplot as plt
+
+    if path is not None:
+        fig.savefig(path)
+    else:
+        plt.show()
+
+    plt.clf()
+    plt.close(fig)
+
+
+def render_geometry(snapshot, path=None, markers=True, plot_frontline=True, rasterized=True):
+    # draw a geometry snapshot (see GeometryCluster.geometry_snapshot), saved to path or shown if path is None
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize = (8, 6))
+
+    draw_segments(ax, snapshot['segments'], markers=markers, rasterized=rasterized)
+
+    if plot_frontline and len(snapshot['frontline']):  # plot frontline points
+        ax.plot(snapshot['frontline'][:, 0], snapshot['frontline'][:, 1], color='r', linestyle='none', marker='x',
+                rasterized=rasterized)
+
+
+    # ax.set_ylim(0, 2)
+    ax.set_xlim(0, snapshot['reach'])
+
+    ax.set_xlabel('x')
+    ax.set_ylabel('y')
+    # ax.set_aspect('equal')
+
+    ax.grid()
+
+    save_or_show(fig, path)
+
+
+_segments = None  # worker side: segment columns of the snapshots submitted so far
+
+
+def _render_in_worker(render, snapshot, path, kwargs):
+    # snapshots carry the segments from snapshot['start'] on, the worker (one per SnapshotPlotter, taking the
+    # snapshots in order) appends them to the ones it has and renders the whole net
+    global _segments
+    import matplotlib
+    matplotlib.use('Agg')
+    if _segments is None or snapshot['start'] == 0:
+        _segments = {name: column[:0] for name, column in snapshot['segments'].items()}
+    if len(next(iter(_segments.values()))) != snapshot['start']:
+        raise RuntimeError('snapshot starts at segment {}, the plotter holds {}'.format(
+            snapshot['start'], len(next(iter(_segments.values())))))
+    _segments = {name: np.concatenate((column, snapshot['segments'][name])) for name, column in _segments.items()}
+    render(dict(snapshot, segments=_segments, start=0), path, **kwargs)
+    return path
+
+
+class SnapshotPlotter:
+    # renders snapshots to files in a background process so the march does not wait for matplotlib,
+    # submit blocks while queue_size snapshots are still pending (backpressure), flush waits for all of them.
+    # snapshots are incremental: a snapshot holds only the segments from segments (those submitted before) on
+    # (see GeometryCluster.geometry_snapshot), so the solver only copies and sends what is new
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE):
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.queue_size = max(int(queue_size), 1)
+        self._pool = ProcessPoolExecutor(max_workers=1)
+        self._pending = []
+        self.segments = 0  # segments submitted so far
+
+    def submit(self, render, snapshot, path, **kwargs):
+        while len(self._pending) >= self.queue_size:
+            self._pending.pop(0).result()
+        self._pending.append(self._pool.submit(_render_in_worker, render, snapshot, path, kwargs))
+        self.segments = snapshot['start'] + len(snapshot['segments']['x0'])
+
+    def flush(self):
+        # wait for every pending plot, errors of the worker are raised here
+        while self._pending:
+            self._pending.pop(0).result()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,111 @@
+import numpy as np
+from src.archive import POINT_COLUMNS, point_columns, flow_property
+
+# fields returned by FieldQuery when none are asked for
+DEFAULT_FIELDS = ('mach_number', 'pressure', 'flow_direction')
+
+
+def _concatenate(chunks):
+    # point columns (see archive.POINT_COLUMNS) of the chunks one after the other, in float64
+    return {name: np.concatenate([np.empty(0, dtype=dtype)] + [np.asarray(chunk[name], dtype=dtype) for chunk in chunks])
+            for name, dtype in POINT_COLUMNS.items()}
+
+
+class FieldQuery:
+    # linear interpolation of flow fields over the solved net (dead points and frontline points) at arbitrary
+    # locations, built on a cached delaunay triangulation that update() extends with the points added since the
+    # last update. fields are evaluated once per point, the first time they are asked for, e.g.
+    #   query = gc.query()
+    #   query(x, y)['mach_number']
+    #   query.grid(np.linspace(0, 10, 200), np.linspace(0, 1, 50), ['pressure'])
+    # locations outside the net give nan. shock points have no flow state (nan invariants), they are left out of
+    # the triangulation and the fields around them are interpolated between their solved neighbors
+    # scipy (for the triangulation) is only imported once a query is built, the solver does not need it
+    def __init__(self, cluster):
+        self.cluster = cluster
+        self.index = np.empty(0, dtype=np.int64)  # store indices of the points, in triangulation order
+        self.iter = None  # cluster iteration of the last update
+        self._inserted = np.zeros(0, dtype=bool)  # by store index
+        self._columns = _concatenate([])  # point columns (see archive.POINT_COLUMNS) of self.index
+        self._values = {}  # field -> values of self.index
+        self._pending = _concatenate([])  # columns of the points not triangulated yet (too few for a first triangle)
+        self._tri = None
+        self.update()
+
+    def __len__(self):
+        return len(self.index)
+
+    def _new_points(self):
+        # point columns of the solved points not inserted yet, the dead ones are read from the dead point chunks
+        # (in streaming mode the cluster stores do not keep them)
+        cluster = self.cluster
+        if len(self._inserted) < len(cluster.points):
+            self._inserted = np.concatenate([self._inserted, np.zeros(len(cluster.points) - len(self._inserted), dtype=bool)])
+        chunks = list(cluster.dead_point_chunks())
+        chunks.append(point_columns(cluster.points, sorted(p.store_index for p in cluster.frontline_points)))
+        new = _concatenate([{name: column[~self._inserted[chunk['index']]] for name, column in chunk.items()}
+                            for chunk in chunks])
+        _, first = np.unique(new['index'], return_index=True)
+        return {name: column[first] for name, column in new.items()}
+
+    def update(self):
+        # add the points the cluster solved since the last update (but the shock points), returns the number of points added
+        from scipy.spatial import Delaunay, QhullError
+
+        new = self._new_points()
+        self._inserted[new['index']] = True
+        self.iter = self.cluster.iter
+        solved = ~(np.isnan(new['v_plus']) | np.isnan(new['v_minus']))
+        new = {name: column[solved] for name, column in new.items()}
+        if len(new['index']) == 0:
+            return 0
+
+        if self._tri is None:
+            rows = _concatenate([self._pending, new])
+            try:
+                self._tri = Delaunay(np.column_stack([rows['x'], rows['y']]), incremental=True)
+            except QhullError: # all points on a line so far
+                self._pending = rows
+                return len(new['index'])
+            self._pending = _concatenate([])
+            new = rows
+        else:
+            self._tri.add_points(np.column_stack([new['x'], new['y']]))
+
+        for name in self._values:
+            self._values[name] = np.concatenate([self._values[name], flow_property(new, name)])
+        self._columns = _concatenate([self._columns, new])
+        self.index = self._columns['index']
+        return len(new['index'])
+
+    def values(self, name):
+        # field values at the triangulated points (ordered like self.index)
+        if name not in self._values:
+            self._values[name] = flow_property(self._columns, name)
+        return self._values[name]
+
+    def __call__(self, x, y, names=DEFAULT_FIELDS):
+        # {field: values} interpolated at the locations (x, y), arrays of any matching shape
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        if self._tri is None:
+            return {name: np.full(x.shape, np.nan) for name in names}
+
+        q = np.column_stack([x.ravel(), y.ravel()])
+        simplex = self._tri.find_simplex(q)
+        inside = simplex >= 0
+        transform = self._tri.transform[simplex[inside]]
+        b = np.einsum('nij,nj->ni', transform[:, :2], q[inside] - transform[:, 2])
+        weights = np.column_stack([b, 1 - b.sum(axis=1)])
+        vertices = self._tri.simplices[simplex[inside]]
+
+        result = {}
+        for name in names:
+            values = np.full(len(q), np.nan)
+            values[inside] = np.einsum('nk,nk->n', self.values(name)[vertices], weights)
+            result[name] = values.reshape(x.shape)
+        return result
+
+    def grid(self, x, y, names=DEFAULT_FIELDS):
+        # fields on the regular grid spanned by the 1d coordinates x and y, arrays of shape (len(y), len(x))
+        X, Y = np.meshgrid(x, y)
+        return self(X, Y, names)
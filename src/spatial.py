@@ -0,0 +1,364 @@
+import math
+
+import numpy as np
+from src.characteristic import intersect_rays
+from src.store import CharacteristicStore
+
+# cells are sized as this multiple of the median segment length of the first inserted batch
+CELL_SIZE_FACTOR = 2.0
+# segments are inflated by this amount (in x and y) so hits on cell edges are never missed
+BBOX_PADDING = 1e-9
+# number of cells traversed along a query ray before their candidates are evaluated together
+CELLS_PER_BATCH = 8
+# (ray x segment) pairs evaluated at a time by SegmentGrid.first_intersections
+PAIR_BLOCK_SIZE = 2**18
+
+
+def _segment_cells(x0, y0, x1, y1, h):
+    # cells of size h covered by the segments (x0, y0) - (x1, y1) inflated by BBOX_PADDING, column by column:
+    # the y range of a segment over the part of the column it spans, so the number of cells grows with the
+    # length of the segment rather than the area of its bounding box. returns (segment, i, j) for every
+    # covered cell, segments in ascending order
+    xa, xb = np.minimum(x0, x1), np.maximum(x0, x1)
+    vertical = x1 == x0
+    slope = np.divide(y1 - y0, x1 - x0, out=np.zeros(len(x0)), where=~vertical)
+
+    first = np.floor((xa - BBOX_PADDING) / h).astype(np.int64)
+    counts = np.floor((xb + BBOX_PADDING) / h).astype(np.int64) - first + 1
+    segment = np.repeat(np.arange(len(x0)), counts)
+    i = np.arange(len(segment)) - np.repeat(np.cumsum(counts) - counts - first, counts)
+    xa, xb, x0, y0, slope = xa[segment], xb[segment], x0[segment], y0[segment], slope[segment]
+    ya = y0 + (np.minimum(np.maximum(i * h, xa), xb) - x0) * slope
+    yb = y0 + (np.minimum(np.maximum((i + 1) * h, xa), xb) - x0) * slope
+    vertical = vertical[segment]
+    ya[vertical], yb[vertical] = np.minimum(y0, y1[segment])[vertical], np.maximum(y0, y1[segment])[vertical]
+
+    first = np.floor((np.minimum(ya, yb) - BBOX_PADDING) / h).astype(np.int64)
+    counts = np.floor((np.maximum(ya, yb) + BBOX_PADDING) / h).astype(np.int64) - first + 1
+    j = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - first, counts)
+    return np.repeat(segment, counts), np.repeat(i, counts), j
+
+
+def unreachable_segments(rays, x0, y0, x1, y1, h):
+    # whether each bounded dead segment (x0, y0) - (x1, y1) lies upstream of every hit the query rays (RayArrays)
+    # can make. a valid hit lies on a query ray on the side its origin flow direction points to; if all of these
+    # half-rays point downstream (in x) with |dy / dx| <= k, a hit at height y lies at x >= min over the rays of
+    # x_r + |y - y_r| / k. the bound is taken per band of height h, as if every ray started at the edge of its
+    # band closest to the band considered, and a segment is unreachable if its largest x stays below the bound over
+    # the bands of its y range. none is unreachable if some half-ray points upstream, all are without rays
+    n = len(x0)
+    forward = np.cos(rays.direction) * rays.cos_flow + np.sin(rays.direction) * rays.sin_flow
+    shooting = forward != 0  # a ray normal to its flow direction has no valid hits
+    sign = np.sign(forward[shooting])
+    dx, dy = sign * np.cos(rays.direction[shooting]), sign * np.sin(rays.direction[shooting])
+    x, y = rays.x[shooting], rays.y[shooting]
+    if n == 0 or np.any(dx <= 0):
+        return np.zeros(n, dtype=bool)
+    if len(x) == 0:
+        return np.ones(n, dtype=bool)
+    with np.errstate(divide='ignore'):
+        step = h / np.max(np.abs(dy) / dx)  # x the rays advance at least per band crossed, inf if all are horizontal
+
+    xmax = np.maximum(x0, x1) + BBOX_PADDING
+    low = np.floor((np.minimum(y0, y1) - BBOX_PADDING) / h).astype(np.int64)
+    high = np.floor((np.maximum(y0, y1) + BBOX_PADDING) / h).astype(np.int64)
+    ray_band = np.floor(y / h).astype(np.int64)
+    first = min(ray_band.min(), low.min())
+    bands = max(ray_band.max(), high.max()) - first + 1
+
+    # lowest x of the rays of every band, carried (j - i) * step from band i to the bands j above (up) and below
+    # (down), in log2(bands) doubling passes of the min-plus scan
+    local = np.full(bands, np.inf)
+    np.minimum.at(local, ray_band - first, x)
+    up, down = local.copy(), local.copy()
+    shift = 1
+    while shift < bands:
+        up[shift:] = np.minimum(up[shift:], up[:-shift] + shift * step)
+        down[:-shift] = np.minimum(down[:-shift], down[shift:] + shift * step)
+        shift *= 2
+    # a ray from band i reaches band j != i at x >= x_r + (|j - i| - 1) * step
+    bound = local.copy()
+    bound[1:] = np.minimum(bound[1:], up[:-1])
+    bound[:-1] = np.minimum(bound[:-1], down[1:])
+
+    # smallest bound over the bands [low, high] of every segment
+    ranges = np.empty(2 * n, dtype=np.int64)
+    ranges[0::2] = low - first
+    ranges[1::2] = high - first + 1
+    return xmax < np.minimum.reduceat(np.append(bound, np.inf), ranges)[0::2]
+
+
+class SegmentGrid:
+    # uniform-grid spatial index over dead characteristic segments (rows of a CharacteristicStore)
+    # a query walks the grid cells along a characteristic ray in order of distance and only evaluates
+    # the segments registered in those cells, stopping as soon as no closer hit is possible
+    def __init__(self, characteristics : CharacteristicStore, cell_size=None):
+        self.characteristics = characteristics
+        self.cell_size = cell_size
+        self.cells = {}  # (i, j) -> list of segment ids
+        self.unbounded = []  # segments whose valid hits are not confined to the segment itself
+
+        self.ids = np.empty(0, dtype=np.int64)  # characteristic store index of each segment
+        self._segment_of = {}  # characteristic store index -> segment id
+        self.bbox = None  # (xmin, ymin, xmax, ymax) of all bounded segments
+
+        # per-segment columns used by the intersection filters
+        self.x0 = np.empty(0)
+        self.y0 = np.empty(0)
+        self.x1 = np.empty(0)
+        self.y1 = np.empty(0)
+        self.direction = np.empty(0)
+        self.origin = np.empty(0, dtype=np.int64)
+        self.origin_cos = np.empty(0)
+        self.origin_sin = np.empty(0)
+        self.end_cos = np.empty(0)
+        self.end_sin = np.empty(0)
+        self.bounded = np.empty(0, dtype=bool)  # valid hits lie on the segment itself
+        self.active = np.empty(0, dtype=bool)  # evicted segments stay in the columns until the next compaction
+        self.pair_tests = 0  # segments evaluated by queries so far
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, char_index):
+        return char_index in self._segment_of
+
+    def insert(self, char_indices):
+        # add dead characteristics (by store index) to the index, already indexed ones are skipped
+        char_indices = np.array([c for c in dict.fromkeys(char_indices) if c not in self._segment_of], dtype=np.int64)
+        if len(char_indices) == 0:
+            return
+
+        store = self.characteristics
+        points = store.points
+        origin = store.values('origin', char_indices)
+        end = store.values('end', char_indices)
+        x0, y0 = points.values('x', origin), points.values('y', origin)
+        x1, y1 = points.values('x', end), points.values('y', end)
+        direction = store.values('direction', char_indices)
+        origin_flow = (points.values('v_minus', origin) - points.values('v_plus', origin)) / 2
+        end_flow = (points.values('v_minus', end) - points.values('v_plus', end)) / 2
+
+        if self.cell_size is None:
+            length = np.hypot(x1 - x0, y1 - y0)
+            length = length[length > 0]
+            self.cell_size = CELL_SIZE_FACTOR * float(np.median(length)) if len(length) else 1.0
+
+        first = len(self.ids)
+        self.ids = np.concatenate((self.ids, char_indices))
+        self.x0 = np.concatenate((self.x0, x0))
+        self.y0 = np.concatenate((self.y0, y0))
+        self.x1 = np.concatenate((self.x1, x1))
+        self.y1 = np.concatenate((self.y1, y1))
+        self.direction = np.concatenate((self.direction, direction))
+        self.origin = np.concatenate((self.origin, origin))
+        self.origin_cos = np.concatenate((self.origin_cos, np.cos(origin_flow)))
+        self.origin_sin = np.concatenate((self.origin_sin, np.sin(origin_flow)))
+        self.end_cos = np.concatenate((self.end_cos, np.cos(end_flow)))
+        self.end_sin = np.concatenate((self.end_sin, np.sin(end_flow)))
+        self.active = np.concatenate((self.active, np.ones(len(char_indices), dtype=bool)))
+
+        # a hit on the line of the segment passes the origin/end flow direction tests only between origin and
+        # end if the segment points forward relative to the end flow direction, otherwise register it everywhere
+        bounded = (np.cos(direction) * np.cos(end_flow) + np.sin(direction) * np.sin(end_flow)) > 0
+        self.bounded = np.concatenate((self.bounded, bounded))
+
+        h = self.cell_size
+        xmin = np.minimum(x0, x1) - BBOX_PADDING
+        xmax = np.maximum(x0, x1) + BBOX_PADDING
+        ymin = np.minimum(y0, y1) - BBOX_PADDING
+        ymax = np.maximum(y0, y1) + BBOX_PADDING
+        self._segment_of.update(zip(char_indices.tolist(), range(first, first + len(char_indices))))
+        self.unbounded.extend((first + np.flatnonzero(~bounded)).tolist())
+        # register the bounded segments cell by cell, one list extension per covered cell
+        rows = np.flatnonzero(bounded)
+        segment, i, j = _segment_cells(x0[rows], y0[rows], x1[rows], y1[rows], h)
+        order = np.lexsort((segment, j, i))
+        segment, i, j = (first + rows[segment[order]]).tolist(), i[order], j[order]
+        starts = np.flatnonzero(np.r_[True, (i[1:] != i[:-1]) | (j[1:] != j[:-1])][:len(segment)]).tolist()
+        cells = self.cells
+        for start, end, cell in zip(starts, starts[1:] + [len(segment)], zip(i[starts].tolist(), j[starts].tolist())):
+            cells.setdefault(cell, []).extend(segment[start:end])
+
+        if bounded.any():
+            box = (xmin[bounded].min(), ymin[bounded].min(), xmax[bounded].max(), ymax[bounded].max())
+            if self.bbox is not None:
+                box = (min(box[0], self.bbox[0]), min(box[1], self.bbox[1]),
+                       max(box[2], self.bbox[2]), max(box[3], self.bbox[3]))
+            self.bbox = box
+
+    def searchable(self, char_indices):
+        # whether each of the characteristics (by store index) is indexed and active
+        return np.array([c in self._segment_of and bool(self.active[self._segment_of[c]]) for c in char_indices],
+                        dtype=bool)
+
+    def restore(self, char_indices):
+        # put evicted characteristics back into the search, the ones not compacted away yet are reactivated
+        indexed = [self._segment_of[c] for c in char_indices if c in self._segment_of]
+        self.active[np.array(indexed, dtype=np.int64)] = True
+        self.insert(char_indices)
+
+    def evict(self, bound, rays=None):
+        # deactivate the segments ending at x <= bound, they cannot pass the end x > origin x test of a query
+        # from a point at x >= bound, and given the query rays (RayArrays) also the bounded segments upstream of
+        # all of their hits (see unreachable_segments); returns their characteristic store indices
+        out = self.active & (self.x1 <= bound)
+        if rays is not None:
+            # the hit is on the segment if the origin flow direction test also bounds it (it does unless the
+            # segment is normal to the flow at its origin)
+            candidates = np.flatnonzero(self.active & ~out & self.bounded &
+                                        (self.origin_cos * np.cos(self.direction) + self.origin_sin * np.sin(self.direction) > 0))
+            out[candidates[unreachable_segments(rays, self.x0[candidates], self.y0[candidates], self.x1[candidates],
+                                                self.y1[candidates], self.cell_size)]] = True
+        evicted = np.flatnonzero(out)
+        if len(evicted) == 0:
+            return evicted
+        self.active[evicted] = False
+        char_indices = self.ids[evicted]
+        if 2 * np.count_nonzero(self.active) < len(self.active):
+            self._compact()
+        return char_indices
+
+    def _compact(self):
+        # rebuild the columns and cells from the active segments only, keeping their order and the cell size
+        char_indices = self.ids[self.active]
+        self.__init__(self.characteristics, self.cell_size)
+        self.insert(char_indices)
+
+    def _cells_along(self, x0, y0, dx, dy):
+        # grid cells crossed by the ray (x0, y0) + t * (dx, dy), t >= 0, inside the bounding box,
+        # yields ((i, j), t at which the ray enters the cell) in order of increasing t
+        if self.bbox is None:
+            return
+        t_in, t_out = 0.0, math.inf
+        for p, d, lo, hi in ((x0, dx, self.bbox[0], self.bbox[2]), (y0, dy, self.bbox[1], self.bbox[3])):
+            if d == 0:
+                if not lo <= p <= hi:
+                    return
+                continue
+            ta, tb = (lo - p) / d, (hi - p) / d
+            t_in, t_out = max(t_in, min(ta, tb)), min(t_out, max(ta, tb))
+        if t_in > t_out:
+            return
+
+        h = self.cell_size
+        px, py = x0 + t_in * dx, y0 + t_in * dy
+        i, j = math.floor(px / h), math.floor(py / h)
+        step_i = 1 if dx > 0 else -1
+        step_j = 1 if dy > 0 else -1
+        t_next_x = t_in + ((i + (dx > 0)) * h - px) / dx if dx != 0 else math.inf
+        t_next_y = t_in + ((j + (dy > 0)) * h - py) / dy if dy != 0 else math.inf
+        t_delta_x = h / abs(dx) if dx != 0 else math.inf
+        t_delta_y = h / abs(dy) if dy != 0 else math.inf
+
+        t = t_in
+        while t <= t_out:
+            yield (i, j), t
+            if t_next_x < t_next_y:
+                t = t_next_x
+                t_next_x += t_delta_x
+                i += step_i
+            else:
+                t = t_next_y
+                t_next_y += t_delta_y
+                j += step_j
+
+    def _evaluate(self, segments, char1, x1, y1, cos_f1, sin_f1, origin_index):
+        # filters of GeometryCluster.find_first_dead_intersection, returns (flow distance, segment) of the best hit,
+        # the lowest segment among equally distant ones (hits on a point shared by segments)
+        s = np.sort(np.fromiter(segments, dtype=np.int64, count=len(segments)))
+        self.pair_tests += len(s)
+        x, y, hit = intersect_rays(self.x0[s], self.y0[s], self.direction[s], x1, y1, char1.direction)
+        distance = cos_f1 * (x - x1) + sin_f1 * (y - y1)
+        with np.errstate(invalid='ignore'):
+            valid = hit & self.active[s] & (self.x1[s] > x1) & (self.origin[s] != origin_index) & (distance > 0) &\
+                (self.origin_cos[s] * (x - self.x0[s]) + self.origin_sin[s] * (y - self.y0[s]) > 0) &\
+                (self.end_cos[s] * (x - self.x1[s]) + self.end_sin[s] * (y - self.y1[s]) < 0)
+        if not valid.any():
+            return math.inf, None
+        distance = np.where(valid, distance, np.inf)
+        k = int(np.argmin(distance))
+        return float(distance[k]), int(s[k])
+
+    def first_intersections(self, rays, origins):
+        # batched first_intersection for the rays (RayArrays) starting at the points origins (store indices), returns
+        # the characteristic store index of the closest valid hit of every ray or -1. the segments the rays cannot
+        # reach (see unreachable_segments) are left out, the others are evaluated against all rays at once with the
+        # filters of _evaluate (the same tie-break, segments are in grid order)
+        first = np.full(len(rays), -1, dtype=np.int64)
+        s = np.flatnonzero(self.active)
+        if len(s) == 0 or len(rays) == 0:
+            return first
+        bounded = self.bounded[s] &\
+            (self.origin_cos[s] * np.cos(self.direction[s]) + self.origin_sin[s] * np.sin(self.direction[s]) > 0)
+        reachable = ~bounded
+        reachable[bounded] = ~unreachable_segments(rays, self.x0[s[bounded]], self.y0[s[bounded]], self.x1[s[bounded]],
+                                                   self.y1[s[bounded]], self.cell_size)
+        s = s[reachable]
+        if len(s) == 0:
+            return first
+
+        origins = np.asarray(origins, dtype=np.int64)
+        block = max(1, PAIR_BLOCK_SIZE // len(s))
+        for start in range(0, len(rays), block):
+            r = slice(start, start + block)
+            x1, y1 = rays.x[r, None], rays.y[r, None]
+            cos_f1, sin_f1 = rays.cos_flow[r, None], rays.sin_flow[r, None]
+            self.pair_tests += len(s) * len(x1)
+            x, y, hit = intersect_rays(self.x0[s], self.y0[s], self.direction[s], x1, y1, rays.direction[r, None])
+            distance = cos_f1 * (x - x1) + sin_f1 * (y - y1)
+            with np.errstate(invalid='ignore'):
+                valid = hit & (self.x1[s] > x1) & (self.origin[s] != origins[r, None]) & (distance > 0) &\
+                    (self.origin_cos[s] * (x - self.x0[s]) + self.origin_sin[s] * (y - self.y0[s]) > 0) &\
+                    (self.end_cos[s] * (x - self.x1[s]) + self.end_sin[s] * (y - self.y1[s]) < 0)
+            distance = np.where(valid, distance, np.inf)
+            k = np.argmin(distance, axis=1)
+            found = valid[np.arange(len(k)), k]
+            first[r][found] = self.ids[s[k[found]]]
+        return first
+
+    def first_intersection(self, char1):
+        # closest dead characteristic g with a valid hit g * char1, returns the characteristic store index or None
+        if len(self.ids) == 0:
+            return None
+
+        origin = char1.origin
+        x1, y1 = origin.pos
+        _, _, _, _, cos_f1, sin_f1 = origin._derived_state()
+        dx, dy = math.cos(char1.direction), math.sin(char1.direction)
+        origin_index = origin.store_index
+
+        best_distance, best = math.inf, None
+        if self.unbounded:
+            best_distance, best = self._evaluate(self.unbounded, char1, x1, y1, cos_f1, sin_f1, origin_index)
+
+        # the flow distance of a hit at ray parameter t is t * forward, so cells can be visited in order of t
+        forward = dx * cos_f1 + dy * sin_f1
+        if forward <= 0:  # no forward hits along the ray direction, check every segment directly
+            distance, segment = self._evaluate(range(len(self.ids)), char1, x1, y1, cos_f1, sin_f1, origin_index)
+            return None if segment is None else int(self.ids[segment])
+
+        # a hit inside a cell lies at t >= the cell entry t, so the walk stops once a cell starts beyond the best hit
+        visited = set(self.unbounded)
+        batch = []
+        n_cells = 0
+        for cell, t_enter in self._cells_along(x1, y1, dx, dy):
+            if t_enter * forward > best_distance:
+                break
+            for segment in self.cells.get(cell, ()):
+                if segment not in visited:
+                    visited.add(segment)
+                    batch.append(segment)
+            n_cells += 1
+            if batch and n_cells >= CELLS_PER_BATCH:
+                distance, segment = self._evaluate(batch, char1, x1, y1, cos_f1, sin_f1, origin_index)
+                if distance < best_distance or distance == best_distance and segment is not None and segment < best:
+                    best_distance, best = distance, segment
+                batch = []
+                n_cells = 0
+        if batch:
+            distance, segment = self._evaluate(batch, char1, x1, y1, cos_f1, sin_f1, origin_index)
+            if distance < best_distance or distance == best_distance and segment is not None and segment < best:
+                best_distance, best = distance, segment
+
+        return None if best is None else int(self.ids[best])
@@ -0,0 +1,315 @@
+from array import array
+
+import numpy as np
+
+# integer codes for the boundary flags of FluidPoint
+BOUNDARY_CODES = {None: 0, "lower": 1, "upper": 2, "plus_only": 3, "minus_only": 4}
+BOUNDARY_NAMES = {code: name for name, code in BOUNDARY_CODES.items()}
+
+NO_INDEX = -1  # index used for missing links (e.g. a characteristic without an end point)
+
+
+class ColumnStore:
+    # growable struct-of-arrays container, one contiguous numpy array per column
+    # column views returned by attribute access (e.g. store.x) cover the resident rows only and
+    # are invalidated when the store grows, so do not hold on to them across appends
+    # a column holding the same value in every row can be hoisted (see hoist), it then takes no memory
+    # per row and reads as a read-only broadcast of that value, rows with another value bring the array back
+    # rows are numbered in order of addition (the row index, e.g. FluidPoint.store_index) and stay resident until
+    # they are dropped by compact, after that the resident rows take fewer places than there are row indices and
+    # row indices are translated to places through a slot map (4 bytes per row), use values(name, rows) for
+    # columns at given row indices
+    COLUMNS = {}
+
+    def __init__(self, capacity=1024, view=None):
+        self.size = 0  # rows added (row indices in use)
+        self.resident = 0  # rows held in the columns
+        self.capacity = max(int(capacity), 1)
+        self._data = {name: np.empty(self.capacity, dtype=dtype) for name, dtype in self.COLUMNS.items()}
+        self._slot = None  # array: row index -> place in the columns (-1 once dropped), None while every row is resident
+        self.constants = {}  # hoisted column -> its value in every row
+        self.objects = []  # the view objects, by place (None once released)
+        self.view = view  # view(store, index) creates the view object of a row
+
+    def __len__(self):
+        return self.size
+
+    def __getattr__(self, name):
+        columns = type(self).COLUMNS
+        if name in columns:
+            constants = self.__dict__['constants']
+            if name in constants:
+                return np.broadcast_to(np.asarray(constants[name], dtype=columns[name]), (self.resident,))
+            return self.__dict__['_data'][name][:self.resident]
+        raise AttributeError(name)
+
+    def _slots(self):
+        # numpy view of the slot map, do not hold on to it across appends
+        return np.frombuffer(self._slot, dtype=np.int32)
+
+    def place(self, rows):
+        # places of row indices (an array) in the columns, raises KeyError for dropped rows
+        if self._slot is None:
+            return rows
+        places = self._slots()[rows]
+        if np.any(places < 0):
+            raise KeyError('rows {} were dropped from the store'.format(rows[places < 0]))
+        return places
+
+    def _place(self, index):
+        # place of a single row index
+        if self._slot is None:
+            return index
+        place = self._slot[index]
+        if place < 0:
+            raise KeyError('row {} was dropped from the store'.format(index))
+        return place
+
+    def rows(self):
+        # row indices of the resident rows, by place
+        if self._slot is None:
+            return np.arange(self.size)
+        slots = self._slots()
+        rows = np.empty(self.resident, dtype=np.int64)
+        resident = np.flatnonzero(slots >= 0)
+        rows[slots[resident]] = resident
+        return rows
+
+    def dropped(self, rows):
+        # whether each of the row indices was dropped (see compact)
+        rows = np.asarray(rows, dtype=np.int64)
+        return np.zeros(len(rows), dtype=bool) if self._slot is None else self._slots()[rows] < 0
+
+    def values(self, name, rows):
+        # column name at the row indices rows
+        return getattr(self, name)[self.place(np.asarray(rows, dtype=np.int64))]
+
+    def hoist(self, name, value=None):
+        # store column name as a single value (by default the one shared by all rows), returns whether it
+        # could be hoisted, i.e. all rows hold that value
+        if name in self.constants:
+            return value is None or self.constants[name] == value
+        column = self._data[name][:self.resident]
+        if value is None:
+            if self.resident == 0:
+                return False
+            value = column[0].item()
+        if not np.all(column == value):
+            return False
+        self.constants[name] = value
+        del self._data[name]
+        return True
+
+    def _unhoist(self, name):
+        # bring back the array of a hoisted column (a row with another value is about to be written)
+        value = self.constants.pop(name)
+        self._data[name] = np.full(self.capacity, value, dtype=self.COLUMNS[name])
+
+    def _check_constants(self, values):
+        for name, value in self.constants.items():
+            if name in values and not np.all(np.asarray(values[name]) == value):
+                self._unhoist(name)
+
+    def _grow(self, n_extra=1):
+        if self.resident + n_extra <= self.capacity:
+            return
+        while self.resident + n_extra > self.capacity:
+            self.capacity *= 2
+        for name, column in self._data.items():
+            grown = np.empty(self.capacity, dtype=column.dtype)
+            grown[:self.resident] = column[:self.resident]
+            self._data[name] = grown
+
+    def _append_row(self, obj, **values):
+        self._grow()
+        self._check_constants(values)
+        index = self.size
+        place = self.resident
+        for name, value in values.items():
+            if name not in self.constants:
+                self._data[name][place] = value
+        if self._slot is not None:
+            self._slot.append(place)
+        self.size += 1
+        self.resident += 1
+        self.objects.append(obj)
+        return index
+
+    def extend(self, **columns):
+        # append rows given as equally long arrays, one per column, their view objects are created lazily
+        # (see object), returns the indices of the new rows
+        n = len(next(iter(columns.values())))
+        if self._slot is not None:
+            self._slot.extend(range(self.resident, self.resident + n))
+        self._put(columns)
+        rows = np.arange(self.size, self.size + n)
+        self.size += n
+        return rows
+
+    def _put(self, columns):
+        # write columns into the next places
+        n = len(next(iter(columns.values())))
+        self._grow(n)
+        self._check_constants(columns)
+        for name, column in self._data.items():
+            column[self.resident:self.resident + n] = columns[name]
+        self.resident += n
+        self.objects.extend([None] * n)
+
+    def reload(self, rows, columns):
+        # make dropped rows resident again with their values (as written by compact's caller, e.g. to an archive)
+        rows = np.asarray(rows, dtype=np.int64)
+        if not np.all(self.dropped(rows)) or self._slot is None:
+            raise ValueError('only dropped rows can be reloaded')
+        self._slots()[rows] = np.arange(self.resident, self.resident + len(rows))
+        self._put(columns)
+
+    def compact(self, keep):
+        # drop every row but the row indices keep from the columns, the view objects of dropped rows are released
+        # and must not be used any more, returns the row indices of the dropped rows
+        keep = np.unique(np.asarray(keep, dtype=np.int64))
+        places = self.place(keep)
+        dropped = np.setdiff1d(self.rows(), keep)
+        capacity = max(2 * len(keep), 1024)
+        for name, column in self._data.items():
+            kept = np.empty(capacity, dtype=column.dtype)
+            kept[:len(keep)] = column[places]
+            self._data[name] = kept
+        self.capacity = capacity
+        self.objects = [self.objects[place] for place in places]
+        if self._slot is None:
+            self._slot = array('i', bytes(4 * self.size))
+        slots = self._slots()
+        slots[dropped] = -1
+        slots[keep] = np.arange(len(keep))
+        self.resident = len(keep)
+        return dropped
+
+    def columns(self):
+        # copies of the resident rows of every column (hoisted ones included) by place, e.g. for checkpoints,
+        # rows() gives their row indices
+        return {name: getattr(self, name).copy() for name in self.COLUMNS}
+
+    def restore(self, columns, rows=None, size=None):
+        # replace the contents with columns (as returned by columns()) for the row indices rows (by default all
+        # rows of a store of size rows) and create the row objects
+        resident = len(next(iter(columns.values()))) if columns else 0
+        rows = np.arange(resident) if rows is None else np.asarray(rows, dtype=np.int64)
+        size = resident if size is None else int(size)
+        self.capacity = max(self.capacity, resident)
+        self._data = {name: np.empty(self.capacity, dtype=dtype) for name, dtype in self.COLUMNS.items()}
+        self.constants = {}
+        for name in self.COLUMNS:
+            self._data[name][:resident] = columns[name]
+        self.size, self.resident = size, resident
+        self._slot = None
+        if resident < size or np.any(rows != np.arange(resident)):
+            self._slot = array('i', bytes(4 * size))
+            slots = self._slots()
+            slots[:] = -1
+            slots[rows] = np.arange(resident)
+        self.objects = [self.view(self, int(index)) for index in rows]
+
+    def object(self, index):
+        # view object of a row, recreated if it was released
+        place = index if self._slot is None else self._place(index)
+        obj = self.objects[place]
+        if obj is None:
+            obj = self.objects[place] = self.view(self, index)
+        return obj
+
+    def release(self, rows):
+        # drop the view objects of rows that are no longer referenced by the march, the column data stays
+        for index in rows:
+            self.objects[self._place(index)] = None
+
+    def get(self, name, index):
+        if name in self.constants:
+            return self.COLUMNS[name](self.constants[name])
+        place = index if self._slot is None else self._slot[index]
+        if place < 0:
+            self._place(index)
+        return self._data[name][place]
+
+    def set(self, name, index, value):
+        if name in self.constants:
+            if value == self.constants[name]:
+                return
+            self._unhoist(name)
+        self._data[name][index if self._slot is None else self._place(index)] = value
+
+
+class PointStore(ColumnStore):
+    # columns of all fluid points registered with a GeometryCluster
+    # v_plus / v_minus of shock points (None on the FluidPoint) are stored as nan
+    COLUMNS = {
+        'x': np.float64,
+        'y': np.float64,
+        'v_plus': np.float64,
+        'v_minus': np.float64,
+        'gamma': np.float64,
+        'ptot': np.float64,
+        'boundary': np.int8,
+        'flags': np.uint8,
+    }
+
+    def add(self, point, pos, v_plus, v_minus, gamma, ptot, boundary, flags):
+        return self._append_row(
+            point,
+            x=pos[0], y=pos[1],
+            v_plus=np.nan if v_plus is None else v_plus,
+            v_minus=np.nan if v_minus is None else v_minus,
+            gamma=gamma, ptot=ptot,
+            boundary=BOUNDARY_CODES[boundary],
+            flags=flags,
+        )
+
+    # the accessors of the FluidPoint views, the hottest store reads of the march
+    def position(self, index):
+        place = index if self._slot is None else self._slot[index]
+        if place < 0:
+            self._place(index)
+        return float(self._data['x'][place]), float(self._data['y'][place])
+
+    def invariant(self, name, index):
+        place = index if self._slot is None else self._slot[index]
+        if place < 0:
+            self._place(index)
+        value = self._data[name][place]
+        return None if np.isnan(value) else float(value)
+
+    def boundary_name(self, index):
+        return BOUNDARY_NAMES[int(self._data['boundary'][index if self._slot is None else self._place(index)])]
+
+    @property
+    def positions(self):
+        return np.column_stack((self.x, self.y))
+
+
+class CharacteristicStore(ColumnStore):
+    # columns of all characteristics registered with a GeometryCluster, origin and end
+    # are row indices into the PointStore the characteristics were registered with
+    COLUMNS = {
+        'origin': np.int64,
+        'end': np.int64,
+        'type': np.int8,
+        'direction': np.float64,
+    }
+
+    def __init__(self, points : PointStore, capacity=1024, view=None):
+        super().__init__(capacity, view)
+        self.points = points
+
+    def add(self, characteristic, origin, end, type, direction):
+        return self._append_row(characteristic, origin=origin, end=end, type=type, direction=direction)
+
+    def segments(self, types=None):
+        # (n, 2, 2) array of segment end points for characteristics with an end, optionally filtered by type
+        mask = self.end != NO_INDEX
+        if types is not None:
+            mask &= np.isin(self.type, types)
+        origin = self.origin[mask]
+        end = self.end[mask]
+        points = self.points
+        return np.stack((np.column_stack((points.values('x', origin), points.values('y', origin))),
+                         np.column_stack((points.values('x', end), points.values('y', end)))), axis=1)
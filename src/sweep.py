@@ -0,0 +1,207 @@
+import argparse
+import contextlib
+import csv
+import itertools
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from src.helper import prandtl_meyer_from_mach
+from src.fluidPoint import GenericFlowElement, FluidPoint
+from src.expansionFan import JetExpansionFan
+from src.cluster import GeometryCluster
+from src.export import EXPORT_FORMATS
+
+# parameters describing one jet expansion case and their defaults (same as main.py)
+CASE_DEFAULTS = {
+    'Mach_inlet': 2.5,
+    'pressure_ratio': 2.0,
+    'gamma': 1.4,
+    'N_fan': 20,
+    'N_inlet': 20,
+    'jet_width': 1.0,
+    'atm_pressure': 101325,
+}
+
+# GeometryCluster.run options and their defaults
+RUN_DEFAULTS = {
+    'max_iter': 200,
+    'plot_interval': 20,
+    'advance_mode': 'global',
+    'engine': 'geometric',
+    'tolerance': None,
+    'x_station': None,
+    'first_shock_only': True,
+    'contours': ['mach_number', 'pressure'],
+    'export': [],  # formats of export.EXPORT_FORMATS the net is written in (every plot_interval) besides the plots
+}
+
+SUMMARY_COLUMNS = ['name', 'Mach_inlet', 'pressure_ratio', 'gamma', 'N_fan', 'N_inlet',
+                   'iterations', 'reach', 'shock_x', 'shock_y', 'wall_time', 'error']
+
+
+def build_jet_cluster(Mach_inlet, pressure_ratio, gamma, N_fan, N_inlet, jet_width=1.0, atm_pressure=101325, **kwargs):
+    # half jet with a lower symmetry boundary and an expansion fan at the upper lip,
+    # kwargs are passed on to GeometryCluster
+    pm_angle_inlet = prandtl_meyer_from_mach(Mach_inlet, gamma)
+    inlet_conditions = GenericFlowElement(pm_angle_inlet, pm_angle_inlet, gamma=gamma)
+
+    jef = JetExpansionFan(inlet=inlet_conditions, pressure_ratio=pressure_ratio, origin=(0, jet_width/2),
+                          NCHAR=N_fan, gamma=gamma, type=-1, pa=atm_pressure)
+    ptot = jef.total_pressure
+
+    inlet_points = [ # first point is a boundary!
+        FluidPoint((0, yp), pm_angle_inlet, pm_angle_inlet, gamma=gamma, ptot = ptot,
+                   boundary="lower" if yp == 0 else None) for yp in np.linspace(0, jet_width/2, N_inlet, endpoint=False)
+    ]
+    inlet_points.extend(jef.characteristic_origins)
+
+    return GeometryCluster(inlet_points, **kwargs)
+
+
+def case_name(index, case):
+    return '{:03d}_M={}_pr={}_g={}_Nf={}_Ni={}'.format(
+        index, case['Mach_inlet'], case['pressure_ratio'], case['gamma'], case['N_fan'], case['N_inlet'])
+
+
+def load_config(path):
+    # sweep config (json):
+    # {
+    #   "output_dir": "sweeps/mach",       (relative to the config file)
+    #   "workers": 4,
+    #   "run": {"max_iter": 200, "plot_interval": 20, "advance_mode": "global", "tolerance": 0.01,
+    #           "contours": ["mach_number"], "export": ["npz", "vtk"]},
+    #   "defaults": {"gamma": 1.4, "N_fan": 20, "N_inlet": 20},
+    #   "grid": {"Mach_inlet": [2.0, 2.5, 3.0], "pressure_ratio": [1.5, 2.0]},
+    #   "cases": [{"Mach_inlet": 2.5, "pressure_ratio": 2.5}]
+    # }
+    # every combination of the grid values is a case, followed by the explicit cases,
+    # missing parameters are taken from defaults and then CASE_DEFAULTS
+    with open(path) as f:
+        config = json.load(f)
+
+    unknown = set(config) - {'output_dir', 'workers', 'run', 'defaults', 'grid', 'cases'}
+    if unknown:
+        raise ValueError('unknown sweep config keys: {}'.format(sorted(unknown)))
+
+    defaults = dict(CASE_DEFAULTS, **config.get('defaults', {}))
+    grid = config.get('grid', {})
+    cases = [dict(zip(grid, values)) for values in itertools.product(*grid.values())] if grid else []
+    cases += config.get('cases', [])
+    cases = [dict(defaults, **case) for case in cases]
+    for case in cases:
+        unknown = set(case) - set(CASE_DEFAULTS)
+        if unknown:
+            raise ValueError('unknown case parameters: {}'.format(sorted(unknown)))
+    if not cases:
+        raise ValueError('sweep config {} defines no cases'.format(path))
+
+    run_options = dict(RUN_DEFAULTS, **config.get('run', {}))
+    unknown = set(run_options) - set(RUN_DEFAULTS)
+    if unknown:
+        raise ValueError('unknown run options: {}'.format(sorted(unknown)))
+    unknown = set(run_options['export']) - set(EXPORT_FORMATS)
+    if unknown:
+        raise ValueError('unknown export formats: {}, expected some of {}'.format(sorted(unknown), sorted(EXPORT_FORMATS)))
+
+    output_dir = os.path.join(os.path.dirname(os.path.abspath(path)), config.get('output_dir', 'sweep'))
+    return cases, run_options, output_dir, config.get('workers')
+
+
+def run_case(name, case, run_options, output_dir):
+    # build and run one case in its own directory, its console output goes to run.log there
+    # (matplotlib is only loaded, with a file backend, if the case writes plots)
+    if run_options['plot_interval'] > 0 or run_options['contours']:
+        import matplotlib
+        matplotlib.use('Agg')
+
+    case_dir = os.path.join(output_dir, name)
+    os.makedirs(case_dir, exist_ok=True)
+    result = dict(name=name, **{key: case[key] for key in SUMMARY_COLUMNS if key in case})
+
+    start = time.perf_counter()
+    with open(os.path.join(case_dir, 'run.log'), 'w') as log, contextlib.redirect_stdout(log):
+        try:
+            gc = build_jet_cluster(**case, advance_mode=run_options['advance_mode'], engine=run_options['engine'],
+                                   tolerance=run_options['tolerance'], output_dir=case_dir)
+            gc.run(printFlag=True, plot_interval=run_options['plot_interval'], max_iter=run_options['max_iter'],
+                   plotkwargs={'save': True, 'markers': False, 'plot_frontline': True},
+                   x_station=run_options['x_station'],
+                   first_shock_only=run_options['first_shock_only'],
+                   exporters=[EXPORT_FORMATS[fmt](case_dir) for fmt in run_options['export']])
+        except Exception:
+            traceback.print_exc(file=log)
+            result['error'] = traceback.format_exc().strip().splitlines()[-1]
+        else:
+            shock = gc.shock_location
+            result.update(iterations=gc.iter, reach=gc.reach,
+                          shock_x=None if shock is None else shock[0], shock_y=None if shock is None else shock[1])
+            # a failing contour plot keeps the solved case, the (first) plot error is reported with it
+            for attr in run_options['contours']:
+                try:
+                    gc.plot_contours(attr, save=True, plot_characteristics=False, plot_frontline=True, plot_boundaries=True)
+                except Exception:
+                    traceback.print_exc(file=log)
+                    result.setdefault('error', '{} contours: {}'.format(attr, traceback.format_exc().strip().splitlines()[-1]))
+    result['wall_time'] = time.perf_counter() - start
+
+    with open(os.path.join(case_dir, 'result.json'), 'w') as f:
+        json.dump({'case': case, 'run': run_options, 'result': result}, f, indent=2)
+    return result
+
+
+def run_sweep(cases, run_options, output_dir, workers=None):
+    # run all cases on a process pool, returns the results in case order and writes summary.csv
+    os.makedirs(output_dir, exist_ok=True)
+    names = [case_name(index, case) for index, case in enumerate(cases)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_case, name, case, run_options, output_dir) for name, case in zip(names, cases)]
+        for name, future in zip(names, futures):
+            result = future.result()
+            print('{}: {}'.format(name, 'failed ({})'.format(result['error']) if 'error' in result else
+                                  'done in {:.1f} s'.format(result['wall_time'])))
+        results = [future.result() for future in futures]
+
+    with open(os.path.join(output_dir, 'summary.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(results)
+    return results
+
+
+def format_summary(results):
+    # plain text table of the sweep results
+    def cell(value):
+        if value is None:
+            return '-'
+        return '{:.4g}'.format(value) if isinstance(value, float) else str(value)
+
+    columns = [c for c in SUMMARY_COLUMNS if c != 'error' or any('error' in r for r in results)]
+    rows = [[cell(r.get(c)) for c in columns] for r in results]
+    widths = [max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(columns)]
+    lines = ['  '.join(c.ljust(w) for c, w in zip(columns, widths))]
+    lines += ['  '.join(v.ljust(w) for v, w in zip(row, widths)) for row in rows]
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='run a parameter sweep of jet expansion cases')
+    parser.add_argument('config', help='sweep config file (json)')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('-o', '--output', default=None, help='output directory (overrides the config)')
+    args = parser.parse_args(argv)
+
+    cases, run_options, output_dir, workers = load_config(args.config)
+    output_dir = args.output or output_dir
+    workers = args.workers or workers
+
+    print('running {} cases into {}'.format(len(cases), output_dir))
+    results = run_sweep(cases, run_options, output_dir, workers)
+    print(format_summary(results))
+
+
+if __name__ == "__main__":
+    main()
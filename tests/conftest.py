@@ -0,0 +1,27 @@
+import contextlib
+import io
+
+import pytest
+from src.sweep import CASE_DEFAULTS, build_jet_cluster
+
+
+@pytest.fixture(scope='session')
+def jet():
+    # the default jet case (see sweep.CASE_DEFAULTS) at N_fan = N_inlet = n, options go to GeometryCluster
+    def build(n, **options):
+        return build_jet_cluster(**dict(CASE_DEFAULTS, N_fan=n, N_inlet=n), **options)
+    return build
+
+
+@pytest.fixture(scope='session')
+def solve(jet):
+    # the jet case run to its end without printing, run_options go to GeometryCluster.run,
+    # observers are added before the run
+    def run(n, run_options=None, observers=(), **options):
+        gc = jet(n, **options)
+        for observer in observers:
+            gc.add_observer(observer)
+        with contextlib.redirect_stdout(io.StringIO()):
+            gc.run(**dict({'max_iter': 100000}, **(run_options or {})))
+        return gc
+    return run
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from src.characteristic import Characteristic, RayArrays
+from src.fluidPoint import FluidPoint
+
+
+def _random_characteristics(rng, n):
+    # supersonic points (prandtl-meyer angle 0.2 - 1 rad) with a random flow direction, one random family each
+    pm, fd = rng.uniform(0.2, 1.0, n), rng.uniform(-0.3, 0.3, n)
+    x, y = rng.uniform(0, 2, n), rng.uniform(0, 1, n)
+    return [Characteristic(FluidPoint((x[i], y[i]), pm[i] - fd[i], pm[i] + fd[i]), type=int(rng.choice([1, -1, 0])))
+            for i in range(n)]
+
+
+def _scalar_hits(char, others):
+    # `other * char` with the forward test of intersect_many: (position or None, flow distance from char.origin)
+    hits = []
+    for other in others:
+        point = other * char
+        if point is not None and (char.origin.flow_direction_dot_product(point) <= 0 or
+                                  other.origin.flow_direction_dot_product(point) <= 0):
+            point = None
+        hits.append((point, np.inf if point is None else char.origin.flow_direction_dot_product(point)))
+    return hits
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_batched_intersections_match_the_scalar_ones(seed):
+    rng = np.random.default_rng(seed)
+    chars = _random_characteristics(rng, 60)
+    rays = RayArrays(chars)
+    for char in chars[:20]:
+        positions, hit = char.intersect_many(rays)
+        _, any_hit = char.intersect_many(chars, forward=False)
+        hits = _scalar_hits(char, chars)
+        assert hit.tolist() == [point is not None for point, _ in hits]
+        assert any_hit.tolist() == [other * char is not None for other in chars]
+        expected = np.array([point.pos for point, _ in hits if point is not None]).reshape(-1, 2)
+        assert np.allclose(positions[hit], expected, rtol=1e-12, atol=1e-12)
+
+        point, other = char.first_intersection(rays)
+        distance = [d for _, d in hits]
+        if np.isfinite(min(distance)):
+            assert other is chars[int(np.argmin(distance))]
+            assert point.pos == hits[int(np.argmin(distance))][0].pos
+        else:
+            assert point is None and other is None
+
+
+def test_parallel_and_backward_rays_do_not_intersect():
+    # mach 2.5 flow at 0.1 rad, gamma+ rays point at 0.51 rad and gamma- rays at -0.31 rad
+    state = {'v_plus': 0.5, 'v_minus': 0.7}
+    char = Characteristic(FluidPoint((0.0, 1.0), **state), type=-1)
+    parallel = Characteristic(FluidPoint((0.0, 0.5), **state), type=-1)
+    past = Characteristic(FluidPoint((2.0, 1.0), **state), type=1)  # the lines cross behind past.origin
+    behind = Characteristic(FluidPoint((-2.0, 0.0), **state), type=1)  # ... and behind char.origin
+    crossing = Characteristic(FluidPoint((0.0, 0.0), **state), type=1)
+
+    others = [parallel, past, behind, crossing]
+    _, forward = char.intersect_many(others)
+    _, lines = char.intersect_many(others, forward=False)
+    assert forward.tolist() == [False, False, False, True]
+    assert lines.tolist() == [False, True, True, True]
+    point, other = char.first_intersection(others)
+    assert other is crossing and np.allclose(point.pos, (crossing * char).pos)
+    # only rays pointing counter-clockwise of char hit it (see characteristic.DET_TOL)
+    assert char * crossing is None and not crossing.intersect_many([char])[1].any()
+
+    # the same ray with itself, or only rays it never meets ahead
+    assert char.first_intersection([char]) == (None, None)
+    assert char.first_intersection([parallel, past, behind]) == (None, None)
+    assert char.first_intersection([]) == (None, None)
@@ -0,0 +1,44 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+from src.cluster import GeometryCluster
+from src.metrics import MetricsTable
+
+
+def test_shock_points_are_recorded_once(solve):
+    table = MetricsTable()
+    gc = solve(20, {'first_shock_only': False}, observers=[table])
+    assert len(gc.shock_points) > 1
+    assert len({id(p) for p in gc.shock_points}) == len(gc.shock_points)
+    assert table.totals()['shocks'] == len(gc.shock_points)
+
+
+@pytest.mark.parametrize('options, run_options', [({}, {}), ({'advance_mode': 'neighbor'}, {}), ({'tolerance': 0.02}, {}),
+                                                  ({'storage': 'full'}, {}), ({'storage': 'compact'}, {}),
+                                                  ({'engine': 'lattice'}, {}), ({}, {'first_shock_only': False})],
+                         ids=['global', 'neighbor', 'adaptive', 'streaming', 'compact', 'lattice', 'past_shocks'])
+@pytest.mark.parametrize('stop', [1, 37, -5], ids=['1', '37', 'end-5'])
+def test_resume_reproduces_an_uninterrupted_run(jet, solve, tmp_path, options, run_options, stop):
+    # stop < 0 counts back from the end of the uninterrupted run
+    if 'storage' in options:
+        options = dict(options, archive_dir=str(tmp_path / 'reference'))
+    reference = solve(10, run_options, **options)
+    stop = stop % reference.iter
+
+    if 'storage' in options:
+        options = dict(options, archive_dir=str(tmp_path / 'resumed'))
+    gc = jet(10, **options)
+    path = str(tmp_path / 'checkpoint.npz')
+    with contextlib.redirect_stdout(io.StringIO()):
+        gc.run(max_iter=stop, checkpoint_path=path, checkpoint_interval=stop, **run_options)
+        gc = GeometryCluster.resume(path)
+        assert gc.iter == stop
+        gc.run(max_iter=100000, **run_options)
+
+    assert gc.iter == reference.iter
+    assert [p.pos for p in gc.shock_points] == [p.pos for p in reference.shock_points]
+    assert gc.shock_location == reference.shock_location
+    for name in ('index', 'x', 'y', 'v_plus', 'v_minus'):
+        assert np.array_equal(gc.field(name), reference.field(name), equal_nan=True), name
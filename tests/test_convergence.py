@@ -0,0 +1,29 @@
+import pytest
+from src.convergence import analyse, format_report, observed_order
+
+EXACT = 1.5
+
+
+def _levels(ladder, order=2.0):
+    # synthetic outputs exact + h^order with h = 1 / n
+    return [{'n': n, 'iterations': 0, 'points': 0, 'wall_time': 0.0, 'memory_peak': 0,
+             'outputs': {'value': EXACT + (1 / n)**order}} for n in ladder]
+
+
+@pytest.mark.parametrize('ladder', [(10, 20, 40), (10, 20, 50), (10, 15, 40), (8, 20, 30)])
+def test_observed_order_recovers_h2_on_unequal_ladders(ladder):
+    values = [EXACT + (1 / n)**2 for n in ladder]
+    assert observed_order(*values, ladder[1] / ladder[0], ladder[2] / ladder[1]) == pytest.approx(2.0, rel=1e-8)
+    report, _ = analyse(_levels(ladder))
+    assert report['value']['extrapolated'] == pytest.approx(EXACT, rel=1e-10)
+
+
+def test_diverging_order_is_reported():
+    ladder = (10, 20, 25)
+    values = [EXACT + (1 / n)**2 for n in ladder]
+    with pytest.raises(RuntimeError):
+        observed_order(*values, ladder[1] / ladder[0], ladder[2] / ladder[1])
+    report, _ = analyse(_levels(ladder))
+    assert report['value']['order'] is None and report['value']['note']
+    study = {'levels': _levels(ladder), 'report': report, 'recommended': None, 'tolerance': 1e-3}
+    assert 'value: observed order' in format_report(study)
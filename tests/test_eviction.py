@@ -0,0 +1,36 @@
+import numpy as np
+from src.characteristic import RayArrays
+from src.spatial import unreachable_segments
+
+
+def test_unreachable_segments_are_never_hit():
+    rng = np.random.default_rng(3)
+    n_rays, n_segments = 200, 4000
+    direction = rng.uniform(-1.0, 1.0, n_rays)
+    flow = direction + rng.uniform(-0.5, 0.5, n_rays)
+    rays = RayArrays._from_columns(range(n_rays), [rng.uniform(1, 2, n_rays), rng.uniform(0, 2, n_rays), direction,
+                                                   np.cos(flow), np.sin(flow)])
+    x0, y0 = rng.uniform(-2, 3, n_segments), rng.uniform(-1, 3, n_segments)
+    angle, length = rng.uniform(-1.2, 1.2, n_segments), rng.uniform(0.01, 0.3, n_segments)
+    x1, y1 = x0 + length * np.cos(angle), y0 + length * np.sin(angle)
+    out = unreachable_segments(rays, x0, y0, x1, y1, 0.1)
+    assert 0 < out.sum() < n_segments
+
+    # hits on the segments (0 < s < length) forward of the ray origins in their flow direction
+    dx, dy = np.cos(direction)[:, None], np.sin(direction)[:, None]
+    sx, sy = np.cos(angle)[None, :], np.sin(angle)[None, :]
+    rx, ry = x0[None, :] - rays.x[:, None], y0[None, :] - rays.y[:, None]
+    det = sx * dy - dx * sy
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (sx * ry - sy * rx) / det
+        s = (dx * ry - dy * rx) / det
+    forward = t * (dx * rays.cos_flow[:, None] + dy * rays.sin_flow[:, None]) > 0
+    hit = (det != 0) & (s > 0) & (s < length[None, :]) & forward
+    assert not np.any(hit[:, out])
+
+
+def test_eviction_leaves_the_net_unchanged(solve):
+    gc, reference = solve(20, eviction=True), solve(20, eviction=False)
+    assert np.count_nonzero(gc._dead_index.active) < 0.2 * len(reference._dead_index.ids)
+    for name in ('x', 'y', 'v_plus', 'v_minus'):
+        assert np.array_equal(getattr(gc.points, name), getattr(reference.points, name), equal_nan=True), name
@@ -0,0 +1,110 @@
+import json
+import re
+
+import numpy as np
+import pytest
+from src.archive import FLOW_FIELDS, POINT_COLUMNS
+from src.export import NpzExporter, VtkExporter, load_npz
+from src.store import NO_INDEX
+
+ROUNDING = 2.0**-24  # relative rounding error of the float32 archive read back by field() in compact storage
+# (rtol, atol) of the fields derived from float32 invariants, see archive.ARCHIVE_PRECISIONS: angles within
+# 1.2e-7 rad per invariant, mach number and pressures within 1e-6 relative
+ANGLES = ('v_plus', 'v_minus', 'prandtl_meyer_angle', 'flow_direction', 'mach_angle', 'gamma_plus_direction',
+          'gamma_minus_direction')
+COMPACT_TOLERANCES = dict({name: (0.0, 2.4e-7) for name in ANGLES},
+                          **{name: (1e-6, 0.0) for name in ('mach_number', 'pressure_over_total_pressure', 'pressure')})
+EXPORT_INTERVAL = 10
+
+
+def _read_vtp(path):
+    # {name: array} of the DataArrays of a polydata part written by export.write_vtp
+    with open(path, 'rb') as f:
+        content = f.read()
+    header, data = content.split(b'<AppendedData encoding="raw">\n_', 1)
+    arrays = {}
+    for kind, name, offset in re.findall(rb'<DataArray type="(\w+)" (?:Name="(\w+)"|NumberOfComponents="3") '
+                                         rb'format="appended" offset="(\d+)"/>', header):
+        offset = int(offset)
+        size = int(np.frombuffer(data[offset:offset + 8], dtype='<u8')[0])
+        array = np.frombuffer(data[offset + 8:offset + 8 + size], dtype=np.dtype(kind.decode().lower()).newbyteorder('<'))
+        arrays[name.decode() or 'points'] = array
+    arrays['points'] = arrays['points'].reshape(-1, 3)
+    return arrays
+
+
+@pytest.fixture(scope='module', params=['resident', 'compact', 'lattice'])
+def exported(request, solve, tmp_path_factory):
+    directory = tmp_path_factory.mktemp(request.param)
+    options = {'resident': {}, 'compact': {'storage': 'compact', 'archive_dir': str(directory / 'archive')},
+               'lattice': {'engine': 'lattice'}}[request.param]
+    exporters = [NpzExporter(str(directory / 'npz')), VtkExporter(str(directory / 'vtk'))]
+    gc = solve(20, {'exporters': exporters, 'export_interval': EXPORT_INTERVAL}, **options)
+    return request.param, gc, directory, exporters
+
+
+def _dead_segments(gc):
+    # columns of the dead segments by store row, read back from the archive in streaming mode
+    chunks = list(gc.dead_segment_chunks())
+    order = np.argsort(np.concatenate([chunk['index'] for chunk in chunks]))
+    return {name: np.concatenate([chunk[name] for chunk in chunks])[order]
+            for name in ('index', 'origin', 'end', 'type', 'x0', 'y0', 'x1', 'y1')}
+
+
+def _assert_columns(columns, gc, mode):
+    # the export holds every point store row, field() the dead and frontline points: the points that left the front
+    # through a dead characteristic intersection (and those of the iteration that stopped the march) are only exported
+    index, rows = np.unique(gc.field('index'), return_index=True)
+    exported = np.isin(columns['index'], index)
+    assert np.array_equal(np.unique(columns['index'][exported]), index)
+    at = np.searchsorted(index, columns['index'][exported])
+    for name in [name for name in POINT_COLUMNS if name != 'index'] + list(FLOW_FIELDS):
+        values, expected = columns[name][exported], gc.field(name)[rows][at]
+        rtol, atol = COMPACT_TOLERANCES.get(name, (ROUNDING, 0.0)) if mode == 'compact' else (0.0, 0.0)
+        assert np.allclose(values, expected, rtol=rtol, atol=atol, equal_nan=True), name
+
+
+def test_npz_export_round_trips_against_the_fields(exported):
+    mode, gc, directory, _ = exported
+    net = load_npz(str(directory / 'npz'))
+    assert np.array_equal(net['index'], np.arange(len(gc.points)))
+    _assert_columns(net, gc, mode)
+    assert np.array_equal(net['segment_index'], np.arange(len(gc.characteristics)))
+    segments = _dead_segments(gc)
+    for name in ('origin', 'end', 'type'):
+        assert np.array_equal(net[name][segments['index']], segments[name]), name
+
+
+def test_vtk_export_round_trips_against_the_fields(exported):
+    mode, gc, directory, exporters = exported
+    vtm = (directory / 'vtk' / 'net.vtm').read_text()
+    parts = [_read_vtp(directory / 'vtk' / name) for name in re.findall(r'file="([^"]+)"', vtm)]
+    assert len(parts) == exporters[1].parts
+    columns = {name: np.concatenate([part[name] for part in parts]) for name in parts[0] if name != 'points'}
+    points = np.concatenate([part['points'] for part in parts])
+    columns['x'], columns['y'] = points[:, 0], points[:, 1]
+    _assert_columns(columns, gc, mode)
+
+    # every segment with an end point is one line from its origin to its end
+    segments = _dead_segments(gc)
+    ends = segments['end'] != NO_INDEX
+    assert np.isin(segments['index'][ends], columns['segment_index']).all()
+    assert not np.isin(segments['index'][~ends], columns['segment_index']).any()
+    lines = np.concatenate([part['points'][part['connectivity'].reshape(-1, 2), :2].reshape(-1, 4) for part in parts])
+    exported = np.isin(columns['segment_index'], segments['index'])
+    at = np.searchsorted(segments['index'], columns['segment_index'][exported])
+    expected = np.column_stack([segments[name][at] for name in ('x0', 'y0', 'x1', 'y1')])
+    assert np.allclose(lines[exported], expected, rtol=ROUNDING if mode == 'compact' else 0.0, atol=0)
+
+
+def test_export_interval_takes_effect(exported):
+    mode, gc, directory, exporters = exported
+    with open(directory / 'npz' / 'net.json') as f:
+        index = json.load(f)
+    assert index['iter'] == gc.iter
+    if mode == 'lattice':
+        # the exports due during the lattice phase are written once at the handover
+        assert 1 < index['parts'] < gc.iter // EXPORT_INTERVAL + 1
+    else:
+        assert index['parts'] == gc.iter // EXPORT_INTERVAL + (gc.iter % EXPORT_INTERVAL != 0)
+    assert [exporter.parts for exporter in exporters] == [index['parts']] * 2
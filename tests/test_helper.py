@@ -0,0 +1,31 @@
+import math
+
+import numpy as np
+import pytest
+from src.helper import (PM_ROUNDOFF, PM_TABLE_MACH_MAX, PM_TOL, _pm_of_beta, _pm_of_beta_derivative,
+                        mach_from_prandtl_meyer, prandtl_meyer_max)
+
+
+@pytest.mark.parametrize('gamma', [1.05, 1.1, 1.3, 1.4, 5/3, 3.0])
+def test_inverse_prandtl_meyer_within_documented_error_bound(gamma):
+    # from M = 1 (the first table node) past the last node at PM_TABLE_MACH_MAX, where newton carries on alone
+    mach = np.concatenate([1 + np.logspace(-10, 0, 300), np.linspace(2, PM_TABLE_MACH_MAX, 2000),
+                           np.logspace(2, 4, 50)])
+    alpha = math.sqrt((gamma + 1) / (gamma - 1))
+    beta = np.sqrt(mach**2 - 1)
+    pm = _pm_of_beta(beta, alpha)
+
+    # |dM| <= PM_TOL * max(1, M), or near the limit the error of a round-off residual of nu, relative to M
+    bound = np.maximum(PM_TOL, PM_ROUNDOFF * pm / _pm_of_beta_derivative(beta, alpha) * beta / mach**2)
+    vectorized = mach_from_prandtl_meyer(pm, gamma)
+    scalar = np.array([mach_from_prandtl_meyer(v, gamma) for v in pm])
+    assert np.all(np.abs(vectorized - mach) <= bound * mach)
+    assert np.all(np.abs(scalar - mach) <= bound * mach)
+
+
+def test_inverse_prandtl_meyer_limits_and_nan():
+    nu_max = prandtl_meyer_max(1.4)
+    values = np.array([-0.1, 0.0, nu_max, np.nan])
+    expected = [1.0, 1.0, np.inf, np.nan]
+    assert np.array_equal(mach_from_prandtl_meyer(values, 1.4), expected, equal_nan=True)
+    assert np.array_equal([mach_from_prandtl_meyer(v, 1.4) for v in values], expected, equal_nan=True)
@@ -0,0 +1,21 @@
+import numpy as np
+from src.characteristic import Characteristic, RayArrays
+
+
+def test_lattice_reproduces_the_geometric_engine(solve):
+    gc, reference = solve(30, engine='lattice'), solve(30, engine='geometric')
+    assert gc.iter == reference.iter
+    for name in ('x', 'y', 'v_plus', 'v_minus', 'boundary'):
+        assert np.array_equal(getattr(gc.points, name), getattr(reference.points, name), equal_nan=True), name
+    assert np.array_equal(gc.characteristics.direction, reference.characteristics.direction)
+
+
+def test_batched_dead_search_matches_first_intersection(solve):
+    gc = solve(20, {'max_iter': 60}, eviction=False)
+    grid = gc._dead_index
+    chars = [Characteristic(gc.points.object(i), type=t) for i in range(len(gc.points)) for t in (1, -1, 0)]
+    chars = [char for char in chars if char.origin.v_plus is not None]
+    first = grid.first_intersections(RayArrays(chars), [char.origin.store_index for char in chars])
+    expected = [grid.first_intersection(char) for char in chars]
+    assert np.count_nonzero(first >= 0) > len(chars) // 2
+    assert first.tolist() == [-1 if index is None else index for index in expected]
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from src.characteristic import nearest_intersections
+from src.cluster import GeometryCluster
+
+
+@pytest.mark.parametrize('window', [1, 4])
+def test_neighbor_search_matches_the_global_search(solve, monkeypatch, window):
+    # every row of every iteration, the local result or its global fallback
+    search = GeometryCluster.find_neighbor_intersections
+    mismatches = []
+
+    def checked(gc):
+        first_index = search(gc)
+        expected, _ = nearest_intersections(gc._frontline_rays, gc._frontline_rays)
+        mismatches.append(np.count_nonzero(first_index != expected))
+        return first_index
+
+    monkeypatch.setattr(GeometryCluster, 'find_neighbor_intersections', checked)
+    solve(30, advance_mode='neighbor', neighbor_window=window)
+    assert len(mismatches) > 0 and sum(mismatches) == 0
+
+
+def test_neighbor_net_matches_global(solve):
+    # above N = 20, where a wrongly accepted local result changes the net and the first shock
+    gc, reference = solve(40, advance_mode='neighbor'), solve(40, advance_mode='global')
+    assert gc.iter == reference.iter
+    assert gc.shock_location == reference.shock_location
+    for name in ('index', 'x', 'y', 'v_plus', 'v_minus', 'boundary'):
+        assert np.array_equal(gc.field(name), reference.field(name), equal_nan=True), name
@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+import src.parallel
+
+
+@pytest.mark.parametrize('advance_mode', ['global', 'neighbor'])
+def test_parallel_search_matches_serial(solve, monkeypatch, advance_mode):
+    reference = solve(10, advance_mode=advance_mode)
+
+    # shard every search, not only those of large fronts
+    monkeypatch.setattr(src.parallel, 'PARALLEL_MIN_PAIRS', 1)
+    shared = []
+    share = src.parallel.IntersectionPool._share
+    monkeypatch.setattr(src.parallel.IntersectionPool, '_share', lambda pool, rays: shared.append(share(pool, rays)))
+    gc = solve(10, {'intersection_workers': 2}, advance_mode=advance_mode)
+
+    assert len(shared) > 0
+    assert gc.iter == reference.iter
+    for name in ('x', 'y', 'v_plus', 'v_minus', 'boundary'):
+        assert np.array_equal(getattr(gc.points, name), getattr(reference.points, name), equal_nan=True), name
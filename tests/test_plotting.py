@@ -0,0 +1,55 @@
+import contextlib
+import io
+import time
+
+import numpy as np
+import pytest
+from src.plotting import SnapshotPlotter
+
+RENDER_SECONDS = 1.0
+
+
+def _save_segments(snapshot, path):
+    np.savez(path, **snapshot['segments'])
+
+
+def _slow_render(snapshot, path):
+    time.sleep(RENDER_SECONDS)
+    _save_segments(snapshot, path)
+
+
+@pytest.mark.parametrize('streaming', [False, True], ids=['resident', 'streaming'])
+def test_incremental_snapshots_render_the_whole_net(jet, tmp_path, streaming):
+    options = {'archive_dir': str(tmp_path / 'archive')} if streaming else {}
+    gc = jet(10, **options)
+    expected = []
+    with SnapshotPlotter() as plotter, contextlib.redirect_stdout(io.StringIO()):
+        for k in (5, 20, 21, 60, 100000):
+            gc.run(max_iter=k)
+            snapshot = gc.geometry_snapshot(start=plotter.segments)
+            assert len(snapshot['segments']['x0']) == gc.dead_segment_count - snapshot['start']
+            plotter.submit(_save_segments, snapshot, str(tmp_path / '{}.npz'.format(k)))
+            expected.append((k, gc.geometry_snapshot()['segments']))
+    for k, segments in expected:
+        with np.load(tmp_path / '{}.npz'.format(k)) as rendered:
+            for name, column in segments.items():
+                assert np.array_equal(rendered[name], column, equal_nan=True), (k, name)
+
+
+def test_submit_does_not_wait_for_the_render(solve, tmp_path):
+    gc = solve(10, {'max_iter': 20})
+    with SnapshotPlotter(queue_size=2) as plotter:
+        start = time.perf_counter()
+        for k in range(2):
+            plotter.submit(_slow_render, gc.geometry_snapshot(start=plotter.segments), str(tmp_path / '{}.npz'.format(k)))
+        assert time.perf_counter() - start < RENDER_SECONDS / 2
+    assert (tmp_path / '1.npz').exists()
+
+
+def test_contours_of_a_run_past_shocks(solve, tmp_path):
+    # shock points carry nan invariants, the contours are drawn over the solved points around them
+    gc = solve(10, {'first_shock_only': False}, output_dir=str(tmp_path))
+    assert len(gc.shock_points) > 1 and np.isnan(gc.field('mach_number')).any()
+    for name in ('mach_number', 'pressure'):
+        gc.plot_contours(name, save=True)
+        assert (tmp_path / '{}_{}.svg'.format(name, gc.iter)).exists()
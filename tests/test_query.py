@@ -0,0 +1,70 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+from src.query import FieldQuery
+
+
+@pytest.fixture(scope='module')
+def nets(solve):
+    return {'first_shock': solve(20), 'past_shocks': solve(10, {'first_shock_only': False})}
+
+
+@pytest.mark.parametrize('net', ['first_shock', 'past_shocks'])
+def test_query_at_the_net_points(nets, net):
+    gc = nets[net]
+    query = gc.query()
+    x, y, mach = gc.field('x'), gc.field('y'), gc.field('mach_number')
+    solved = np.isfinite(mach)
+    assert np.array_equal(np.sort(query.index), np.unique(gc.field('index')[solved]))
+    # the rays of the expansion fan all start at the lip, the fan is left out (one location, many states)
+    _, first, count = np.unique(np.column_stack((x, y))[solved], axis=0, return_index=True, return_counts=True)
+    rows = np.flatnonzero(solved)[first[count == 1]]
+    assert len(rows) > 0.9 * solved.sum()
+    values = query(x[rows], y[rows], ['mach_number', 'x', 'y'])
+    assert np.allclose(values['mach_number'], mach[rows], rtol=1e-9, atol=0)
+    assert np.allclose(values['x'], x[rows]) and np.allclose(values['y'], y[rows])
+
+
+def test_query_reproduces_linear_fields_and_is_nan_outside(nets):
+    gc = nets['first_shock']
+    query = gc.query()
+    rng = np.random.default_rng(0)
+    x, y = rng.uniform(0, gc.reach, 2000), rng.uniform(0, 1, 2000)
+    values = query(x, y, ['x', 'y'])
+    inside = np.isfinite(values['x'])
+    assert inside.sum() > 500
+    assert np.allclose(values['x'][inside], x[inside]) and np.allclose(values['y'][inside], y[inside])
+
+    outside = query([-1.0, 1.0, gc.reach + 1.0], [0.2, 10.0, 0.2])
+    assert all(np.isnan(values).all() for values in outside.values())
+    grid = query.grid(np.linspace(0, gc.reach, 7), np.linspace(0, 0.4, 5), ['pressure'])
+    assert grid['pressure'].shape == (5, 7)
+
+
+def test_query_past_shocks_has_no_nan_holes(nets):
+    gc = nets['past_shocks']
+    query = gc.query()
+    shocks = np.array([p.pos for p in gc.shock_points])
+    assert len(shocks) > 1 and np.isnan(gc.field('v_plus')).sum() == len(shocks)
+    # shock points are not triangulated, inside the solved net every location (a shock point too) gets finite
+    # values interpolated between solved points, only locations outside it are nan
+    rng = np.random.default_rng(1)
+    x = np.concatenate((shocks[:, 0], rng.uniform(0, gc.reach, 2000)))
+    y = np.concatenate((shocks[:, 1], rng.uniform(0, 1, 2000)))
+    inside = query._tri.find_simplex(np.column_stack((x, y))) >= 0
+    assert inside[:len(shocks)].any() and inside.sum() > 500
+    for name, values in query(x, y, ['mach_number', 'pressure']).items():
+        assert np.array_equal(np.isfinite(values), inside), name
+
+
+def test_query_follows_the_cluster(jet):
+    gc = jet(10)
+    with contextlib.redirect_stdout(io.StringIO()):
+        gc.run(max_iter=20)
+        query = gc.query()
+        size = len(query)
+        gc.run(max_iter=100000)
+    assert gc.query() is query and len(query) > size
+    assert np.array_equal(np.sort(query.index), np.sort(FieldQuery(gc).index))
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+N = 30
+ROUNDING = 2.0**-24  # relative rounding error of float32 (see archive.ARCHIVE_PRECISIONS)
+
+
+@pytest.fixture(scope='module')
+def nets(solve, tmp_path_factory):
+    return {storage: solve(N, archive_dir=str(tmp_path_factory.mktemp(storage)), storage=storage)
+            for storage in ('full', 'compact')}
+
+
+def test_compact_storage_leaves_the_march_unchanged(nets):
+    full, compact = nets['full'], nets['compact']
+    assert compact.iter == full.iter
+    assert len(compact.points) == len(full.points)
+    assert sorted(p.pos for p in compact.frontline_points) == sorted(p.pos for p in full.frontline_points)
+
+
+def test_compact_archive_within_documented_error_bounds(nets):
+    full, compact = nets['full'], nets['compact']
+    assert np.array_equal(compact.field('index'), full.field('index'))
+    for name in ('x', 'y', 'v_plus', 'v_minus'):
+        expected, values = full.field(name), compact.field(name)
+        finite = np.isfinite(expected)
+        assert np.array_equal(finite, np.isfinite(values)), name
+        assert np.all(np.abs(values - expected)[finite] <= ROUNDING * np.abs(expected[finite])), name
+
+    # mach number below 1e-6 relative for 1.05 < M < 10, p / ptot by gamma M / (1 + (gamma - 1) / 2 M^2) |dM|
+    mach, compact_mach = full.field('mach_number'), compact.field('mach_number')
+    rows = (mach > 1.05) & (mach < 10)
+    assert rows.any()
+    mach, compact_mach, gamma = mach[rows], compact_mach[rows], full.field('gamma')[rows]
+    assert np.all(np.abs(compact_mach - mach) <= 1e-6 * mach)
+    ratio = full.field('pressure_over_total_pressure')[rows]
+    compact_ratio = compact.field('pressure_over_total_pressure')[rows]
+    sensitivity = gamma * mach / (1 + (gamma - 1) / 2 * mach**2)
+    assert np.all(np.abs(compact_ratio - ratio) <= sensitivity * 1e-6 * mach * ratio)
+
+
+def test_streaming_drops_archived_rows_from_the_stores(nets):
+    for gc in nets.values():
+        assert gc.points.resident < len(gc.points) / 2
+        assert gc.characteristics.resident < len(gc.characteristics) / 2
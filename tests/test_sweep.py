@@ -0,0 +1,47 @@
+import csv
+import json
+
+import pytest
+from src.sweep import RUN_DEFAULTS, load_config, main, run_case
+
+N = 8
+
+
+def _config(tmp_path, **config):
+    path = tmp_path / 'sweep.json'
+    path.write_text(json.dumps(dict({'defaults': {'N_fan': N, 'N_inlet': N}}, **config)))
+    return str(path)
+
+
+def test_sweep_cli_runs_the_cases(tmp_path, capsys):
+    path = _config(tmp_path, output_dir='out', grid={'Mach_inlet': [2.5, 3.0]}, cases=[{'pressure_ratio': 1.5}],
+                   run={'max_iter': 100000, 'plot_interval': 0, 'first_shock_only': False, 'contours': ['mach_number']})
+    main([path, '-j', '1'])
+    with open(tmp_path / 'out' / 'summary.csv') as f:
+        rows = list(csv.DictReader(f))
+    assert [(row['Mach_inlet'], row['pressure_ratio']) for row in rows] == [('2.5', '2.0'), ('3.0', '2.0'), ('2.5', '1.5')]
+    for row in rows:
+        assert not row['error'] and int(row['iterations']) > 0 and row['shock_x'], row
+        result = json.loads((tmp_path / 'out' / row['name'] / 'result.json').read_text())
+        assert result['result']['iterations'] == int(row['iterations'])
+        assert (tmp_path / 'out' / row['name'] / 'mach_number_{}.svg'.format(row['iterations'])).exists()
+    assert '3 cases' in capsys.readouterr().out
+
+
+def test_failing_contour_plot_keeps_the_solved_case(tmp_path):
+    case = dict(load_config(_config(tmp_path, cases=[{}]))[0][0])
+    run_options = dict(RUN_DEFAULTS, plot_interval=0, contours=['no_such_field', 'mach_number'])
+    result = run_case('case', case, run_options, str(tmp_path))
+    assert result['iterations'] > 0 and result['shock_x'] is not None
+    assert result['error'].startswith('no_such_field contours: ValueError')
+    assert (tmp_path / 'case' / 'mach_number_{}.svg'.format(result['iterations'])).exists()
+
+
+@pytest.mark.parametrize('config, message', [({'cases': [{}], 'run': {'bbox': [0, 0, 1, 1]}}, 'unknown run options'),
+                                             ({'cases': [{'mach': 2.0}]}, 'unknown case parameters'),
+                                             ({'cases': [{}], 'run': {'export': ['csv']}}, 'unknown export formats'),
+                                             ({'case': [{}]}, 'unknown sweep config keys'),
+                                             ({'grid': {}}, 'defines no cases')])
+def test_invalid_config_is_rejected(tmp_path, config, message):
+    with pytest.raises(ValueError, match=message):
+        load_config(_config(tmp_path, **config))